@@ -1,13 +1,212 @@
 # TODO: 1 - import the OpenAI class from the openai library
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
+import httpx
 import numpy as np
+import os
 import pandas as pd
 import re
 import csv
+import json
+import threading
+import time
 import uuid
 from datetime import datetime
 
 
+# OpenAI-compatible endpoint every agent calls; point it at api.openai.com or a
+# local server (vLLM, Ollama) through the OPENAI_BASE_URL environment variable
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
+
+# Connection pool shared by every agent call; idle connections stay open for reuse
+OPENAI_POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+
+# Admission control for every agent call, per model, so fanned-out workflows
+# stay under the account limits instead of piling into 429 retries. Requests
+# and tokens per minute are unlimited unless set (OPENAI_RPM, OPENAI_TPM).
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TPM", "0"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+# Seconds to first response byte above which the concurrency limit backs off;
+# 0 adapts to 429 responses only (OPENAI_LATENCY_TARGET)
+OPENAI_LATENCY_TARGET = float(os.getenv("OPENAI_LATENCY_TARGET", "0"))
+# Tokens charged for a request whose body cannot be read up front (streamed
+# or multipart uploads)
+UNREAD_REQUEST_TOKENS = 1000
+
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute, plus an AIMD limit on
+    requests in flight: it grows by one per limit's worth of successful
+    requests and halves on a 429 response, or on a response slower than
+    latency_target seconds when one is set (at most once per second).
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_concurrency=16,
+                 latency_target=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.queue_wait = 0.0  # total seconds requests waited for admission
+        # Budgets may go negative: later callers wait until they are paid back
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, tokens):
+        """Block until a request of about `tokens` tokens may be sent"""
+        start = time.monotonic()
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < max(1, int(self.concurrency)))
+            self.in_flight += 1
+            now = time.monotonic()
+            elapsed_minutes = (now - self._updated) / 60
+            self._updated = now
+            wait = 0.0
+            if self.requests_per_minute:
+                self._requests = min(self.requests_per_minute,
+                                     self._requests + elapsed_minutes * self.requests_per_minute) - 1
+                wait = max(wait, -self._requests * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                self._tokens = min(self.tokens_per_minute,
+                                   self._tokens + elapsed_minutes * self.tokens_per_minute) - tokens
+                wait = max(wait, -self._tokens * 60 / self.tokens_per_minute)
+        if wait:
+            time.sleep(wait)
+        with self._condition:
+            self.admitted += 1
+            self.queue_wait += time.monotonic() - start
+
+    def release(self, rate_limited=False, latency=None):
+        """Free a slot; a request that failed before responding (latency None)
+        leaves the concurrency limit as it is"""
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if rate_limited:
+                self.rate_limited += 1
+            slow = bool(self.latency_target) and latency is not None and latency > self.latency_target
+            if rate_limited or slow:
+                if now - self._last_decrease >= 1.0:
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self._last_decrease = now
+            elif latency is not None:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "admitted": self.admitted,
+                "rate_limited": self.rate_limited,
+                "queue_wait_total": self.queue_wait,
+                "queue_wait_mean": self.queue_wait / self.admitted if self.admitted else 0.0,
+                "concurrency_limit": max(1, int(self.concurrency)),
+            }
+
+
+_rate_limiters = {}
+
+
+def get_rate_limiter(model):
+    """Return the process-wide rate limiter for a model, creating it on first use"""
+    with _openai_clients_lock:
+        if model not in _rate_limiters:
+            _rate_limiters[model] = RateLimiter(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE,
+                                                OPENAI_MAX_CONCURRENCY, OPENAI_LATENCY_TARGET)
+        return _rate_limiters[model]
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees its rate limiter slot once it is closed"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._release is not None:
+                release, self._release = self._release, None
+                release()
+
+
+class RateLimitedTransport(httpx.HTTPTransport):
+    """HTTP transport admitting each API request through its model's rate limiter.
+    The slot is held until the response body is read and closed, so streamed
+    completions count as in flight for as long as they stream."""
+
+    def handle_request(self, request):
+        try:
+            body = request.content
+        except httpx.RequestNotRead:
+            # Streamed or multipart body: unknown model and size
+            body = None
+        model = "default"
+        if body is not None:
+            try:
+                model = json.loads(body).get("model", "default")
+            except (ValueError, AttributeError):
+                pass
+        limiter = get_rate_limiter(model)
+        # Roughly four characters of request body per prompt token
+        limiter.acquire(len(body) // 4 if body is not None else UNREAD_REQUEST_TOKENS)
+        started = time.monotonic()
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            limiter.release()
+            raise
+        # Time to the response headers; the body may stream for much longer
+        latency = time.monotonic() - started
+        rate_limited = response.status_code == 429
+        if response.is_closed:
+            # Body already loaded in memory; nothing left to hold the slot for
+            limiter.release(rate_limited, latency)
+            return response
+        response.stream = _ReleasingStream(response.stream, lambda: limiter.release(rate_limited, latency))
+        return response
+
+
+def get_openai_client(openai_api_key, base_url=None):
+    """Return the process-wide OpenAI client for this key, creating it on first use.
+    Reusing one client keeps its HTTP connections alive between calls.
+    base_url defaults to OPENAI_BASE_URL."""
+    base_url = base_url or OPENAI_BASE_URL
+    key = (openai_api_key, base_url)
+    with _openai_clients_lock:
+        if key not in _openai_clients:
+            try:
+                import h2  # noqa: F401  (HTTP/2 needs the optional h2 package)
+                http2 = True
+            except ImportError:
+                http2 = False
+            _openai_clients[key] = OpenAI(
+                base_url=base_url,
+                api_key=openai_api_key,
+                http_client=DefaultHttpxClient(
+                    transport=RateLimitedTransport(limits=OPENAI_POOL_LIMITS, http2=http2),
+                ),
+            )
+        return _openai_clients[key]
+
+
 # DirectPromptAgent class definition
 class DirectPromptAgent:
     """
@@ -21,7 +220,7 @@ class DirectPromptAgent:
 
     def respond(self, prompt):
         # Generate a response using the OpenAI API
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
         response = client.chat.completions.create(
             # TODO: 3 - Specify the model to use (gpt-3.5-turbo)
             model="gpt-3.5-turbo",
@@ -49,7 +248,7 @@ class AugmentedPromptAgent:
 
     def respond(self, input_text):
         """Generate a response using OpenAI API."""
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
 
         # TODO: 2 - Declare a variable 'response' that calls OpenAI's API for a chat completion.
         response = client.chat.completions.create(
@@ -81,7 +280,7 @@ class KnowledgeAugmentedPromptAgent:
 
     def respond(self, input_text):
         """Generate a response using the OpenAI API."""
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
 
         # TODO: 2 - Construct a system message including:
         #           - The persona with the following instruction:
@@ -142,7 +341,7 @@ class RAGKnowledgePromptAgent:
         Returns:
         list: The embedding vector.
         """
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
         response = client.embeddings.create(
             model="text-embedding-3-large",
             input=text,
@@ -235,7 +434,7 @@ class RAGKnowledgePromptAgent:
 
         best_chunk = df.loc[df['similarity'].idxmax(), 'text']
 
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
@@ -264,7 +463,7 @@ class EvaluationAgent:
     def evaluate(self, initial_prompt):
         # This method manages interactions between agents to achieve a solution.
         # Iteratively gets a response from the worker agent, evaluates it, and refines if needed
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
         prompt_to_evaluate = initial_prompt
 
         for i in range(self.max_interactions): # TODO: 2 - Set loop to iterate up to the maximum number of interactions:
@@ -342,7 +541,7 @@ class RoutingAgent():
         self.agents = agents if agents is not None else []
 
     def get_embedding(self, text):
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
         # TODO: 2 - Write code to calculate the embedding of the text using the text-embedding-3-large model
         response = client.embeddings.create(
             model="text-embedding-3-large",
@@ -406,7 +605,7 @@ class ActionPlanningAgent:
     def extract_steps_from_prompt(self, prompt):
 
         # TODO: 2 - Instantiate the OpenAI client using the provided API key
-        client = OpenAI(base_url="https://openai.vocareum.com/v1", api_key=self.openai_api_key)
+        client = get_openai_client(self.openai_api_key)
 
         # TODO: 3 - Call the OpenAI API to get a response from the "gpt-3.5-turbo" model.
         # Provide the following system prompt along with the user's prompt:
@@ -0,0 +1,47 @@
+"""
+Agent graph throughput with the offline StubBackend: no network, no spend.
+
+Every run makes the model call a tool, executes it and writes the final
+answer, so it measures the framework's own cost per LLM/tool loop. Run
+from 3-building-agents/project:
+
+    python -m benchmarks.agent_throughput [runs] [concurrency]
+"""
+import sys
+import time
+
+from lib.agents import Agent
+from lib.backends import StubBackend
+from lib.tooling import tool
+
+
+@tool
+def search_games(query: str, limit: int = 5) -> str:
+    """Search the game catalogue"""
+    return f"{limit} games matching {query}"
+
+
+def main(runs: int = 1000, concurrency: int = 8):
+    agent = Agent(
+        model_name="gpt-4o-mini",
+        instructions="You answer questions about video games.",
+        tools=[search_games],
+        backend=StubBackend(),
+    )
+    states = [agent._initial_state(f"Which Zelda game is best? ({i})", f"session-{i}") for i in range(runs)]
+
+    start = time.perf_counter()
+    for state in states:
+        agent.workflow.run(state)
+    elapsed = time.perf_counter() - start
+    print(f"Sequential             {runs / elapsed:8.0f} runs/s ({elapsed / runs * 1000:.3f} ms per run)")
+
+    start = time.perf_counter()
+    for _ in agent.workflow.run_many(states, concurrency=concurrency):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"run_many x{concurrency:<3}          {runs / elapsed:8.0f} runs/s")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
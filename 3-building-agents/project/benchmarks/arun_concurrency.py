@@ -0,0 +1,57 @@
+"""
+Concurrent agent runs on one event loop with StateMachine.arun.
+
+Every run makes the model call a tool, executes it and writes the final
+answer with the offline StubBackend, whose `latency` stands in for the
+network round trip of each LLM call. Sequential runs wait out every call
+in turn; arun lets all runs wait together on one thread. CPU time per run
+is the framework's own cost, so 1 / (CPU time per run) is the number of
+runs one core sustains. Run from 3-building-agents/project:
+
+    python -m benchmarks.arun_concurrency [runs] [latency_ms]
+"""
+import asyncio
+import sys
+import time
+
+from lib.agents import Agent
+from lib.backends import StubBackend
+from lib.tooling import tool
+
+
+@tool
+def search_games(query: str, limit: int = 5) -> str:
+    """Search the game catalogue"""
+    return f"{limit} games matching {query}"
+
+
+def main(runs: int = 1000, latency_ms: int = 50):
+    agent = Agent(
+        model_name="gpt-4o-mini",
+        instructions="You answer questions about video games.",
+        tools=[search_games],
+        backend=StubBackend(latency=latency_ms / 1000),
+    )
+    states = [agent._initial_state(f"Which Zelda game is best? ({i})", f"session-{i}") for i in range(runs)]
+
+    # Sequential runs block on every call; a handful is enough to time them
+    sample = states[:max(1, min(runs, 20))]
+    start = time.perf_counter()
+    for state in sample:
+        agent.workflow.run(state)
+    elapsed = time.perf_counter() - start
+    print(f"Sequential run         {len(sample) / elapsed:8.1f} runs/s ({elapsed / len(sample) * 1000:.1f} ms per run)")
+
+    async def run_all():
+        return await asyncio.gather(*(agent.async_workflow.arun(state) for state in states))
+
+    start, cpu = time.perf_counter(), time.process_time()
+    results = asyncio.run(run_all())
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    assert all(result.get_final_state()["messages"][-1].content for result in results)
+    print(f"arun x{runs:<6}           {runs / elapsed:8.1f} runs/s ({elapsed:.2f} s wall, one thread)")
+    print(f"CPU per run            {cpu / runs * 1000:8.3f} ms ({runs / cpu:,.0f} runs per core-second)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
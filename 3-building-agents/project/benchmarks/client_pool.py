@@ -0,0 +1,84 @@
+"""
+Per-call overhead of a fresh OpenAI client vs the shared, pooled client.
+
+Starts a stub chat completions server on localhost and times N sequential
+calls each way. Run from 3-building-agents/project:
+
+    python -m benchmarks.client_pool [calls]
+
+A fresh client builds its own SSL context (loading the CA bundle) and opens
+a new connection. Against the real API the gap is larger still: every fresh
+client also pays DNS, a TLS handshake and TCP slow start, which localhost
+does not.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+from lib.clients import get_openai_client, reset_clients
+
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-stub",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "stub",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "ok"},
+        "finish_reason": "stop",
+    }],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def call(client: OpenAI):
+    client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}])
+
+
+def bench(label: str, make_client, calls: int) -> float:
+    call(make_client())  # warm up imports and the first connection
+    start = time.perf_counter()
+    for _ in range(calls):
+        call(make_client())
+    per_call = (time.perf_counter() - start) / calls
+    print(f"{label:<14} {per_call * 1000:8.3f} ms/call")
+    return per_call
+
+
+def main(calls: int = 500):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    try:
+        fresh = bench("fresh client", lambda: OpenAI(api_key="stub", base_url=base_url), calls)
+        shared = bench("shared client", lambda: get_openai_client("stub", base_url), calls)
+        print(f"saved          {(fresh - shared) * 1000:8.3f} ms/call ({fresh / shared:.1f}x)")
+    finally:
+        reset_clients()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
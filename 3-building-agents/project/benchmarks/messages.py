@@ -0,0 +1,115 @@
+"""
+Cost of constructing, serializing and deep-copying chat messages.
+
+Builds a conversation of system, user, assistant (with tool calls) and tool
+messages, converts it to the OpenAI wire format the way LLM._build_payload
+does, and deep-copies it the way ShortTermMemory stores runs. Each step is
+timed for lib.messages and for the pydantic models it replaced, kept below
+as the baseline. Run from 3-building-agents/project:
+
+    python -m benchmarks.messages [count]
+"""
+import copy
+import sys
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Literal, Optional
+
+from openai.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall
+from pydantic import BaseModel
+
+from lib import messages as current
+from lib.tooling import ToolCall
+
+
+# The pydantic messages lib.messages replaced, tool calls being openai's model
+
+class PydanticMessage(BaseModel):
+    role: str
+    content: Optional[str] = ""
+
+    def dict(self) -> Dict:
+        return dict(self)
+
+
+class PydanticSystemMessage(PydanticMessage):
+    role: Literal["system"] = "system"
+
+
+class PydanticUserMessage(PydanticMessage):
+    role: Literal["user"] = "user"
+
+
+class PydanticToolMessage(PydanticMessage):
+    role: Literal["tool"] = "tool"
+    tool_call_id: str
+    name: str
+    content: str = ""
+
+
+class PydanticTokenUsage(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+
+
+class PydanticAIMessage(PydanticMessage):
+    role: Literal["assistant"] = "assistant"
+    content: Optional[str] = ""
+    tool_calls: Optional[List[ChatCompletionMessageToolCall]] = None
+    token_usage: Optional[PydanticTokenUsage] = None
+
+
+BASELINE = SimpleNamespace(
+    SystemMessage=PydanticSystemMessage, UserMessage=PydanticUserMessage,
+    AIMessage=PydanticAIMessage, ToolMessage=PydanticToolMessage,
+    ToolCall=ChatCompletionMessageToolCall,
+)
+CURRENT = SimpleNamespace(
+    SystemMessage=current.SystemMessage, UserMessage=current.UserMessage,
+    AIMessage=current.AIMessage, ToolMessage=current.ToolMessage,
+    ToolCall=ToolCall,
+)
+
+
+def build(impl: SimpleNamespace, count: int) -> list:
+    messages = [impl.SystemMessage(content="You are a helpful assistant.")]
+    i = 0
+    while len(messages) < count:
+        call = impl.ToolCall(id=f"call_{i}", type="function",
+                             function={"name": "lookup", "arguments": '{"query": "zelda"}'})
+        messages.append(impl.UserMessage(content=f"Question {i}"))
+        messages.append(impl.AIMessage(content=None, tool_calls=[call]))
+        messages.append(impl.ToolMessage(content=f'"result {i}"', tool_call_id=f"call_{i}", name="lookup"))
+        messages.append(impl.AIMessage(content=f"Answer {i}"))
+        i += 1
+    return messages[:count]
+
+
+def timed(fn, count: int):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) / count * 1e6
+
+
+def measure(impl: SimpleNamespace, count: int) -> Dict[str, float]:
+    messages, construct = timed(lambda: build(impl, count), count)
+    _, first = timed(lambda: [m.dict() for m in messages], count)
+    _, again = timed(lambda: [m.dict() for m in messages], count)
+    _, deep = timed(lambda: copy.deepcopy(messages), count)
+    return {"Construct": construct, "Serialize (first)": first,
+            "Serialize (again)": again, "Deep copy": deep}
+
+
+def main(count: int = 100_000):
+    baseline = measure(BASELINE, count)
+    dataclasses = measure(CURRENT, count)
+    print(f"{count} messages, us per message")
+    print(f"{'':<20} {'pydantic':>10} {'dataclass':>10} {'speedup':>8}")
+    for label, before in baseline.items():
+        after = dataclasses[label]
+        print(f"{label:<20} {before:10.2f} {after:10.2f} {before / after:7.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
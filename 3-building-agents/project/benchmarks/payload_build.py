@@ -0,0 +1,74 @@
+"""
+Cost of building a chat completion payload for 50 tools x 200 messages.
+
+Times Tool construction and LLM._build_payload for an agent-like
+conversation in which every turn appends an assistant and a tool message
+to the previous history. Run from 3-building-agents/project:
+
+    python -m benchmarks.payload_build [turns]
+"""
+import sys
+import time
+from typing import List, Optional
+
+from lib.llm import LLM
+from lib.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage, UserMessage
+from lib.tooling import Tool, ToolCall
+
+
+TOOLS = 50
+MESSAGES = 200
+
+
+def make_function(i: int):
+    def lookup(query: str, limit: int = 10, tags: Optional[List[str]] = None, exact: bool = False) -> str:
+        """Look something up in one of the benchmark sources"""
+        return query
+    lookup.__name__ = f"lookup_{i}"
+    return lookup
+
+
+FUNCTIONS = [make_function(i) for i in range(TOOLS)]
+
+
+def make_tools() -> List[Tool]:
+    return [Tool(func) for func in FUNCTIONS]
+
+
+def turn(i: int) -> List[BaseMessage]:
+    call = ToolCall(id=f"call_{i}", type="function",
+                    function={"name": f"lookup_{i % TOOLS}", "arguments": '{"query": "zelda"}'})
+    return [
+        AIMessage(content=None, tool_calls=[call]),
+        ToolMessage(content=f'"result {i}"', tool_call_id=f"call_{i}", name=f"lookup_{i % TOOLS}"),
+    ]
+
+
+def main(turns: int = 200):
+    start = time.perf_counter()
+    for _ in range(20):
+        tools = make_tools()
+    print(f"Tool construction      {(time.perf_counter() - start) / 20 * 1000:8.3f} ms per {TOOLS} tools")
+
+    llm = LLM(api_key="stub", tools=tools)
+    messages: List[BaseMessage] = [SystemMessage(content="You are a helpful assistant.")]
+    messages += [UserMessage(content=f"Question {i}") for i in range(MESSAGES // 4)]
+    while len(messages) < MESSAGES:
+        messages = messages + turn(len(messages))
+
+    start = time.perf_counter()
+    llm._build_payload(messages)
+    print(f"First payload          {(time.perf_counter() - start) * 1000:8.3f} ms")
+
+    elapsed = 0.0
+    for i in range(turns):
+        messages = messages + turn(MESSAGES + i)
+        start = time.perf_counter()
+        llm._build_payload(messages)
+        elapsed += time.perf_counter() - start
+    print(f"Payload per turn       {elapsed / turns * 1000:8.3f} ms "
+          f"({TOOLS} tools, {MESSAGES}-{MESSAGES + 2 * turns} messages)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
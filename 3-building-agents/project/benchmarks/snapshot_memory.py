@@ -0,0 +1,77 @@
+"""
+Memory and time of snapshots over long runs: field deltas vs. deep copies.
+
+Each step of the run appends an assistant message to a growing messages
+list, as an agent loop does. Messages are plain dicts: AIMessage objects
+are immutable and deep-copy to themselves, which would hide the cost. Snapshots store only the fields a step changed, sharing
+the rest with earlier snapshots. The baseline additionally deep-copies the
+full state at every snapshot, which is what snapshots used to hold. Peak
+memory is traced with tracemalloc. Run from 3-building-agents/project:
+
+    python -m benchmarks.snapshot_memory [steps]
+"""
+import contextlib
+import copy
+import io
+import sys
+import time
+import tracemalloc
+from typing import List, Optional, TypedDict
+
+from lib.instrumentation import StepObserver
+from lib.state_machine import EntryPoint, StateMachine, Step, Termination
+
+
+class ChatState(TypedDict):
+    messages: List[dict]
+    turns: int
+
+
+class DeepCopySnapshots(StepObserver):
+    """Keeps a deep copy of every snapshot's full state"""
+
+    def __init__(self):
+        self.states = []
+
+    def on_snapshot(self, run, snapshot):
+        self.states.append(copy.deepcopy(snapshot.state_data))
+
+
+def long_run_machine(steps: int) -> StateMachine[ChatState]:
+    def reply(state: ChatState) -> dict:
+        message = {"role": "assistant", "content": f"Turn {state['turns']}: " + "lorem ipsum " * 20}
+        return {"messages": state["messages"] + [message], "turns": state["turns"] + 1}
+
+    machine = StateMachine[ChatState](ChatState)
+    entry, step, termination = EntryPoint[ChatState](), Step[ChatState]("reply", reply), Termination[ChatState]()
+    machine.add_steps([entry, step, termination])
+    machine.connect(entry, step)
+    machine.connect(step, [step, termination], lambda state: "reply" if state["turns"] < steps else termination.step_id)
+    return machine
+
+
+def measure(steps: int, observer: Optional[StepObserver]):
+    machine = long_run_machine(steps)
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = machine.run({"messages": [], "turns": 0}, observers=[observer] if observer else None)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert run.get_final_state()["turns"] == steps
+    return elapsed, peak
+
+
+def main(steps: int = 500):
+    results = {}
+    for label, observer in (("Deep copies", DeepCopySnapshots()), ("Field deltas", None)):
+        elapsed, peak = measure(steps, observer)
+        results[label] = peak
+        print(f"{label:<16} {elapsed:8.3f} s {peak / 1e6:10.1f} MB peak over {steps} steps")
+    baseline, deltas = results.values()
+    print(f"{'Memory saved':<16} {1 - deltas / baseline:10.1%}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
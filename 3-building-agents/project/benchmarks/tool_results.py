@@ -0,0 +1,58 @@
+"""
+Prompt tokens of a tool-heavy session with and without a ToolResultPolicy.
+
+Every turn the model calls a tool returning a large inventory report and
+then answers, with the offline StubBackend. The conversation carries over
+between turns, so without a policy each report is sent again on every
+later call. Run from 3-building-agents/project:
+
+    python -m benchmarks.tool_results [turns] [report_rows]
+"""
+import sys
+
+from lib.agents import Agent
+from lib.artifacts import ToolResultPolicy
+from lib.backends import StubBackend
+from lib.tooling import Tool
+
+
+def inventory_report_tool(rows: int) -> Tool:
+    def inventory_report(as_of_date: str) -> str:
+        """Stock level of every item on a date"""
+        return "\n".join(f"item_{i:05d}  paper supply #{i}  stock {i * 37 % 1000:5d}  as of {as_of_date}"
+                         for i in range(rows))
+    return Tool(inventory_report)
+
+
+def session_prompt_tokens(agent: Agent, turns: int) -> int:
+    prompt_tokens = 0
+    messages = []
+    for turn in range(turns):
+        state = agent._initial_state(f"Check inventory_report for 2025-01-{turn + 1:02d}", "benchmark")
+        state["messages"] = messages
+        final = agent.workflow.run(state).get_final_state()
+        new_messages = final["messages"][len(messages):]
+        prompt_tokens += sum(m.token_usage.prompt_tokens for m in new_messages if getattr(m, "token_usage", None))
+        messages = final["messages"]
+    return prompt_tokens
+
+
+def main(turns: int = 10, rows: int = 2000):
+    tool = inventory_report_tool(rows)
+    results = {}
+    for label, policy in (("No policy", None), ("Spill over 1000 tokens", ToolResultPolicy(max_tokens=1000))):
+        agent = Agent(
+            model_name="gpt-4o-mini",
+            instructions="You answer questions about the inventory.",
+            tools=[tool],
+            backend=StubBackend(),
+            result_policy=policy,
+        )
+        results[label] = session_prompt_tokens(agent, turns)
+        print(f"{label:<24} {results[label]:10,d} prompt tokens over {turns} turns")
+    baseline, reduced = results.values()
+    print(f"{'Reduction':<24} {1 - reduced / baseline:10.1%}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
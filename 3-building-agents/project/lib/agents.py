@@ -1,11 +1,21 @@
-from typing import TypedDict, List, Optional, Union, TypeVar
+from typing import Iterator, TypedDict, List, Optional, Union, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
 import json
 
-from lib.state_machine import StateMachine, Step, EntryPoint, Termination, Run
+from lib.state_machine import StateMachine, Step, EntryPoint, Termination, Run, RunBudget, StreamEvent
 from lib.llm import LLM
+from lib.backends import LLMBackend
+from lib.rate_limit import RateLimiter
 from lib.messages import AIMessage, UserMessage, SystemMessage, ToolMessage
 from lib.tooling import Tool, ToolCall
 from lib.memory import ShortTermMemory
+from lib.resilience import StepPolicy, call_with_timeout
+from lib.instrumentation import current_step_metrics
+from lib.context import ContextManager, ContextUsage
+from lib.artifacts import READ_ARTIFACT, ToolResultPolicy
+from lib.usage import usage_scope
 
 # Define the state schema
 class AgentState(TypedDict):
@@ -14,13 +24,23 @@ class AgentState(TypedDict):
     messages: List[dict]  # List of conversation messages
     current_tool_calls: Optional[List[ToolCall]]  # Current pending tool calls
     total_tokens: int  # Track the cumulative total
+    context_usage: Optional[dict]  # How the last LLM call fitted the context budget
     
 class Agent:
     def __init__(self, 
                  model_name: str,
                  instructions: str, 
                  tools: List[Tool] = None,
-                 temperature: float = 0.7):
+                 temperature: float = 0.7,
+                 llm_policy: Optional[StepPolicy] = None,
+                 tool_policy: Optional[StepPolicy] = None,
+                 budget: Optional[RunBudget] = None,
+                 tool_concurrency: int = 8,
+                 tool_timeout: Optional[float] = None,
+                 context: Optional[ContextManager] = None,
+                 backend: Optional[LLMBackend] = None,
+                 rate_limiter: Optional[Union[str, RateLimiter]] = None,
+                 result_policy: Optional[ToolResultPolicy] = None):
         """
         Initialize an Agent
         
@@ -29,15 +49,51 @@ class Agent:
             instructions: System instructions for the agent
             tools: Optional list of tools available to the agent
             temperature: Temperature parameter for LLM (default: 0.7)
+            llm_policy: Optional timeout/retry/circuit breaker policy for the LLM step
+            tool_policy: Optional timeout/retry/circuit breaker policy for the tool step
+            budget: Optional step, wall time and token limits per invocation, which
+                bound the LLM/tool loop (on_exhausted may name "__termination__")
+            tool_concurrency: Maximum number of tool calls from one model turn
+                executed at the same time (default: 8)
+            tool_timeout: Optional seconds each tool call may take before its
+                result is replaced by an error message
+            context: Optional context window manager keeping each LLM call within
+                a token budget by compacting older messages
+            backend: Optional LLM provider (default: OpenAI); a StubBackend runs
+                the agent offline
+            rate_limiter: Optional limiter, or name of a shared one, admitting
+                the agent's LLM calls (see lib.rate_limit.get_rate_limiter)
+            result_policy: Optional size caps on tool results; results over
+                them are truncated, summarized or spilled to an artifact store
+                the agent reads back with an added read_artifact tool
         """
         self.instructions = instructions
         self.tools = tools if tools else []
+        self.result_policy = result_policy
+        if result_policy is not None and all(tool.name != READ_ARTIFACT for tool in self.tools):
+            self.tools = self.tools + [result_policy.read_artifact_tool()]
+        self.tools_by_name = {tool.name: tool for tool in self.tools}
         self.model_name = model_name
         self.temperature = temperature
+        self.llm_policy = llm_policy
+        self.tool_policy = tool_policy
+        self.budget = budget
+        self.tool_concurrency = tool_concurrency
+        self.tool_timeout = tool_timeout
+        self.context = context
+        # Built once; every loop iteration reuses its pooled client
+        self.llm = LLM(
+            model=self.model_name,
+            temperature=self.temperature,
+            tools=self.tools,
+            backend=backend,
+            rate_limiter=rate_limiter
+        )
         
         # Initialize memory and state machine
         self.memory = ShortTermMemory()
         self.workflow = self._create_state_machine()
+        self.async_workflow = self._create_state_machine(asynchronous=True)
 
     def _prepare_messages_step(self, state: AgentState) -> AgentState:
         """Step logic: Prepare messages for LLM consumption"""
@@ -47,8 +103,8 @@ class Agent:
         if not messages:
             messages = [SystemMessage(content=state["instructions"])]
             
-        # Add the new user message
-        messages.append(UserMessage(content=state["user_query"]))
+        # Add the new user message without mutating the list held by earlier snapshots
+        messages = messages + [UserMessage(content=state["user_query"])]
         
         return {
             "messages": messages,
@@ -57,24 +113,49 @@ class Agent:
 
     def _llm_step(self, state: AgentState) -> AgentState:
         """Step logic: Process the current state through the LLM"""
-        # Initialize LLM
-        llm = LLM(
-            model=self.model_name,
-            temperature=self.temperature,
-            tools=self.tools
-        )
+        with usage_scope(session_id=state["session_id"]):
+            messages, usage = self.context.fit(state["messages"]) if self.context else (state["messages"], None)
+            metrics = current_step_metrics()
+            if metrics is not None and metrics.on_token is not None:
+                # Someone streams this run: forward tokens as they are generated
+                response = None
+                for chunk in self.llm.stream(messages):
+                    response = chunk.message or response
+            else:
+                response = self.llm.invoke(messages)
+        return self._llm_result(state, response, usage)
+
+    async def _allm_step(self, state: AgentState) -> AgentState:
+        """Step logic: Asynchronous counterpart of _llm_step"""
+        messages, usage = state["messages"], None
+        with usage_scope(session_id=state["session_id"]):
+            if self.context:
+                # Compaction may call the LLM to summarize; keep it off the event loop
+                messages, usage = await asyncio.to_thread(self.context.fit, messages)
+            metrics = current_step_metrics()
+            if metrics is not None and metrics.on_token is not None:
+                response = None
+                async for chunk in self.llm.astream(messages):
+                    response = chunk.message or response
+            else:
+                response = await self.llm.ainvoke(messages)
+        return self._llm_result(state, response, usage)
 
-        response = llm.invoke(state["messages"])
+    def _llm_result(self, state: AgentState, response: AIMessage,
+                    usage: Optional[ContextUsage] = None) -> AgentState:
+        """Append the response to the full history. Compaction only shapes what
+        is sent to the LLM, so later calls can still retrieve any earlier turn."""
         tool_calls = response.tool_calls if response.tool_calls else None
 
         current_total = state.get("total_tokens", 0)
         if response.token_usage:
             current_total += response.token_usage.total_tokens
 
-        # Create AI message with content and tool calls
+        # Create AI message with content and tool calls, keeping its token usage
         ai_message = AIMessage(
             content=response.content, 
             tool_calls=tool_calls,
+            token_usage=response.token_usage,
         )
 
         return {
@@ -82,28 +163,25 @@ class Agent:
             "current_tool_calls": tool_calls,
             "session_id": state["session_id"],
             "total_tokens": current_total,
+            "context_usage": usage.to_dict() if usage else None,
         }
 
     def _tool_step(self, state: AgentState) -> AgentState:
         """Step logic: Execute any pending tool calls"""
         tool_calls = state["current_tool_calls"] or []
-        tool_messages = []
-        
-        for call in tool_calls:
-            # Access tool call data correctly
-            function_name = call.function.name
-            function_args = json.loads(call.function.arguments)
-            tool_call_id = call.id
-            # Find the matching tool
-            tool = next((t for t in self.tools if t.name == function_name), None)
-            if tool:
-                result = str(tool(**function_args))
-                tool_message = ToolMessage(
-                    content=json.dumps(result), 
-                    tool_call_id=tool_call_id, 
-                    name=function_name, 
-                )
-                tool_messages.append(tool_message)
+
+        with usage_scope(session_id=state["session_id"]):
+            if len(tool_calls) > 1 and self.tool_concurrency > 1:
+                # Independent calls run concurrently; map keeps the tool_call_id order.
+                # Each call gets a copy of the step's context so usage is attributed to it.
+                with ThreadPoolExecutor(max_workers=min(len(tool_calls), self.tool_concurrency)) as executor:
+                    futures = [
+                        executor.submit(contextvars.copy_context().run, self._execute_tool_call, call)
+                        for call in tool_calls
+                    ]
+                    tool_messages = [future.result() for future in futures]
+            else:
+                tool_messages = [self._execute_tool_call(call) for call in tool_calls]
         
         # Clear tool calls and add results to messages
         return {
@@ -112,15 +190,91 @@ class Agent:
             "session_id": state["session_id"]
         }
 
-    def _create_state_machine(self) -> StateMachine[AgentState]:
-        """Create the internal state machine for the agent"""
-        machine = StateMachine[AgentState](AgentState)
+    async def _atool_step(self, state: AgentState) -> AgentState:
+        """Step logic: Await pending tool calls together, in tool_call_id order"""
+        tool_calls = state["current_tool_calls"] or []
+        semaphore = asyncio.Semaphore(self.tool_concurrency)
+
+        async def execute(call: ToolCall) -> ToolMessage:
+            async with semaphore:
+                return await self._aexecute_tool_call(call)
+
+        with usage_scope(session_id=state["session_id"]):
+            tool_messages = await asyncio.gather(*[execute(call) for call in tool_calls])
+
+        return {
+            "messages": state["messages"] + list(tool_messages),
+            "current_tool_calls": None,
+            "session_id": state["session_id"]
+        }
+
+    def _execute_tool_call(self, call: ToolCall) -> ToolMessage:
+        """Run one tool call, turning any failure into an error result for the model"""
+        function_name = call.function.name
+        tool = self.tools_by_name.get(function_name)
+        try:
+            if tool is None:
+                raise LookupError(f"Unknown tool '{function_name}'")
+            function_args = json.loads(call.function.arguments)
+            # LLM calls made by the tool are attributed to it in the usage ledger
+            with usage_scope(tool=function_name):
+                if self.tool_timeout:
+                    result = str(call_with_timeout(lambda: tool(**function_args), self.tool_timeout))
+                else:
+                    result = str(tool(**function_args))
+        except Exception as e:
+            result = f"Error: {type(e).__name__}: {e}"
+
+        if self.result_policy is not None:
+            result = self.result_policy.apply(function_name, result)
+
+        return ToolMessage(
+            content=json.dumps(result), 
+            tool_call_id=call.id, 
+            name=function_name, 
+        )
+
+    async def _aexecute_tool_call(self, call: ToolCall) -> ToolMessage:
+        """Asynchronous counterpart of _execute_tool_call; async tools are awaited
+        on the loop and sync ones run in the default executor"""
+        function_name = call.function.name
+        tool = self.tools_by_name.get(function_name)
+        try:
+            if tool is None:
+                raise LookupError(f"Unknown tool '{function_name}'")
+            function_args = json.loads(call.function.arguments)
+            with usage_scope(tool=function_name):
+                if self.tool_timeout:
+                    result = str(await asyncio.wait_for(tool.acall(**function_args), self.tool_timeout))
+                else:
+                    result = str(await tool.acall(**function_args))
+        except asyncio.TimeoutError:
+            result = f"Error: TimeoutError: Tool call exceeded {self.tool_timeout}s"
+        except Exception as e:
+            result = f"Error: {type(e).__name__}: {e}"
+
+        if self.result_policy is not None:
+            # Spilling writes a file and summarizing calls the LLM; keep both off the event loop
+            result = await asyncio.to_thread(self.result_policy.apply, function_name, result)
+
+        return ToolMessage(
+            content=json.dumps(result), 
+            tool_call_id=call.id, 
+            name=function_name, 
+        )
+
+    def _create_state_machine(self, asynchronous: bool = False) -> StateMachine[AgentState]:
+        """Create the internal state machine for the agent.
+        The asynchronous variant awaits the LLM and tools and only runs with arun."""
+        machine = StateMachine[AgentState](AgentState, budget=self.budget)
         
         # Create steps
         entry = EntryPoint[AgentState]()
         message_prep = Step[AgentState]("message_prep", self._prepare_messages_step)
-        llm_processor = Step[AgentState]("llm_processor", self._llm_step)
-        tool_executor = Step[AgentState]("tool_executor", self._tool_step)
+        llm_processor = Step[AgentState]("llm_processor", self._allm_step if asynchronous else self._llm_step,
+                                         policy=self.llm_policy)
+        tool_executor = Step[AgentState]("tool_executor", self._atool_step if asynchronous else self._tool_step,
+                                         policy=self.tool_policy)
         termination = Termination[AgentState]()
         
         machine.add_steps([entry, message_prep, llm_processor, tool_executor, termination])
@@ -153,7 +307,60 @@ class Agent:
             The final run object after processing
         """
         session_id = session_id or "default"
+        initial_state = self._initial_state(query, session_id)
 
+        run_object = self.workflow.run(initial_state)
+        
+        # Store the complete run object in memory
+        self.memory.add(run_object, session_id)
+        
+        return run_object
+
+    async def ainvoke(self, query: str, session_id: Optional[str] = None) -> Run:
+        """
+        Asynchronous counterpart of invoke
+        
+        The LLM is awaited and tool calls are awaited together: async tools
+        natively, sync tools in the default executor.
+        
+        Args:
+            query: The user's query to process
+            session_id: Optional session identifier (uses "default" if None)
+            
+        Returns:
+            The final run object after processing
+        """
+        session_id = session_id or "default"
+        initial_state = self._initial_state(query, session_id)
+
+        run_object = await self.async_workflow.arun(initial_state)
+        
+        # Store the complete run object in memory
+        self.memory.add(run_object, session_id)
+        
+        return run_object
+
+    def stream(self, query: str, session_id: Optional[str] = None) -> Iterator[StreamEvent]:
+        """
+        Run the agent on a query, yielding step and token events as they happen
+        
+        Args:
+            query: The user's query to process
+            session_id: Optional session identifier (uses "default" if None)
+            
+        Returns:
+            Iterator of StreamEvents; the last one ("run_end") carries the run
+            object, which is also stored in memory like with invoke
+        """
+        session_id = session_id or "default"
+        initial_state = self._initial_state(query, session_id)
+
+        for event in self.workflow.stream(initial_state):
+            if event.kind == "run_end":
+                self.memory.add(event.data, session_id)
+            yield event
+
+    def _initial_state(self, query: str, session_id: str) -> AgentState:
         # Create session if it doesn't exist
         self.memory.create_session(session_id)
 
@@ -165,7 +372,7 @@ class Agent:
             if last_state:
                 previous_messages = last_state["messages"]
 
-        initial_state: AgentState = {
+        return {
             "user_query": query,
             "instructions": self.instructions,
             "messages": previous_messages,
@@ -173,12 +380,31 @@ class Agent:
             "session_id": session_id,
         }
 
-        run_object = self.workflow.run(initial_state)
+    def invoke_many(self, queries: List[str], concurrency: int = 8) -> Iterator[Run]:
+        """
+        Run the agent on many independent queries concurrently
         
-        # Store the complete run object in memory
-        self.memory.add(run_object, session_id)
+        Each query starts without conversation history and its run is not
+        stored in memory, which suits evaluation and backfill jobs.
         
-        return run_object
+        Args:
+            queries: The user queries to process
+            concurrency: Maximum number of queries processed at once
+            
+        Returns:
+            Iterator yielding each run object as it completes
+        """
+        initial_states = [
+            {
+                "user_query": query,
+                "instructions": self.instructions,
+                "messages": [],
+                "current_tool_calls": None,
+                "session_id": "default",
+            }
+            for query in queries
+        ]
+        return self.workflow.run_many(initial_states, concurrency=concurrency)
 
     def get_session_runs(self, session_id: Optional[str] = None) -> List[Run]:
         """Get all Run objects for a session
@@ -0,0 +1,262 @@
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, Literal, Optional
+
+from lib.context import TokenCounter
+from lib.llm import LLM
+from lib.messages import SystemMessage, UserMessage
+from lib.tooling import Tool
+
+
+READ_ARTIFACT = "read_artifact"
+
+_ARTIFACT_ID = re.compile(r"^[\w.-]+$")
+
+
+class ArtifactStore:
+    """
+    Local store for tool results too large to keep in the conversation.
+
+    Artifacts are text, named after the tool that produced them and a hash
+    of their content, so storing the same result twice yields the same id.
+    They are files in `directory`, or kept in memory when it is None.
+    """
+
+    def __init__(self, directory: Optional[str] = "artifacts"):
+        self.directory = directory
+        self._memory: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"ArtifactStore({self.directory!r})"
+
+    def _path(self, artifact_id: str) -> str:
+        if not _ARTIFACT_ID.match(artifact_id):
+            raise KeyError(f"Invalid artifact id '{artifact_id}'")
+        return os.path.join(self.directory, f"{artifact_id}.txt")
+
+    def put(self, content: str, name: str = "artifact") -> str:
+        """Store content; return its id"""
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+        artifact_id = re.sub(r"[^\w.-]", "_", name) + "-" + digest
+        if self.directory is None:
+            with self._lock:
+                self._memory[artifact_id] = content
+            return artifact_id
+        path = self._path(artifact_id)
+        if not os.path.exists(path):
+            # Written aside and renamed, so readers never see a partial file
+            partial = f"{path}.{threading.get_ident()}.tmp"
+            with open(partial, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(partial, path)
+        return artifact_id
+
+    def get(self, artifact_id: str) -> str:
+        """The full content of an artifact; KeyError if there is none"""
+        if self.directory is None:
+            with self._lock:
+                return self._memory[artifact_id]
+        path = self._path(artifact_id)
+        if not os.path.exists(path):
+            raise KeyError(f"No artifact '{artifact_id}'")
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def read(self, artifact_id: str, offset: int = 0, length: int = 8000) -> str:
+        """One page of an artifact: `length` characters from `offset`, with a
+        footer telling the model where the next page starts"""
+        content = self.get(artifact_id)
+        offset = max(0, offset)
+        page = content[offset:offset + length]
+        end = offset + len(page)
+        if end < len(content):
+            footer = (f"[characters {offset}-{end} of {len(content)}; call {READ_ARTIFACT} "
+                      f"with offset={end} for more]")
+        else:
+            footer = f"[characters {offset}-{end} of {len(content)}; end of artifact]"
+        return f"{page}\n{footer}"
+
+
+@dataclass
+class ToolResultLimit:
+    """Size cap for the results of one tool; None fields use the policy's defaults"""
+    max_tokens: Optional[int] = None
+    max_bytes: Optional[int] = None
+    strategy: Optional[Literal["truncate", "summarize", "spill"]] = None
+
+
+class ToolResultPolicy:
+    """
+    Keeps large tool results out of the conversation, where every later LLM
+    call of the run (and of the session) would send them again.
+
+    A result over its token or byte cap is reduced with one of three
+    strategies before it becomes a ToolMessage:
+
+    - "truncate": keep the beginning, with a note of what was cut
+    - "summarize": replace it with an LLM-written summary
+    - "spill": keep the beginning as a preview and store the full result in
+      the ArtifactStore, from which the model reads further pages with the
+      read_artifact tool (see read_artifact_tool)
+
+    Summarized results are stored too, so the model can still read the
+    original. Caps and strategies apply per tool through `limits`.
+
+    Example:
+        >>> policy = ToolResultPolicy(max_tokens=1000, store=ArtifactStore(),
+        ...                           limits={"get_weather": ToolResultLimit(max_tokens=200)})
+        >>> agent = Agent(..., tools=[search_web, get_weather], result_policy=policy)
+    """
+
+    def __init__(self,
+                 max_tokens: Optional[int] = 2000,
+                 max_bytes: Optional[int] = None,
+                 strategy: Literal["truncate", "summarize", "spill"] = "spill",
+                 limits: Optional[Dict[str, ToolResultLimit]] = None,
+                 store: Optional[ArtifactStore] = None,
+                 llm: Optional[LLM] = None,
+                 counter: Optional[TokenCounter] = None,
+                 page_tokens: int = 2000):
+        """
+        Args:
+            max_tokens: Default token cap per result
+            max_bytes: Default UTF-8 size cap per result
+            strategy: Default reduction of results over their cap
+            limits: Caps and strategies of particular tools, by tool name
+            store: Where results are spilled (default: in memory)
+            llm: Model writing summaries; required for "summarize"
+            counter: Token counter (default: TokenCounter for gpt-4o-mini)
+            page_tokens: Size of the pages read_artifact returns
+        """
+        limits = limits or {}
+        if llm is None and "summarize" in [strategy] + [limit.strategy for limit in limits.values()]:
+            raise ValueError("The summarize strategy needs an llm")
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+        self.strategy = strategy
+        self.limits = limits
+        self.store = store if store is not None else ArtifactStore(directory=None)
+        self.llm = llm
+        self.counter = counter or TokenCounter()
+        self.page_tokens = page_tokens
+        self.results = 0
+        self.reduced = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"ToolResultPolicy(max_tokens={self.max_tokens}, strategy='{self.strategy}')"
+
+    def _limit(self, tool_name: str) -> ToolResultLimit:
+        limit = self.limits.get(tool_name)
+        if limit is None:
+            return ToolResultLimit(self.max_tokens, self.max_bytes, self.strategy)
+        return ToolResultLimit(
+            limit.max_tokens if limit.max_tokens is not None else self.max_tokens,
+            limit.max_bytes if limit.max_bytes is not None else self.max_bytes,
+            limit.strategy or self.strategy,
+        )
+
+    def _head(self, text: str, max_tokens: Optional[int], max_bytes: Optional[int]) -> str:
+        # The longest prefix of whole characters within both caps. Tokens are
+        # cut as UTF-8 bytes: decoding them to text would turn a character
+        # split across tokens into U+FFFD, and offsets into the result would
+        # no longer line up with the stored artifact.
+        if max_tokens is not None:
+            if self.counter.encoding is not None:
+                tokens = self.counter.encoding.encode(text, disallowed_special=())[:max_tokens]
+                head = self.counter.encoding.decode_bytes(tokens).decode("utf-8", errors="ignore")
+                text = text[:len(head)]
+            else:
+                text = text[:max_tokens * 4]
+        if max_bytes is not None:
+            text = text.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore")
+        return text
+
+    def apply(self, tool_name: str, result: str) -> str:
+        """The result to put in the conversation: unchanged when within its cap"""
+        if tool_name == READ_ARTIFACT:
+            return result  # pages are bounded by page_tokens already
+        limit = self._limit(tool_name)
+        tokens = self.counter.count_text(result)
+        over = (limit.max_tokens is not None and tokens > limit.max_tokens) or \
+            (limit.max_bytes is not None and len(result.encode("utf-8")) > limit.max_bytes)
+
+        reduced = result
+        if over:
+            # Room for the note appended below, at most a quarter of the cap
+            max_tokens = limit.max_tokens - min(80, limit.max_tokens // 4) if limit.max_tokens is not None else None
+            max_bytes = limit.max_bytes - min(320, limit.max_bytes // 4) if limit.max_bytes is not None else None
+            if limit.strategy == "truncate":
+                head = self._head(result, max_tokens, max_bytes)
+                reduced = f"{head}\n[truncated: {len(head)} of {len(result)} characters shown]"
+            elif limit.strategy == "summarize":
+                reduced = self._summarize(tool_name, result, tokens, max_tokens, max_bytes)
+            else:
+                artifact_id = self.store.put(result, tool_name)
+                head = self._head(result, max_tokens, max_bytes)
+                reduced = (f"{head}\n[{len(head)} of {len(result)} characters shown ({tokens} tokens in all). "
+                           f"The full result is artifact '{artifact_id}'; call {READ_ARTIFACT}("
+                           f"artifact_id='{artifact_id}', offset={len(head)}) to read more.]")
+
+        with self._lock:
+            self.results += 1
+            if over:
+                self.reduced += 1
+            self.tokens_in += tokens
+            self.tokens_out += self.counter.count_text(reduced) if over else tokens
+        return reduced
+
+    def _summarize(self, tool_name: str, result: str, tokens: int,
+                   max_tokens: Optional[int], max_bytes: Optional[int]) -> str:
+        words = max((max_tokens or 500) * 3 // 4, 20)
+        response = self.llm.invoke([
+            SystemMessage(content=(
+                f"Summarize this result of the {tool_name} tool for the assistant that called it. "
+                "Keep names, numbers and anything needed to answer follow-up questions. "
+                f"Use at most {words} words."
+            )),
+            # The model summarizing cannot take more than its own window
+            UserMessage(content=self._head(result, 50_000, None)),
+        ])
+        summary = self._head(response.content or "", max_tokens, max_bytes)
+        artifact_id = self.store.put(result, tool_name)
+        return (f"{summary}\n[summary of a {tokens}-token result; the full result is "
+                f"artifact '{artifact_id}', readable with {READ_ARTIFACT}]")
+
+    def read_artifact_tool(self) -> Tool:
+        """The tool the model pages through spilled results with"""
+        page = self.page_tokens * 4  # characters, at about four per token
+
+        def read_artifact(artifact_id: str, offset: int = 0) -> str:
+            try:
+                return self.store.read(artifact_id, offset, page)
+            except KeyError:
+                return f"Error: no artifact '{artifact_id}'"
+
+        return Tool(
+            read_artifact,
+            name=READ_ARTIFACT,
+            description=(
+                "Read part of a tool result too large to show in full. "
+                "Pass the artifact id from the result and the character offset to start from."
+            ),
+        )
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "results": self.results,
+                "reduced": self.reduced,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_saved": self.tokens_in - self.tokens_out,
+            }
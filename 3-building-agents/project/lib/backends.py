@@ -0,0 +1,417 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+from openai import OpenAI, AsyncOpenAI
+from openai.lib._parsing._completions import type_to_response_format_param
+
+from lib.clients import get_openai_client, get_async_openai_client
+from lib.llm_cache import completion_cache_key
+from lib.messages import AIMessage, AIMessageChunk, TokenUsage, ToolCallChunk
+from lib.tooling import ToolCall
+
+
+class LLMBackend(ABC):
+    """
+    Provider behind an LLM.
+
+    Backends receive the chat completion payload built by LLM._build_payload,
+    in the OpenAI wire format: model, temperature, messages and, when set,
+    tools, tool_choice and response_format (a pydantic class). They return
+    AIMessages, token_usage included, so LLM's caching, usage accounting and
+    streaming work the same with every provider.
+
+    The async methods default to running the sync ones in a worker thread;
+    backends with a native async client override them.
+    """
+
+    @abstractmethod
+    def complete(self, payload: Dict[str, Any]) -> AIMessage:
+        pass
+
+    @abstractmethod
+    def stream(self, payload: Dict[str, Any]) -> Iterator[AIMessageChunk]:
+        """Yield content and tool call deltas; the last chunk carries the
+        assembled AIMessage in its `message`"""
+        pass
+
+    async def acomplete(self, payload: Dict[str, Any]) -> AIMessage:
+        return await asyncio.to_thread(self.complete, payload)
+
+    async def astream(self, payload: Dict[str, Any]) -> AsyncIterator[AIMessageChunk]:
+        chunks = await asyncio.to_thread(lambda: list(self.stream(payload)))
+        for chunk in chunks:
+            yield chunk
+
+
+def _token_usage(usage: Any) -> Optional[TokenUsage]:
+    """TokenUsage of a completion or final stream chunk, None when not reported"""
+    if not usage:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return TokenUsage(
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        total_tokens=usage.total_tokens,
+        cached_tokens=(getattr(details, "cached_tokens", None) or 0) if details else 0,
+    )
+
+
+class _StreamAssembler:
+    """Turns chat completion chunks into AIMessageChunks and the final AIMessage"""
+
+    def __init__(self):
+        self.content: List[str] = []
+        self.tool_calls: Dict[int, Dict[str, Any]] = {}
+        self.usage = None
+
+    def feed(self, chunk: Any) -> Optional[AIMessageChunk]:
+        if chunk.usage:
+            # With include_usage the last chunk carries the usage and no choices
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta
+
+        content = delta.content or ""
+        if content:
+            self.content.append(content)
+
+        tool_call_chunks = []
+        for fragment in delta.tool_calls or []:
+            call = self.tool_calls.setdefault(fragment.index, {"id": None, "name": "", "arguments": []})
+            name = fragment.function.name if fragment.function else None
+            arguments = (fragment.function.arguments if fragment.function else None) or ""
+            if fragment.id:
+                call["id"] = fragment.id
+            if name:
+                call["name"] += name
+            call["arguments"].append(arguments)
+            tool_call_chunks.append(ToolCallChunk(index=fragment.index, id=fragment.id, name=name, arguments=arguments))
+
+        if not content and not tool_call_chunks:
+            return None
+        return AIMessageChunk(content=content, tool_call_chunks=tool_call_chunks)
+
+    def finish(self) -> AIMessage:
+        tool_calls = [
+            ToolCall(
+                id=call["id"],
+                type="function",
+                function={"name": call["name"], "arguments": "".join(call["arguments"])},
+            )
+            for _, call in sorted(self.tool_calls.items())
+        ] or None
+
+        return AIMessage(
+            content="".join(self.content) if self.content or not tool_calls else None,
+            tool_calls=tool_calls,
+            token_usage=_token_usage(self.usage)
+        )
+
+
+def _parse_response(response: Any) -> AIMessage:
+    message = response.choices[0].message
+    return AIMessage(
+        content=message.content,
+        tool_calls=message.tool_calls,
+        token_usage=_token_usage(response.usage)
+    )
+
+
+def _stream_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    if isinstance(payload.get("response_format"), type):
+        # create() takes the JSON schema form that parse() derives from the class
+        payload["response_format"] = type_to_response_format_param(payload["response_format"])
+    return payload
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI's API, or any server speaking it, through the shared pooled clients"""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(base_url={self.base_url!r})"
+
+    @property
+    def client(self) -> OpenAI:
+        # Shared across LLM instances so calls reuse pooled keep-alive connections
+        return get_openai_client(self.api_key, self.base_url)
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        # Looked up per call: async connections are tied to the running event loop
+        return get_async_openai_client(self.api_key, self.base_url)
+
+    def complete(self, payload: Dict[str, Any]) -> AIMessage:
+        if payload.get("response_format"):
+            return _parse_response(self.client.beta.chat.completions.parse(**payload))
+        return _parse_response(self.client.chat.completions.create(**payload))
+
+    async def acomplete(self, payload: Dict[str, Any]) -> AIMessage:
+        if payload.get("response_format"):
+            return _parse_response(await self.async_client.beta.chat.completions.parse(**payload))
+        return _parse_response(await self.async_client.chat.completions.create(**payload))
+
+    def stream(self, payload: Dict[str, Any]) -> Iterator[AIMessageChunk]:
+        assembler = _StreamAssembler()
+        # Closing the stream when the caller stops early aborts the request
+        with self.client.chat.completions.create(**_stream_payload(payload)) as stream:
+            for chunk in stream:
+                message_chunk = assembler.feed(chunk)
+                if message_chunk is not None:
+                    yield message_chunk
+        yield AIMessageChunk(message=assembler.finish())
+
+    async def astream(self, payload: Dict[str, Any]) -> AsyncIterator[AIMessageChunk]:
+        assembler = _StreamAssembler()
+        async with await self.async_client.chat.completions.create(**_stream_payload(payload)) as stream:
+            async for chunk in stream:
+                message_chunk = assembler.feed(chunk)
+                if message_chunk is not None:
+                    yield message_chunk
+        yield AIMessageChunk(message=assembler.finish())
+
+
+class LocalHTTPBackend(OpenAIBackend):
+    """
+    A self-hosted model behind an OpenAI-compatible HTTP endpoint, such as
+    vLLM, Ollama or llama.cpp's server.
+
+    No API key is needed. The base URL defaults to LOCAL_LLM_BASE_URL, then
+    to Ollama's default port. Local model names are not in the usage
+    pricing table, so their calls are recorded at no cost.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, api_key: str = "local"):
+        super().__init__(
+            api_key=api_key,
+            base_url=base_url or os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:11434/v1"),
+        )
+
+
+def _estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _example_value(schema: Dict[str, Any], text: str) -> Any:
+    """Smallest value valid for a JSON schema; strings take `text`"""
+    if "default" in schema:
+        return schema["default"]
+    if schema.get("enum"):
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        return _example_value(schema["anyOf"][0], text)
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            name: _example_value(prop, text)
+            for name, prop in schema.get("properties", {}).items()
+            if name in schema.get("required", [])
+        }
+    return {"string": text, "integer": 0, "number": 0.0, "boolean": False, "array": []}.get(kind)
+
+
+def _inline_refs(schema: Any, definitions: Dict[str, Any]) -> Any:
+    # pydantic puts nested models under $defs; the stub only needs them inlined
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return _inline_refs(definitions[schema["$ref"].rsplit("/", 1)[-1]], definitions)
+        return {k: _inline_refs(v, definitions) for k, v in schema.items()}
+    if isinstance(schema, list):
+        return [_inline_refs(item, definitions) for item in schema]
+    return schema
+
+
+StubResponse = Union[str, AIMessage, Callable[[Dict[str, Any]], Union[str, AIMessage]]]
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic in-process backend for load tests, benchmarks and offline
+    runs: no network, no spend.
+
+    Each call answers with, in order of precedence:
+
+    1. the recording of an identical payload, from RecordingBackend
+    2. the next of `responses`: a string (the content), an AIMessage, or a
+       callable taking the payload and returning either
+    3. a synthesized reply. When the payload offers tools and nothing answered
+       the latest user message yet, that is a call to the first tool named in
+       the message (else the first tool) with arguments built from its schema,
+       strings set to the message. Otherwise it is `reply` or an echo of the
+       message, or, with a response_format, the minimal valid JSON object.
+
+    Token usage is estimated at four characters per token. `latency` adds a
+    fixed delay per call, slept without blocking the event loop in acomplete.
+
+    Example:
+        >>> llm = LLM(backend=StubBackend(responses=["Hello!"]))
+        >>> llm.invoke("Hi").content
+        'Hello!'
+    """
+
+    def __init__(self,
+                 responses: Optional[Sequence[StubResponse]] = None,
+                 recordings: Optional[Dict[str, Dict]] = None,
+                 tool_calls: bool = True,
+                 reply: Optional[str] = None,
+                 latency: float = 0.0):
+        self.recordings = recordings or {}
+        self.tool_calls = tool_calls
+        self.reply = reply
+        self.latency = latency
+        self.calls = 0
+        self._responses = iter(responses or [])
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"StubBackend(recordings={len(self.recordings)}, calls={self.calls})"
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'StubBackend':
+        """Replay recordings saved by RecordingBackend.save"""
+        with open(path) as f:
+            return cls(recordings=json.load(f), **kwargs)
+
+    def complete(self, payload: Dict[str, Any]) -> AIMessage:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(payload)
+
+    async def acomplete(self, payload: Dict[str, Any]) -> AIMessage:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(payload)
+
+    def stream(self, payload: Dict[str, Any]) -> Iterator[AIMessageChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        yield from self._chunks(self._respond(payload))
+
+    async def astream(self, payload: Dict[str, Any]) -> AsyncIterator[AIMessageChunk]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self._respond(payload)):
+            yield chunk
+
+    def _respond(self, payload: Dict[str, Any]) -> AIMessage:
+        with self._lock:
+            self.calls += 1
+        if self.recordings:
+            recorded = self.recordings.get(completion_cache_key(payload))
+            if recorded is not None:
+                return AIMessage.model_validate(recorded)
+        with self._lock:
+            response = next(self._responses, None)
+        if callable(response):
+            response = response(payload)
+        if response is None:
+            response = self._synthesize(payload)
+        if isinstance(response, str):
+            response = AIMessage(content=response)
+        if response.token_usage is None:
+            response = response.model_copy(update={"token_usage": self._usage(payload, response)})
+        return response
+
+    def _synthesize(self, payload: Dict[str, Any]) -> AIMessage:
+        messages = payload["messages"]
+        last_user = next((i for i in range(len(messages) - 1, -1, -1) if messages[i]["role"] == "user"), None)
+        text = (messages[last_user].get("content") or "") if last_user is not None else ""
+        answered = last_user is not None and any(m["role"] == "tool" for m in messages[last_user:])
+
+        tools = payload.get("tools")
+        if self.tool_calls and tools and not answered and last_user is not None:
+            functions = [tool["function"] for tool in tools]
+            function = next((f for f in functions if f["name"] in text), functions[0])
+            arguments = _example_value(function.get("parameters", {}), text)
+            return AIMessage(content=None, tool_calls=[ToolCall(
+                id=f"call_stub_{len(messages)}",
+                type="function",
+                function={"name": function["name"], "arguments": json.dumps(arguments)},
+            )])
+
+        response_format = payload.get("response_format")
+        if response_format is not None:
+            schema = response_format.model_json_schema()
+            schema = _inline_refs(schema, schema.get("$defs", {}))
+            return AIMessage(content=json.dumps(_example_value(schema, self.reply or text)))
+        return AIMessage(content=self.reply if self.reply is not None else f"Stub response to: {text}")
+
+    def _usage(self, payload: Dict[str, Any], message: AIMessage) -> TokenUsage:
+        prompt = sum(_estimate_tokens(m.get("content") or "") + 3 for m in payload["messages"])
+        completion = _estimate_tokens(message.content or "") + sum(
+            _estimate_tokens(call.function.name + call.function.arguments) for call in message.tool_calls or []
+        )
+        return TokenUsage(prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion)
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        # Content streams word by word, each tool call as a single fragment
+        words = (message.content or "").split(" ")
+        for i, word in enumerate(words):
+            if word or i:
+                yield AIMessageChunk(content=word if i == 0 else " " + word)
+        for index, call in enumerate(message.tool_calls or []):
+            yield AIMessageChunk(tool_call_chunks=[ToolCallChunk(
+                index=index, id=call.id, name=call.function.name, arguments=call.function.arguments,
+            )])
+        yield AIMessageChunk(message=message)
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Passes calls through to `backend` and records each response under its
+    payload's completion_cache_key, for StubBackend to replay.
+
+    Example:
+        >>> recorder = RecordingBackend(OpenAIBackend())
+        >>> agent = Agent(..., backend=recorder)
+        >>> agent.invoke("What is the best Zelda game?")
+        >>> recorder.save("recordings.json")
+        >>> replay = StubBackend.from_file("recordings.json")
+    """
+
+    def __init__(self, backend: LLMBackend):
+        self.backend = backend
+        self.recordings: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"RecordingBackend({self.backend!r}, recordings={len(self.recordings)})"
+
+    def _record(self, payload: Dict[str, Any], message: AIMessage) -> AIMessage:
+        with self._lock:
+            self.recordings[completion_cache_key(payload)] = message.model_dump(mode="json")
+        return message
+
+    def complete(self, payload: Dict[str, Any]) -> AIMessage:
+        return self._record(payload, self.backend.complete(payload))
+
+    async def acomplete(self, payload: Dict[str, Any]) -> AIMessage:
+        return self._record(payload, await self.backend.acomplete(payload))
+
+    def stream(self, payload: Dict[str, Any]) -> Iterator[AIMessageChunk]:
+        for chunk in self.backend.stream(payload):
+            if chunk.message is not None:
+                self._record(payload, chunk.message)
+            yield chunk
+
+    async def astream(self, payload: Dict[str, Any]) -> AsyncIterator[AIMessageChunk]:
+        async for chunk in self.backend.astream(payload):
+            if chunk.message is not None:
+                self._record(payload, chunk.message)
+            yield chunk
+
+    def save(self, path: str):
+        with self._lock:
+            recordings = dict(self.recordings)
+        with open(path, "w") as f:
+            json.dump(recordings, f, indent=2)
@@ -0,0 +1,105 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, Generic, List, Sequence, Tuple, TypeVar
+
+
+Item = TypeVar("Item")
+Result = TypeVar("Result")
+
+
+class MicroBatcher(Generic[Item, Result]):
+    """
+    Coalesces concurrent calls to a batch function into a single call.
+
+    fn takes a list of items and returns one result per item, in order (e.g.
+    an embeddings endpoint). When other callers are in flight, the first
+    caller waits up to max_wait seconds, or until max_batch_size items are
+    queued, collecting the items submitted by other threads meanwhile; a
+    lone caller calls fn at once, so batching adds no latency without
+    concurrency. The items are sent once per max_batch_size and every
+    caller gets its own slice of the results. A failure of fn is raised in
+    every caller with items in the failed call.
+    """
+
+    def __init__(self, fn: Callable[[List[Item]], Sequence[Result]],
+                 max_batch_size: int = 256, max_wait: float = 0.01):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait  # seconds
+        self.batches = 0  # calls made to fn
+        self._pending: List[Tuple[List[Item], Future]] = []
+        self._pending_size = 0
+        self._callers = 0  # threads inside __call__
+        self._collecting = False
+        self._full = threading.Event()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"MicroBatcher(max_batch_size={self.max_batch_size}, max_wait={self.max_wait})"
+
+    def __call__(self, items: Sequence[Item]) -> List[Result]:
+        future: Future = Future()
+        with self._lock:
+            self._callers += 1
+            self._pending.append((list(items), future))
+            self._pending_size += len(items)
+            leader = not self._collecting
+            if leader:
+                self._collecting = True
+                self._full.clear()
+            if self._pending_size >= self.max_batch_size:
+                self._full.set()
+            # Nobody else to wait for: a lone caller is flushed right away
+            wait = self._callers > 1
+
+        try:
+            if leader:
+                if wait:
+                    self._full.wait(self.max_wait)
+                with self._lock:
+                    batch, self._pending = self._pending, []
+                    self._pending_size = 0
+                    self._collecting = False
+                self._flush(batch)
+            return future.result()
+        finally:
+            with self._lock:
+                self._callers -= 1
+
+    def _flush(self, batch: List[Tuple[List[Item], Future]]):
+        try:
+            self._call_batches(batch)
+        finally:
+            # fn raised a BaseException (e.g. KeyboardInterrupt) in this thread;
+            # fail the other callers instead of leaving them waiting forever
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Batch call was aborted"))
+
+    def _call_batches(self, batch: List[Tuple[List[Item], Future]]):
+        flat = [item for items, _ in batch for item in items]
+        # Callers that queued while the batch was full push it over max_batch_size
+        results: List[Result] = []
+        errors: List[Tuple[int, int, Exception]] = []  # (start, end, error) of failed chunks
+        for start in range(0, len(flat), self.max_batch_size):
+            chunk = flat[start:start + self.max_batch_size]
+            with self._lock:
+                self.batches += 1
+            try:
+                chunk_results = list(self.fn(chunk))
+                if len(chunk_results) != len(chunk):
+                    raise ValueError(f"Batch function returned {len(chunk_results)} results for {len(chunk)} items")
+            except Exception as e:
+                errors.append((start, start + len(chunk), e))
+                chunk_results = [None] * len(chunk)
+            results += chunk_results
+
+        offset = 0
+        for items, future in batch:
+            end = offset + len(items)
+            error = next((e for start, stop, e in errors if start < end and offset < stop), None)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[offset:end])
+            offset = end
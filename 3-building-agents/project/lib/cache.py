@@ -0,0 +1,198 @@
+import dataclasses
+import datetime
+import enum
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+def _canonical(obj: Any) -> Any:
+    # Objects can define how they are keyed, e.g. by an id or a version
+    if hasattr(obj, "__cache_key__"):
+        return {"__class__": type(obj).__name__, "key": obj.__cache_key__()}
+    # Messages and pydantic models (tool calls) expose model_dump
+    if hasattr(obj, "model_dump") and not isinstance(obj, type):
+        return {"__class__": type(obj).__name__, **obj.model_dump(mode="json")}
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {"__class__": type(obj).__name__, **dataclasses.asdict(obj)}
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=_encode)
+    if isinstance(obj, enum.Enum):
+        return {"__class__": type(obj).__name__, "value": obj.value}
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return obj.hex()
+    # repr() of other objects may hold a memory address, which would never hit
+    raise TypeError(
+        f"Cannot hash {type(obj).__name__} objects deterministically; "
+        f"define __cache_key__ on them or convert them to JSON types first"
+    )
+
+
+def _encode(obj: Any) -> str:
+    return json.dumps(obj, default=_canonical, sort_keys=True, separators=(",", ":"))
+
+
+def stable_hash(obj: Any) -> str:
+    """SHA-256 of a canonical JSON encoding of obj.
+    Equal values hash equally across processes, unlike the builtin hash().
+    Raises TypeError for objects without a deterministic encoding."""
+    return hashlib.sha256(_encode(obj).encode("utf-8")).hexdigest()
+
+
+class Cache(ABC):
+    """
+    Key/value cache with optional per-entry time-to-live.
+
+    get() returns None on a miss, so None itself cannot be cached.
+    Implementations are thread-safe and count hits and misses.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl  # seconds; None keeps entries until evicted
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: Any, expires_at: Optional[float]):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttl
+        self._set(key, value, time.time() + ttl if ttl is not None else None)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+class LRUCache(Cache):
+    """In-memory cache keeping at most maxsize entries, evicting the least recently used"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"LRUCache(size={len(self._entries)}, maxsize={self.maxsize})"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: Any, expires_at: Optional[float]):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskCache(Cache):
+    """Cache persisted in a SQLite file so entries survive restarts.
+    Values are pickled, so they must be picklable."""
+
+    def __init__(self, path: str = "cache.db", ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, "
+                "value BLOB NOT NULL, "
+                "expires_at REAL)"
+            )
+
+    def __repr__(self) -> str:
+        return f"DiskCache('{self.path}')"
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < time.time():
+                with self._connection:
+                    self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+        return pickle.loads(value)
+
+    def _set(self, key: str, value: Any, expires_at: Optional[float]):
+        data = pickle.dumps(value)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, data, expires_at),
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM cache")
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Type
+
+
+from lib.instrumentation import StepMetrics
+from lib.messages import BaseMessage, SystemMessage, UserMessage, AIMessage, ToolMessage
+from lib.state_machine import Run, Snapshot, StateSchema
+from lib.tooling import ToolCall
+
+
+# Tagged types that can be rebuilt from a checkpoint
+SERIALIZABLE_MODELS: Dict[str, Type] = {
+    cls.__name__: cls
+    for cls in (SystemMessage, UserMessage, AIMessage, ToolMessage)
+}
+SERIALIZABLE_MODELS["ToolCall"] = ToolCall
+
+TYPE_TAG = "__type__"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _encode(obj: Any) -> Any:
+    if isinstance(obj, BaseMessage):
+        # None values are kept: AIMessage(content=None) must not reload as content=""
+        return {TYPE_TAG: type(obj).__name__, **obj.model_dump()}
+    if isinstance(obj, ToolCall):
+        return {TYPE_TAG: "ToolCall", **obj.model_dump()}
+    raise TypeError(f"Object of type {type(obj).__name__} cannot be checkpointed")
+
+
+def _decode(obj: Dict) -> Any:
+    type_name = obj.pop(TYPE_TAG, None)
+    if type_name is None:
+        return obj
+    return SERIALIZABLE_MODELS[type_name].model_validate(obj)
+
+
+def dumps_state(state: Dict[str, Any]) -> str:
+    """Serialize a state (or state delta) to compact JSON, tagging message types"""
+    return json.dumps(state, default=_encode, separators=(",", ":"))
+
+
+def loads_state(data: str) -> Dict[str, Any]:
+    """Inverse of dumps_state, rebuilding tagged messages and tool calls"""
+    return json.loads(data, object_hook=_decode)
+
+
+class Checkpointer(ABC):
+    """
+    Persists a Run while it executes so it can be resumed after a crash.
+
+    Every snapshot is written as soon as its step completes. Only the snapshot
+    delta is stored, so a step that appends one message writes one message.
+    Backends only need to append and read back JSON records per run.
+
+    Parallel branches are recorded when they join. Branch records not
+    followed by a snapshot of the main line (or the end of the run) belong to
+    a fan-out that was interrupted; they are left out when the run is loaded,
+    since resuming re-runs that fan-out from its fork.
+    """
+
+    @abstractmethod
+    def append(self, run_id: str, record: Dict[str, Any]):
+        """Durably append a record to the run's log"""
+        pass
+
+    @abstractmethod
+    def records(self, run_id: str) -> List[Dict[str, Any]]:
+        """Return every record of the run, in the order they were appended"""
+        pass
+
+    def start_run(self, run: Run):
+        self.append(run.run_id, {
+            "kind": "run",
+            "start_timestamp": run.start_timestamp.strftime(TIMESTAMP_FORMAT),
+        })
+
+    def save_snapshot(self, run_id: str, snapshot: Snapshot):
+        self.append(run_id, {
+            "kind": "snapshot",
+            "snapshot_id": snapshot.snapshot_id,
+            "parent_id": snapshot.parent.snapshot_id if snapshot.parent else None,
+            "timestamp": snapshot.timestamp.strftime(TIMESTAMP_FORMAT),
+            "step_id": snapshot.step_id,
+            "branch": snapshot.branch,
+            "depth": snapshot.depth,
+            "delta": dumps_state(snapshot.delta),
+            "metrics": snapshot.metrics.to_dict() if snapshot.metrics else None,
+            "fallback": snapshot.fallback,
+        })
+
+    def resume_run(self, run_id: str, snapshot: Snapshot):
+        """Mark that the run continues after snapshot, discarding what was recorded since"""
+        self.append(run_id, {"kind": "resume", "snapshot_id": snapshot.snapshot_id})
+
+    def complete_run(self, run: Run):
+        self.append(run.run_id, {
+            "kind": "end",
+            "end_timestamp": run.end_timestamp.strftime(TIMESTAMP_FORMAT),
+        })
+
+    def load_run(self, run_id: str, state_schema: Type[StateSchema]) -> Optional[Run]:
+        """Rebuild a Run and its snapshots from the stored records.
+        The run's end_timestamp stays None if it never completed."""
+        records = self.records(run_id)
+        if not records:
+            return None
+
+        run = Run(run_id=run_id, start_timestamp=datetime.now())
+        snapshots: Dict[str, Snapshot] = {}
+        # Branch snapshots since the last main-line one, kept once the main line continues
+        pending: List[Snapshot] = []
+        for record in records:
+            kind = record["kind"]
+            if kind == "run":
+                run.start_timestamp = datetime.strptime(record["start_timestamp"], TIMESTAMP_FORMAT)
+            elif kind == "resume":
+                pending.clear()
+            elif kind == "snapshot":
+                snapshot = Snapshot(
+                    snapshot_id=record["snapshot_id"],
+                    timestamp=datetime.strptime(record["timestamp"], TIMESTAMP_FORMAT),
+                    delta=loads_state(record["delta"]),
+                    state_schema=state_schema,
+                    step_id=record["step_id"],
+                    branch=record["branch"],
+                    parent=snapshots.get(record["parent_id"]),
+                    depth=record["depth"],
+                    metrics=StepMetrics.from_dict(record["metrics"]) if record.get("metrics") else None,
+                    fallback=record.get("fallback"),
+                )
+                snapshots[snapshot.snapshot_id] = snapshot
+                if snapshot.branch is not None:
+                    pending.append(snapshot)
+                    continue
+                for branch_snapshot in pending:
+                    run.add_snapshot(branch_snapshot)
+                pending.clear()
+                run.add_snapshot(snapshot)
+            elif kind == "end":
+                for branch_snapshot in pending:
+                    run.add_snapshot(branch_snapshot)
+                pending.clear()
+                run.end_timestamp = datetime.strptime(record["end_timestamp"], TIMESTAMP_FORMAT)
+        return run
+
+
+class SQLiteCheckpointer(Checkpointer):
+    """Checkpointer storing one row per record in a SQLite database"""
+
+    def __init__(self, path: str = "checkpoints.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "run_id TEXT NOT NULL, "
+                "record TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS checkpoints_run_id ON checkpoints (run_id, seq)"
+            )
+
+    def __repr__(self) -> str:
+        return f"SQLiteCheckpointer('{self.path}')"
+
+    def append(self, run_id: str, record: Dict[str, Any]):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO checkpoints (run_id, record) VALUES (?, ?)",
+                (run_id, json.dumps(record, separators=(",", ":"))),
+            )
+
+    def records(self, run_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT record FROM checkpoints WHERE run_id = ? ORDER BY seq",
+                (run_id,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        self._connection.close()
+
+
+class FileCheckpointer(Checkpointer):
+    """Checkpointer writing an append-only JSON Lines file per run"""
+
+    def __init__(self, directory: str = "checkpoints", fsync: bool = True):
+        self.directory = directory
+        # fsync after every record survives power loss, at the cost of a disk flush per step
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"FileCheckpointer('{self.directory}')"
+
+    def _path(self, run_id: str) -> str:
+        return os.path.join(self.directory, f"{run_id}.jsonl")
+
+    def append(self, run_id: str, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock, open(self._path(run_id), "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def records(self, run_id: str) -> List[Dict[str, Any]]:
+        path = self._path(run_id)
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                # A crash mid-write can leave a truncated last line; ignore it
+                if line.endswith("\n"):
+                    records.append(json.loads(line))
+        return records
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+
+@dataclass(frozen=True)
+class PoolLimits:
+    """Connection pool settings shared by every registry client"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0  # seconds an idle connection is kept open
+    http2: bool = True  # only honoured when the optional `h2` package is installed
+
+
+_limits = PoolLimits()
+_clients: Dict[Tuple[Optional[str], Optional[str]], OpenAI] = {}
+# httpx async connections belong to the event loop that opened them
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[Optional[str], Optional[str]], AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _http2_enabled() -> bool:
+    if not _limits.http2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _httpx_options() -> Dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=_limits.max_connections,
+            max_keepalive_connections=_limits.max_keepalive_connections,
+            keepalive_expiry=_limits.keepalive_expiry,
+        ),
+        "http2": _http2_enabled(),
+    }
+
+
+def configure_client_pool(limits: PoolLimits):
+    """Set the pool limits used by clients created from now on.
+    Call reset_clients() as well to apply them to existing clients."""
+    global _limits
+    _limits = limits
+
+
+def get_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> OpenAI:
+    """
+    Process-wide OpenAI client for the given credentials.
+
+    Every caller with the same api_key and base_url shares one client and
+    therefore one pool of keep-alive connections, so repeated calls skip
+    the TCP and TLS handshakes. None uses the OPENAI_* environment defaults.
+    """
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        if key not in _clients:
+            _clients[key] = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultHttpxClient(**_httpx_options()),
+            )
+        return _clients[key]
+
+
+def get_async_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """Asynchronous counterpart of get_openai_client, shared per event loop.
+    Outside a running loop a new, unshared client is returned."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return AsyncOpenAI(api_key=api_key, base_url=base_url,
+                           http_client=DefaultAsyncHttpxClient(**_httpx_options()))
+
+    key = (api_key, base_url)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=DefaultAsyncHttpxClient(**_httpx_options()),
+            )
+        return clients[key]
+
+
+def reset_clients():
+    """Close the shared sync clients and forget every registered client"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _async_clients.clear()
@@ -0,0 +1,285 @@
+import hashlib
+import re
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Literal, Optional, Sequence, Tuple
+
+from lib.cache import LRUCache, stable_hash
+from lib.llm import LLM
+from lib.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage, UserMessage
+
+try:
+    import tiktoken
+except ImportError:  # counts fall back to a characters-per-token estimate
+    tiktoken = None
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+class TokenCounter:
+    """
+    Counts chat tokens locally, the way the OpenAI chat format bills them.
+
+    Uses tiktoken when it is installed; otherwise estimates four characters
+    per token, which is close enough for budgeting English text.
+    """
+
+    # Fixed cost of every message, and of priming the assistant reply
+    TOKENS_PER_MESSAGE = 3
+    TOKENS_PER_NAME = 1
+    REPLY_PRIMING = 3
+
+    def __init__(self, model: str = "gpt-4o-mini"):
+        self.model = model
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def __repr__(self) -> str:
+        name = self.encoding.name if self.encoding else "estimate"
+        return f"TokenCounter('{self.model}', encoding={name})"
+
+    def count_text(self, text: Optional[str]) -> int:
+        if not text:
+            return 0
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def count_message(self, message: BaseMessage) -> int:
+        tokens = self.TOKENS_PER_MESSAGE + self.count_text(message.role) + self.count_text(message.content)
+        if isinstance(message, ToolMessage):
+            tokens += self.TOKENS_PER_NAME + self.count_text(message.name)
+        if isinstance(message, AIMessage) and message.tool_calls:
+            for call in message.tool_calls:
+                tokens += self.count_text(call.function.name) + self.count_text(call.function.arguments)
+        return tokens
+
+    def count(self, messages: Sequence[BaseMessage]) -> int:
+        return sum(self.count_message(m) for m in messages) + self.REPLY_PRIMING
+
+
+@dataclass
+class ContextUsage:
+    """How a conversation was fitted into the token budget for one LLM call"""
+    budget: int
+    tokens_before: int
+    tokens_after: int
+    messages_before: int
+    messages_after: int
+    strategy: Optional[str] = None  # None when nothing had to be compacted
+
+    @property
+    def over_budget(self) -> bool:
+        return self.tokens_after > self.budget
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _group(messages: Sequence[BaseMessage]) -> Tuple[List[BaseMessage], List[List[BaseMessage]]]:
+    """Split leading system messages from the rest, grouped into units that
+    are kept or dropped whole: an assistant message with its tool results, or
+    any other single message"""
+    start = 0
+    while start < len(messages) and isinstance(messages[start], SystemMessage) \
+            and not (messages[start].content or "").startswith(SUMMARY_PREFIX):
+        start += 1
+
+    units: List[List[BaseMessage]] = []
+    for message in messages[start:]:
+        if isinstance(message, ToolMessage) and units:
+            units[-1].append(message)
+        else:
+            units.append([message])
+    return list(messages[:start]), units
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower()))
+
+
+class ContextManager:
+    """
+    Keeps the conversation sent to the LLM within a token budget.
+
+    The leading system messages and everything from the latest user message
+    onwards are always kept. Older messages are compacted with one of three
+    strategies once the budget is exceeded:
+
+    - "truncate": drop the oldest messages
+    - "summarize": replace the dropped messages with an LLM-written summary
+      (a later compaction folds the previous summary into the new one)
+    - "retrieve": keep the older messages most relevant to the latest user
+      message, scored by `embed` similarity or, without it, word overlap
+
+    An assistant message and the tool results answering its tool calls are
+    always kept or dropped together, so the API never sees orphaned pairs.
+
+    fit() does not change the history it is given, so callers keep the full
+    conversation and compact it again on every call. Summaries and embeddings
+    are therefore memoized: a summary per dropped prefix, extended with only
+    the newly dropped messages, and a vector per past turn.
+    """
+
+    def __init__(self,
+                 max_tokens: int,
+                 strategy: Literal["truncate", "summarize", "retrieve"] = "truncate",
+                 counter: Optional[TokenCounter] = None,
+                 llm: Optional[LLM] = None,
+                 summary_tokens: int = 256,
+                 embed: Optional[Callable[[str], Sequence[float]]] = None):
+        """
+        Args:
+            max_tokens: Budget for the messages of one call; leave room for the
+                tool schemas and the completion within the model's window
+            strategy: How older messages are compacted
+            counter: Token counter (default: TokenCounter for gpt-4o-mini)
+            llm: Model writing summaries; required for "summarize"
+            summary_tokens: Room reserved for the summary message
+            embed: Optional text embedding function used by "retrieve"
+        """
+        if strategy == "summarize" and llm is None:
+            raise ValueError("The summarize strategy needs an llm")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.counter = counter or TokenCounter()
+        self.llm = llm
+        self.summary_tokens = summary_tokens
+        self.embed = embed
+        self._summaries = LRUCache(maxsize=256)  # prefix hash -> summary message
+        self._vectors = LRUCache(maxsize=4096)  # text hash -> embedding
+
+    def __repr__(self) -> str:
+        return f"ContextManager(max_tokens={self.max_tokens}, strategy='{self.strategy}')"
+
+    def fit(self, messages: Sequence[BaseMessage]) -> Tuple[List[BaseMessage], ContextUsage]:
+        """Return the messages to send, compacted if needed, and the budget usage"""
+        count = self.counter.count_message
+        tokens_before = self.counter.count(messages)
+        usage = ContextUsage(
+            budget=self.max_tokens,
+            tokens_before=tokens_before,
+            tokens_after=tokens_before,
+            messages_before=len(messages),
+            messages_after=len(messages),
+        )
+        if tokens_before <= self.max_tokens:
+            return list(messages), usage
+
+        system, units = _group(messages)
+        # Everything from the latest user message on is the turn being answered
+        current = len(units)
+        for i in range(len(units) - 1, -1, -1):
+            if isinstance(units[i][0], UserMessage):
+                current = i
+                break
+        older, required = units[:current], units[current:]
+
+        fixed = self.counter.REPLY_PRIMING + sum(count(m) for m in system) \
+            + sum(count(m) for unit in required for m in unit)
+        unit_tokens = [sum(count(m) for m in unit) for unit in older]
+
+        if self.strategy == "retrieve":
+            kept = self._retrieve(older, unit_tokens, self.max_tokens - fixed, required)
+            compacted = [m for unit in kept for m in unit]
+        else:
+            available = self.max_tokens - fixed
+            if self.strategy == "summarize":
+                available -= self.summary_tokens
+            # Keep the most recent older messages that still fit
+            keep_from = len(older)
+            while keep_from > 0 and unit_tokens[keep_from - 1] <= available:
+                keep_from -= 1
+                available -= unit_tokens[keep_from]
+            dropped = [m for unit in older[:keep_from] for m in unit]
+            compacted = [m for unit in older[keep_from:] for m in unit]
+            if self.strategy == "summarize" and dropped:
+                compacted = [self._summary(dropped)] + compacted
+
+        result = system + compacted + [m for unit in required for m in unit]
+        usage.strategy = self.strategy
+        usage.tokens_after = self.counter.count(result)
+        usage.messages_after = len(result)
+        return result, usage
+
+    def _summary(self, dropped: List[BaseMessage]) -> SystemMessage:
+        # Hash of every prefix of dropped, each chained on the previous one
+        prefixes = []
+        digest = hashlib.sha256()
+        for message in dropped:
+            digest.update(stable_hash(message).encode("ascii"))
+            prefixes.append(digest.hexdigest())
+
+        summary = self._summaries.get(prefixes[-1])
+        if summary is not None:
+            return summary
+        # Fold the newly dropped messages into the summary of the longest known prefix
+        for i in range(len(prefixes) - 2, -1, -1):
+            previous = self._summaries.get(prefixes[i])
+            if previous is not None:
+                dropped = [previous] + dropped[i + 1:]
+                break
+        summary = self._summarize(dropped)
+        self._summaries.set(prefixes[-1], summary)
+        return summary
+
+    def _summarize(self, messages: List[BaseMessage]) -> SystemMessage:
+        transcript = "\n".join(
+            f"{m.role}: {m.content or ''}".strip() for m in messages if m.content
+        )
+        words = max(self.summary_tokens * 3 // 4, 20)
+        response = self.llm.invoke([
+            SystemMessage(content=(
+                "Summarize this conversation excerpt for the assistant that continues it. "
+                "Keep facts, decisions, open questions and tool results that may matter later. "
+                f"Use at most {words} words."
+            )),
+            UserMessage(content=transcript),
+        ])
+        return SystemMessage(content=SUMMARY_PREFIX + (response.content or ""))
+
+    def _retrieve(self, older: List[List[BaseMessage]], unit_tokens: List[int],
+                  available: int, required: List[List[BaseMessage]]) -> List[List[BaseMessage]]:
+        # Past turns (a user message and what answered it) are kept or dropped whole
+        turns: List[List[int]] = []
+        for i, unit in enumerate(older):
+            if not turns or isinstance(unit[0], UserMessage):
+                turns.append([])
+            turns[-1].append(i)
+
+        query = " ".join(m.content or "" for unit in required for m in unit if isinstance(m, UserMessage))
+        texts = [" ".join(m.content or "" for i in turn for m in older[i]) for turn in turns]
+
+        if self.embed is not None:
+            query_vector = self._vector(query)
+            query_norm = sum(x * x for x in query_vector) ** 0.5 or 1.0
+            scores = []
+            for text in texts:
+                vector = self._vector(text) if text else []
+                norm = sum(x * x for x in vector) ** 0.5 or 1.0
+                scores.append(sum(a * b for a, b in zip(query_vector, vector)) / (norm * query_norm))
+        else:
+            query_words = _words(query)
+            scores = [len(query_words & _words(text)) / (len(query_words) or 1) for text in texts]
+
+        # Most relevant first, newest first among equals; output keeps conversation order
+        keep = set()
+        for t in sorted(range(len(turns)), key=lambda t: (scores[t], t), reverse=True):
+            tokens = sum(unit_tokens[i] for i in turns[t])
+            if tokens <= available:
+                keep.update(turns[t])
+                available -= tokens
+        return [unit for i, unit in enumerate(older) if i in keep]
+
+    def _vector(self, text: str) -> Sequence[float]:
+        # Past turns come back on every call of the conversation; embed each once
+        key = stable_hash(text)
+        vector = self._vectors.get(key)
+        if vector is None:
+            vector = self.embed(text)
+            self._vectors.set(key, vector)
+        return vector
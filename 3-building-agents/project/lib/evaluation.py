@@ -5,8 +5,10 @@ from pydantic import BaseModel, Field
 from lib.agents import AgentState
 from lib.state_machine import Run
 from lib.llm import LLM
+from lib.llm_cache import CompletionCache
 from lib.messages import AIMessage, BaseMessage
 from lib.parsers import PydanticOutputParser
+from lib.usage import UsageLedger, get_usage_ledger, model_price
 
 
 class TaskCompletionMetrics(BaseModel):
@@ -64,8 +66,17 @@ class JudgeEvaluation(BaseModel):
 class AgentEvaluator:
     """Comprehensive agent evaluation framework"""
     
-    def __init__(self):
-        self.llm_judge = LLM(model="gpt-4o-mini")
+    def __init__(self, cache: Optional[CompletionCache] = None,
+                 pricing_model: str = "gpt-4o-mini",
+                 ledger: Optional[UsageLedger] = None,
+                 judge_explanations: bool = True):
+        # The judge runs at temperature 0, so a cache reuses verdicts for repeated prompts
+        self.llm_judge = LLM(model="gpt-4o-mini", cache=cache)
+        # Without explanations the judge's stream is cut once its verdicts are in
+        self.judge_explanations = judge_explanations
+        # Prices token counts that cannot be matched to calls in the usage ledger
+        self.pricing_model = pricing_model
+        self.ledger = ledger if ledger is not None else get_usage_ledger()
     
     def evaluate_final_response(self, 
                           test_case: TestCase, 
@@ -92,19 +103,28 @@ class AgentEvaluator:
         Provide your evaluation with a brief explanation.
         """
         
-        # Use structured output with Pydantic model
-        judge_response = self.llm_judge.invoke(
-            input=judge_prompt, 
-            response_format=JudgeEvaluation
-        )
-        
-        # Parse the structured response
+        # Stream the structured output, parsing fields as they complete;
+        # an invalid verdict is repaired field by field, not regenerated
         parser = PydanticOutputParser(model_class=JudgeEvaluation)
+        verdicts = {"task_completed", "format_correct", "instructions_followed"}
         try:
-            evaluation = parser.parse(judge_response)
+            last = None
+            for event in parser.parse_stream(
+                self.llm_judge.stream(input=judge_prompt, response_format=JudgeEvaluation),
+                stop_when=lambda event: not self.judge_explanations and verdicts <= event.fields.keys(),
+                llm=self.llm_judge,
+            ):
+                last = event
+            if last is None:
+                raise ValueError("The judge returned no output")
+            if last.stopped:
+                evaluation = JudgeEvaluation(**last.fields, explanation="Not requested")
+            elif last.output is None:
+                raise ValueError("The judge output did not parse into a JudgeEvaluation")
+            else:
+                evaluation = last.output
         except Exception as e:
             print(f"Debug: Structured parsing error: {e}")
-            print(f"Debug: Judge response content: {judge_response.content}")
             
             # Fallback evaluation based on simple heuristics
             has_game_info = any(keyword in agent_response.lower() 
@@ -300,7 +320,7 @@ class AgentEvaluator:
             total_tokens=total_tokens,
             execution_time=execution_time,
             tool_call_latency=execution_time / max(len(tool_calls_made), 1),
-            cost_estimate=self._estimate_cost(total_tokens)
+            cost_estimate=self._run_cost(run, total_tokens)
         )
         
         # Calculate overall score
@@ -323,12 +343,21 @@ class AgentEvaluator:
             feedback=feedback
         )
     
+    def _run_cost(self, run: Run, total_tokens: int) -> float:
+        """Cost of a run from the calls the usage ledger recorded for it, priced
+        per model with the prompt/completion split; falls back to total_tokens"""
+        totals = self.ledger.totals(run_id=run.run_id)
+        if totals.calls:
+            return totals.cost
+        return self._estimate_cost(total_tokens)
+
     def _estimate_cost(self, total_tokens: int) -> float:
-        """Estimate cost based on token usage (rough estimate for GPT-4o-mini)"""
-        # Rough estimate: $0.15 per 1M input tokens, $0.60 per 1M output tokens
-        # Assuming 50/50 split for simplicity
-        cost_per_token = (0.15 + 0.60) / 2 / 1_000_000
-        return total_tokens * cost_per_token
+        """Estimate cost from a bare token count at the pricing model's rates"""
+        price = model_price(self.pricing_model)
+        if price is None:
+            return 0.0
+        # Without the prompt/completion split, assume half of each
+        return total_tokens * (price.input + price.output) / 2 / 1_000_000
     
     def _create_failed_evaluation(self, reason: str) -> EvaluationResult:
         """Create a failed evaluation result"""
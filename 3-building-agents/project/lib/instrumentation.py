@@ -0,0 +1,131 @@
+from typing import Any, Callable, Dict, List, Optional
+from dataclasses import dataclass, field
+from contextvars import ContextVar
+import time
+
+
+@dataclass
+class StepMetrics:
+    """Timing, token usage and error information for a single step execution"""
+    step_id: str
+    branch: Optional[str] = None
+    wall_time: float = 0.0  # seconds
+    cpu_time: float = 0.0  # seconds of CPU used by the executing thread
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cached_tokens: int = 0  # prompt tokens served from the provider's prompt cache
+    retries: int = 0
+    queue_wait: float = 0.0  # seconds LLM calls waited for rate limiter admission
+    error: Optional[str] = None
+    cache_hit: Optional[bool] = None  # None when the step is not memoized
+    # Run executing the step, for attributing usage; set by the StateMachine
+    run_id: Optional[str] = field(default=None, repr=False, compare=False)
+    # Receives token deltas streamed while the step runs; set by the StateMachine
+    on_token: Optional[Callable[[str], None]] = field(default=None, repr=False, compare=False)
+    _wall_start: float = field(default=0.0, repr=False, compare=False)
+    _cpu_start: float = field(default=0.0, repr=False, compare=False)
+    _token: Any = field(default=None, repr=False, compare=False)
+
+    def start(self):
+        """Start the clocks and make these the current step metrics"""
+        self._token = _current_step_metrics.set(self)
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+
+    def stop(self):
+        self.wall_time = time.perf_counter() - self._wall_start
+        self.cpu_time = time.thread_time() - self._cpu_start
+        _current_step_metrics.reset(self._token)
+        self._token = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'StepMetrics':
+        return cls(**data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "step_id": self.step_id,
+            "branch": self.branch,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cached_tokens": self.cached_tokens,
+            "retries": self.retries,
+            "queue_wait": self.queue_wait,
+            "error": self.error,
+            "cache_hit": self.cache_hit,
+        }
+
+
+# Metrics of the step currently executing in this thread or task
+_current_step_metrics: ContextVar[Optional[StepMetrics]] = ContextVar("current_step_metrics", default=None)
+
+
+def current_step_metrics() -> Optional[StepMetrics]:
+    """Metrics of the step currently executing, or None outside a StateMachine step"""
+    return _current_step_metrics.get()
+
+
+def record_token_usage(prompt_tokens: int, completion_tokens: int, total_tokens: int, cached_tokens: int = 0):
+    """Attribute an LLM call's token usage to the step currently executing, if any"""
+    metrics = _current_step_metrics.get()
+    if metrics is None:
+        return
+    metrics.llm_calls += 1
+    metrics.prompt_tokens += prompt_tokens
+    metrics.completion_tokens += completion_tokens
+    metrics.total_tokens += total_tokens
+    metrics.cached_tokens += cached_tokens
+
+
+def record_queue_wait(seconds: float):
+    """Attribute time spent waiting for rate limiter admission to the current step, if any"""
+    metrics = _current_step_metrics.get()
+    if metrics is not None:
+        metrics.queue_wait += seconds
+
+
+def record_token_delta(delta: str):
+    """Forward a streamed piece of LLM output to whoever listens to the current step"""
+    metrics = _current_step_metrics.get()
+    if metrics is not None and metrics.on_token is not None:
+        metrics.on_token(delta)
+
+
+class StepObserver:
+    """
+    Hook interface notified by StateMachine while a run executes.
+
+    Subclass and override the callbacks you need; the defaults do nothing.
+    Callbacks run synchronously in the thread executing the step, so they
+    should be cheap and must be thread-safe when branches run in parallel.
+    """
+
+    def on_run_start(self, run):
+        pass
+
+    def on_step_start(self, run, step_id: str, branch: Optional[str]):
+        pass
+
+    def on_token(self, run, step_id: str, branch: Optional[str], delta: str):
+        """Called for each piece of LLM output streamed while a step runs"""
+        pass
+
+    def on_step_end(self, run, metrics: StepMetrics):
+        """Called after every step, including failed ones (metrics.error is set)"""
+        pass
+
+    def on_snapshot(self, run, snapshot):
+        """Called when a step's snapshot is recorded, before the next transition"""
+        pass
+
+    def on_transition(self, run, source: str, targets: List[str]):
+        pass
+
+    def on_run_end(self, run):
+        pass
@@ -1,14 +1,26 @@
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, Iterator, List, Optional, Dict, Any, Tuple, Union
+from contextlib import nullcontext
+import operator
 from pydantic import BaseModel
-from openai import OpenAI
+from lib.backends import LLMBackend, OpenAIBackend
 from lib.messages import (
     AnyMessage,
     TokenUsage,
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     UserMessage,
 )
 from lib.tooling import Tool
+from lib.instrumentation import record_token_delta, record_token_usage
+from lib.llm_cache import CompletionCache
+from lib.usage import UsageLedger, get_usage_ledger
+from lib.rate_limit import Permit, RateLimiter, get_rate_limiter
+
+
+def _estimate_prompt_tokens(payload: Dict[str, Any]) -> int:
+    # Rough size of a request for rate limiting: four characters per token
+    return sum(len(m.get("content") or "") // 4 + 3 for m in payload["messages"])
 
 
 class LLM:
@@ -17,14 +29,30 @@ class LLM:
         model: str = "gpt-4o-mini",
         temperature: float = 0.0,
         tools: Optional[List[Tool]] = None,
-        api_key: Optional[str] = None
+        api_key: Optional[str] = None,
+        cache: Optional[CompletionCache] = None,
+        ledger: Optional[UsageLedger] = None,
+        backend: Optional[LLMBackend] = None,
+        rate_limiter: Optional[Union[str, RateLimiter]] = None
     ):
         self.model = model
         self.temperature = temperature
-        self.client = OpenAI(api_key=api_key) if api_key else OpenAI()
+        self.api_key = api_key
+        # Reuses completions of identical temperature-0 requests
+        self.cache = cache
+        # Where API calls record their usage (default: the process-wide ledger)
+        self.ledger = ledger
+        # Provider answering the calls (default: OpenAI with the shared pooled clients)
+        self.backend: LLMBackend = backend if backend is not None else OpenAIBackend(api_key)
+        # Admission control shared with other callers of the model; a name
+        # selects the process-wide limiter registered under it
+        self.rate_limiter = get_rate_limiter(rate_limiter) if isinstance(rate_limiter, str) else rate_limiter
         self.tools: Dict[str, Tool] = {
             tool.name: tool for tool in (tools or [])
         }
+        # Serialized tools and the last conversation, reused by _build_payload
+        self._tools_payload: Tuple[Tuple[Tool, ...], List[Dict]] = ((), [])
+        self._messages_payload: Tuple[List[BaseMessage], List[Dict]] = ([], [])
 
     def register_tool(self, tool: Tool):
         self.tools[tool.name] = tool
@@ -33,15 +61,35 @@ class LLM:
         payload = {
             "model": self.model,
             "temperature": self.temperature,
-            "messages": [m.dict() for m in messages],
+            "messages": self._serialize_messages(messages),
         }
 
         if self.tools:
-            payload["tools"] = [tool.dict() for tool in self.tools.values()]
+            payload["tools"] = self._serialize_tools()
             payload["tool_choice"] = "auto"
 
         return payload
 
+    def _serialize_messages(self, messages: List[BaseMessage]) -> List[Dict]:
+        # An agent resends the previous conversation plus a few new messages,
+        # so reuse the serialized prefix when the same message objects lead
+        previous, serialized = self._messages_payload
+        if previous and len(messages) >= len(previous) and all(map(operator.is_, messages, previous)):
+            serialized = serialized + [m.dict() for m in messages[len(previous):]]
+        else:
+            serialized = [m.dict() for m in messages]
+        # One tuple assignment, so concurrent callers never see a torn pair
+        self._messages_payload = (list(messages), serialized)
+        return serialized
+
+    def _serialize_tools(self) -> List[Dict]:
+        tools = tuple(self.tools.values())
+        previous, serialized = self._tools_payload
+        if tools != previous:
+            serialized = [tool.dict() for tool in tools]
+            self._tools_payload = (tools, serialized)
+        return serialized
+
     def _convert_input(self, input: Any) -> List[BaseMessage]:
         if isinstance(input, str):
             return [UserMessage(content=input)]
@@ -52,29 +100,116 @@ class LLM:
         else:
             raise ValueError(f"Invalid input type {type(input)}.")
 
+    def _record_usage(self, token_usage: Optional[TokenUsage]):
+        # Cache hits are not recorded: they make no API call
+        if token_usage is None:
+            return
+        record_token_usage(
+            token_usage.prompt_tokens,
+            token_usage.completion_tokens,
+            token_usage.total_tokens,
+            token_usage.cached_tokens,
+        )
+        ledger = self.ledger if self.ledger is not None else get_usage_ledger()
+        ledger.record(
+            self.model,
+            prompt_tokens=token_usage.prompt_tokens,
+            completion_tokens=token_usage.completion_tokens,
+            cached_tokens=token_usage.cached_tokens,
+            total_tokens=token_usage.total_tokens,
+        )
+
+    def _prepare(self, input: str | BaseMessage | List[BaseMessage],
+                 response_format: BaseModel = None):
+        payload = self._build_payload(self._convert_input(input))
+        if response_format:
+            payload.update({"response_format": response_format})
+        cached, lookup = self.cache.lookup(payload) if self.cache else (None, None)
+        return payload, cached, lookup
+
+    def _limit(self, payload: Dict[str, Any]):
+        if self.rate_limiter is None:
+            return nullcontext()
+        return self.rate_limiter.limit(_estimate_prompt_tokens(payload))
+
+    def _alimit(self, payload: Dict[str, Any]):
+        if self.rate_limiter is None:
+            return nullcontext()
+        return self.rate_limiter.alimit(_estimate_prompt_tokens(payload))
+
+    def _complete(self, message: AIMessage, lookup, permit: Optional[Permit]) -> AIMessage:
+        self._record_usage(message.token_usage)
+        if permit is not None and message.token_usage is not None:
+            permit.record_usage(message.token_usage.total_tokens)
+        if lookup is not None:
+            self.cache.store(lookup, message)
+        return message
+
     def invoke(self, 
                input: str | BaseMessage | List[BaseMessage],
                response_format: BaseModel = None,) -> AIMessage:
-        messages = self._convert_input(input)
-        payload = self._build_payload(messages)
-        if response_format:
-            payload.update({"response_format": response_format})
-            response = self.client.beta.chat.completions.parse(**payload)
-        else:
-            response = self.client.chat.completions.create(**payload)
-        choice = response.choices[0]
-        message = choice.message
-
-        token_usage = None
-        if response.usage:
-            token_usage = TokenUsage(
-                prompt_tokens=response.usage.prompt_tokens,
-                completion_tokens=response.usage.completion_tokens,
-                total_tokens=response.usage.total_tokens
-            )
-
-        return AIMessage(
-            content=message.content,
-            tool_calls=message.tool_calls,
-            token_usage=token_usage
-        )
+        payload, cached, lookup = self._prepare(input, response_format)
+        if cached is not None:
+            return cached
+        with self._limit(payload) as permit:
+            return self._complete(self.backend.complete(payload), lookup, permit)
+
+    async def ainvoke(self, 
+                      input: str | BaseMessage | List[BaseMessage],
+                      response_format: BaseModel = None,) -> AIMessage:
+        """Asynchronous counterpart of invoke, awaited on the running event loop"""
+        payload, cached, lookup = self._prepare(input, response_format)
+        if cached is not None:
+            return cached
+        async with self._alimit(payload) as permit:
+            return self._complete(await self.backend.acomplete(payload), lookup, permit)
+
+    def _replay(self, message: AIMessage) -> AIMessageChunk:
+        # A cache hit arrives as a single chunk holding the whole message
+        if message.content:
+            record_token_delta(message.content)
+        return AIMessageChunk(content=message.content or "", message=message)
+
+    def _forward(self, chunk: AIMessageChunk, lookup, permit: Optional[Permit]) -> AIMessageChunk:
+        if chunk.content:
+            record_token_delta(chunk.content)
+        if chunk.message is not None:
+            self._complete(chunk.message, lookup, permit)
+        return chunk
+
+    def stream(self,
+               input: str | BaseMessage | List[BaseMessage],
+               response_format: BaseModel = None,) -> Iterator[AIMessageChunk]:
+        """
+        Stream the completion as it is generated.
+
+        Yields AIMessageChunks with content deltas and tool call fragments;
+        the last chunk carries the assembled AIMessage, the same one invoke
+        returns, including token_usage. Content deltas are also forwarded to
+        StateMachine stream listeners when called from a step. With a
+        response_format, the content is the JSON object being generated, for
+        the parse_stream of lib.parsers. Closing the iterator early aborts
+        the request; nothing is cached or recorded for it then.
+        """
+        payload, cached, lookup = self._prepare(input, response_format)
+        if cached is not None:
+            yield self._replay(cached)
+            return
+
+        # The permit is held until the stream ends
+        with self._limit(payload) as permit:
+            for chunk in self.backend.stream(payload):
+                yield self._forward(chunk, lookup, permit)
+
+    async def astream(self,
+                      input: str | BaseMessage | List[BaseMessage],
+                      response_format: BaseModel = None,) -> AsyncIterator[AIMessageChunk]:
+        """Asynchronous counterpart of stream"""
+        payload, cached, lookup = self._prepare(input, response_format)
+        if cached is not None:
+            yield self._replay(cached)
+            return
+
+        async with self._alimit(payload) as permit:
+            async for chunk in self.backend.astream(payload):
+                yield self._forward(chunk, lookup, permit)
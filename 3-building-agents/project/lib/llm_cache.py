@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lib.cache import Cache, LRUCache, stable_hash
+from lib.messages import AIMessage, TokenUsage
+
+
+def _key_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # A pydantic response_format class is keyed by its JSON schema, not its repr
+    response_format = payload.get("response_format")
+    if isinstance(response_format, type) and hasattr(response_format, "model_json_schema"):
+        payload = {**payload, "response_format": response_format.model_json_schema()}
+    return payload
+
+
+def completion_cache_key(payload: Dict[str, Any]) -> str:
+    """Stable hash of a chat completion payload (model, temperature, messages,
+    tools, response_format) as built by LLM._build_payload"""
+    return stable_hash(_key_payload(payload))
+
+
+def _cached_message(data: Dict[str, Any]) -> AIMessage:
+    # The stored usage was spent by the call that filled the entry
+    return AIMessage.model_validate({**data, "token_usage": TokenUsage().model_dump()})
+
+
+def _prompt_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{m.get('role')}: {m.get('content') or ''}" for m in messages)
+
+
+class SemanticCache:
+    """
+    Near-duplicate tier of a CompletionCache.
+
+    Prompts are embedded with `embed` and a cached completion is reused when
+    the cosine similarity to a stored prompt reaches `threshold`. Only prompts
+    sent with the same model, temperature, tools and response_format are
+    compared. Keep the threshold high: a hit returns an answer written for a
+    slightly different prompt.
+
+    Example:
+        >>> client = get_openai_client()
+        >>> embed = lambda text: client.embeddings.create(
+        ...     model="text-embedding-3-small", input=text).data[0].embedding
+        >>> semantic = SemanticCache(embed, threshold=0.97)
+    """
+
+    def __init__(self, embed: Callable[[str], Sequence[float]], threshold: float = 0.95,
+                 maxsize: int = 1024, ttl: Optional[float] = None):
+        self.embed = embed
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl  # seconds; None keeps entries until evicted
+        self.hits = 0
+        self.misses = 0
+        # entry id -> (scope, unit vector, value, expires_at), oldest first
+        self._entries: "OrderedDict[int, Tuple[str, np.ndarray, Any, Optional[float]]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"SemanticCache(size={len(self._entries)}, threshold={self.threshold})"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def vector(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, scope: str, vector: np.ndarray) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            candidates = [
+                (entry_id, entry) for entry_id, entry in self._entries.items()
+                if entry[0] == scope and (entry[3] is None or entry[3] >= now)
+            ]
+            value = None
+            if candidates:
+                similarities = np.stack([entry[1] for _, entry in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id, entry = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    value = entry[2]
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, scope: str, vector: np.ndarray, value: Any, ttl: Optional[float] = None):
+        ttl = ttl if ttl is not None else self.ttl
+        with self._lock:
+            self._entries[self._next_id] = (scope, vector, value, time.time() + ttl if ttl is not None else None)
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+@dataclass
+class CacheLookup:
+    """Where a missed completion should be stored once it is generated"""
+    key: str
+    scope: Optional[str] = None
+    vector: Optional[np.ndarray] = None
+
+
+class CompletionCache:
+    """
+    Cache of chat completions for LLM.invoke.
+
+    The exact tier is keyed on completion_cache_key(payload) and can be any
+    lib.cache backend (LRUCache in memory by default, DiskCache to persist
+    across processes). The optional semantic tier is consulted on an exact
+    miss. Entries are stored as plain dicts and rebuilt into AIMessages,
+    tool_calls included, so backends may serialize them. A hit costs no
+    tokens, so its token_usage is zeroed; callers summing token_usage count
+    only the calls that reached the API.
+
+    Only deterministic requests (temperature 0) are cached.
+    """
+
+    def __init__(self, backend: Optional[Cache] = None,
+                 semantic: Optional[SemanticCache] = None,
+                 ttl: Optional[float] = None):
+        self.backend = backend if backend is not None else LRUCache()
+        self.semantic = semantic
+        self.ttl = ttl  # overrides the backends' default TTL when set
+
+    def __repr__(self) -> str:
+        return f"CompletionCache(backend={self.backend!r}, semantic={self.semantic!r})"
+
+    def lookup(self, payload: Dict[str, Any]) -> Tuple[Optional[AIMessage], Optional[CacheLookup]]:
+        """Return the cached message, or None and where to store the completion.
+        Both are None when the payload is not cacheable."""
+        if payload.get("temperature") != 0:
+            return None, None
+
+        key_payload = _key_payload(payload)
+        lookup = CacheLookup(key=stable_hash(key_payload))
+        data = self.backend.get(lookup.key)
+        if data is not None:
+            return _cached_message(data), lookup
+
+        if self.semantic is not None:
+            lookup.scope = stable_hash({k: v for k, v in key_payload.items() if k != "messages"})
+            lookup.vector = self.semantic.vector(_prompt_text(payload["messages"]))
+            data = self.semantic.get(lookup.scope, lookup.vector)
+            if data is not None:
+                return _cached_message(data), lookup
+        return None, lookup
+
+    def store(self, lookup: CacheLookup, message: AIMessage):
+        data = message.model_dump()
+        self.backend.set(lookup.key, data, ttl=self.ttl)
+        if lookup.vector is not None:
+            self.semantic.set(lookup.scope, lookup.vector, data, ttl=self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+        if self.semantic is not None:
+            self.semantic.clear()
+
+    @property
+    def stats(self) -> dict:
+        stats = {"exact": self.backend.stats}
+        if self.semantic is not None:
+            stats["semantic"] = self.semantic.stats
+        return stats
@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 import copy
 
 from lib.documents import Document, Corpus
+from lib.state_machine import Run
 from lib.vector_db import VectorStoreManager,QueryResult
 
 
@@ -12,6 +13,13 @@ class SessionNotFoundError(Exception):
     pass
 
 
+def _copy(obj: Any) -> Any:
+    # Runs share their immutable snapshots; anything else is copied in full
+    if isinstance(obj, Run):
+        return obj.copy()
+    return copy.deepcopy(obj)
+
+
 @dataclass
 class ShortTermMemory():
     """Manage the history of objects across multiple sessions"""
@@ -85,7 +93,7 @@ class ShortTermMemory():
         """
         session_id = session_id or "default"
         self._validate_session(session_id)
-        self.sessions[session_id].append(copy.deepcopy(object))
+        self.sessions[session_id].append(_copy(object))
 
     def get_all_objects(self, session_id: Optional[str] = None) -> List[Any]:
         """Get all objects for a session
@@ -101,7 +109,7 @@ class ShortTermMemory():
         """
         session_id = session_id or "default"
         self._validate_session(session_id)
-        return [copy.deepcopy(obj) for obj in self.sessions[session_id]]
+        return [_copy(obj) for obj in self.sessions[session_id]]
 
     def get_last_object(self, session_id: Optional[str] = None) -> Optional[Any]:
         """Get the most recent object for a session
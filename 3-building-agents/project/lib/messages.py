@@ -1,44 +1,167 @@
-from pydantic import BaseModel
-from typing import Optional, Union, List, Dict, Literal
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Any, Dict, Literal, Optional, Sequence, Union
 
 from lib.tooling import ToolCall
 
 
-class BaseMessage(BaseModel):
-    role: str
-    content: Optional[str] = ""
+# Messages are immutable slotted dataclasses. Constructing one does no
+# validation, snapshots and memory share instances instead of copying them,
+# and the OpenAI wire dict is built once per message. Data from outside the
+# process (caches, checkpoints, recordings) goes through model_validate.
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class TokenUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cached_tokens: int = 0  # part of prompt_tokens served from the provider's prompt cache
+
+    def model_dump(self, **kwargs) -> Dict[str, int]:
+        return asdict(self)
 
-    def dict(self) -> Dict:
-        return dict(self)
+    @classmethod
+    def model_validate(cls, data: Union['TokenUsage', Dict[str, Any]]) -> 'TokenUsage':
+        if isinstance(data, cls):
+            return data
+        return cls(**{f.name: int(data.get(f.name) or 0) for f in fields(cls)})
 
 
+@dataclass(frozen=True, slots=True, kw_only=True)
+class BaseMessage:
+    role: str
+    content: Optional[str] = ""
+    # OpenAI wire dict, built on first use
+    _wire: Optional[Dict[str, Any]] = field(default=None, init=False, repr=False, compare=False)
+
+    def dict(self) -> Dict[str, Any]:
+        """The message in the OpenAI wire format. Built once and shared by
+        every payload the message is sent in; callers must not mutate it."""
+        wire = self._wire
+        if wire is None:
+            wire = self._to_wire()
+            object.__setattr__(self, "_wire", wire)
+        return wire
+
+    def _to_wire(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content}
+
+    def __copy__(self) -> 'BaseMessage':
+        return self
+
+    def __deepcopy__(self, memo: Dict) -> 'BaseMessage':
+        # Immutable, so every copy can be the message itself
+        return self
+
+    def model_dump(self, mode: Optional[str] = None, exclude_none: bool = False) -> Dict[str, Any]:
+        """Plain-dict form of every field, tool calls and token usage included"""
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+        if exclude_none:
+            data = {k: v for k, v in data.items() if v is not None}
+        return data
+
+    def model_copy(self, *, update: Optional[Dict[str, Any]] = None, deep: bool = False) -> 'BaseMessage':
+        return replace(self, **update) if update else self
+
+    @classmethod
+    def model_validate(cls, data: Union['BaseMessage', Dict[str, Any]]) -> 'BaseMessage':
+        """Build a message from untrusted data, checking field names and types"""
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict):
+            raise TypeError(f"Cannot build {cls.__name__} from {type(data).__name__}")
+        unknown = set(data) - {f.name for f in fields(cls) if f.init}
+        if unknown:
+            raise ValueError(f"Unknown {cls.__name__} fields: {sorted(unknown)}")
+        for name in ("content", "tool_call_id", "name"):
+            value = data.get(name)
+            if value is not None and not isinstance(value, str):
+                raise TypeError(f"{cls.__name__}.{name} must be a string, not {type(value).__name__}")
+        return cls(**data)
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
 class SystemMessage(BaseMessage):
     role: Literal["system"] = "system"
 
 
+@dataclass(frozen=True, slots=True, kw_only=True)
 class UserMessage(BaseMessage):
     role: Literal["user"] = "user"
 
 
+@dataclass(frozen=True, slots=True, kw_only=True)
 class ToolMessage(BaseMessage):
     role: Literal["tool"] = "tool"
     tool_call_id: str
     name: str
     content: str = ""
 
-
-class TokenUsage(BaseModel):
-    prompt_tokens: int = 0
-    completion_tokens: int = 0
-    total_tokens: int = 0
+    def _to_wire(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content,
+                "tool_call_id": self.tool_call_id, "name": self.name}
 
 
+@dataclass(frozen=True, slots=True, kw_only=True)
 class AIMessage(BaseMessage):
     role: Literal["assistant"] = "assistant"
     content: Optional[str] = ""
-    tool_calls: Optional[List[ToolCall]] = None
+    tool_calls: Optional[Sequence[ToolCall]] = None
     token_usage: Optional[TokenUsage] = None
 
+    def __post_init__(self):
+        # A tuple of frozen ToolCalls, so the message cannot change under the
+        # snapshots sharing it and stays hashable
+        if self.tool_calls is not None:
+            calls = self.tool_calls
+            if not isinstance(calls, tuple) or not all(type(call) is ToolCall for call in calls):
+                object.__setattr__(self, "tool_calls", tuple(ToolCall.model_validate(call) for call in calls))
+
+    def _to_wire(self) -> Dict[str, Any]:
+        wire = {"role": self.role, "content": self.content}
+        if self.tool_calls:
+            wire["tool_calls"] = [call.model_dump() for call in self.tool_calls]
+        return wire
+
+    def model_dump(self, mode: Optional[str] = None, exclude_none: bool = False) -> Dict[str, Any]:
+        data = BaseMessage.model_dump(self, mode, exclude_none)
+        if self.tool_calls is not None:
+            data["tool_calls"] = [call.model_dump() for call in self.tool_calls]
+        if self.token_usage is not None:
+            data["token_usage"] = self.token_usage.model_dump()
+        return data
+
+    @classmethod
+    def model_validate(cls, data: Union['AIMessage', Dict[str, Any]]) -> 'AIMessage':
+        if isinstance(data, dict):
+            data = dict(data)
+            if data.get("tool_calls") is not None:
+                if not isinstance(data["tool_calls"], (list, tuple)):
+                    raise TypeError(f"AIMessage.tool_calls must be a list, not {type(data['tool_calls']).__name__}")
+                data["tool_calls"] = tuple(ToolCall.model_validate(call) for call in data["tool_calls"])
+            if data.get("token_usage") is not None:
+                if not isinstance(data["token_usage"], (dict, TokenUsage)):
+                    raise TypeError(f"AIMessage.token_usage must be a dict, not {type(data['token_usage']).__name__}")
+                data["token_usage"] = TokenUsage.model_validate(data["token_usage"])
+        return BaseMessage.model_validate.__func__(cls, data)
+
+
+# Fragment of a tool call streamed by the model; fragments of one call share an index
+@dataclass(frozen=True, slots=True, kw_only=True)
+class ToolCallChunk:
+    index: int
+    id: Optional[str] = None
+    name: Optional[str] = None
+    arguments: str = ""
+
+
+# Incremental piece of a streamed AIMessage
+@dataclass(frozen=True, slots=True, kw_only=True)
+class AIMessageChunk:
+    content: str = ""
+    tool_call_chunks: Sequence[ToolCallChunk] = ()
+    message: Optional[AIMessage] = None  # the assembled message, on the final chunk only
+
 
 AnyMessage = Union[
     SystemMessage,
@@ -1,9 +1,13 @@
 import json
-from typing import Any, Type
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type
 from abc import ABC, abstractmethod
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError, create_model
 
-from lib.messages import AIMessage
+from lib.llm import LLM
+from lib.messages import AIMessage, AIMessageChunk
 
 
 class OutputParser(BaseModel, ABC):
@@ -26,14 +30,380 @@ class ToolOutputParser(BaseModel):
         } for call in ai_message.tool_calls]
 
 
+_STRING_SPECIAL = re.compile(r'["\\]')
+_NESTED_SPECIAL = re.compile(r'[\[\]{}"]')
+_CLOSERS = {"{": "}", "[": "]"}
+_MISSING = object()
+
+
+class IncrementalJsonParser:
+    """
+    Parser for a JSON object arriving in arbitrary pieces, e.g. the content
+    deltas of a streamed completion.
+
+    feed() scans each delta once and returns the top-level fields it
+    completed, parsed. Only the field still being generated is kept as
+    text, so the cost of a stream is linear in its length. `partial` is a
+    best-effort view of the object so far, including the unfinished field.
+    Anything before the opening brace, such as a markdown fence, is skipped.
+
+    Example:
+        >>> parser = IncrementalJsonParser()
+        >>> parser.feed('{"score": 9, "expl')
+        [('score', 9)]
+        >>> parser.feed('anation": "Goo')
+        []
+        >>> parser.partial
+        {'score': 9, 'explanation': 'Goo'}
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False  # the closing brace has been seen
+        self._text = ""  # unconsumed text: the key or value being generated
+        self._pos = 0  # scan position in _text
+        self._start = 0  # where the current key or value starts in _text
+        # start, key, colon, value, string, scalar, nested or comma
+        self._state = "start"
+        self._in_string = False
+        self._closers: List[str] = []  # of the containers open inside the current value
+        self._key: Optional[str] = None
+
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        """Consume a piece of the text; return the (name, value) of fields it completed"""
+        completed = []
+        if self.done or not delta:
+            return completed
+        text = self._text + delta
+        pos, end = self._pos, len(text)
+
+        while pos < end and not self.done:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(text, pos)
+                if match is None:
+                    pos = end
+                    break
+                pos = match.start()
+                if text[pos] == "\\":
+                    if pos + 1 == end:
+                        break  # the escaped character is in the next delta
+                    pos += 2
+                    continue
+                pos += 1
+                self._in_string = False
+                if self._state == "key":
+                    self._key = json.loads(text[self._start:pos])
+                    self._state = "colon"
+                elif self._state == "string":
+                    completed.append(self._complete(text[self._start:pos]))
+                continue
+
+            if self._state == "nested":
+                match = _NESTED_SPECIAL.search(text, pos)
+                if match is None:
+                    pos = end
+                    break
+                pos = match.start()
+                char = text[pos]
+                pos += 1
+                if char == '"':
+                    self._in_string = True
+                elif char in _CLOSERS:
+                    self._closers.append(_CLOSERS[char])
+                else:
+                    self._closers.pop()
+                    if not self._closers:
+                        completed.append(self._complete(text[self._start:pos]))
+                continue
+
+            char = text[pos]
+            if self._state == "scalar":
+                # Numbers, true, false and null end at the next delimiter
+                if char in ",}" or char.isspace():
+                    completed.append(self._complete(text[self._start:pos]))
+                    continue  # the delimiter is handled in the comma state
+                pos += 1
+                continue
+            pos += 1
+            if char.isspace():
+                continue
+            if self._state == "start":
+                if char == "{":
+                    self._state = "key"
+            elif self._state == "key":
+                if char == '"':
+                    self._start = pos - 1
+                    self._in_string = True
+                elif char == "}":
+                    self.done = True
+            elif self._state == "colon":
+                if char == ":":
+                    self._state = "value"
+            elif self._state == "value":
+                self._start = pos - 1
+                if char == '"':
+                    self._state = "string"
+                    self._in_string = True
+                elif char in _CLOSERS:
+                    self._state = "nested"
+                    self._closers.append(_CLOSERS[char])
+                else:
+                    self._state = "scalar"
+            elif self._state == "comma":
+                if char == ",":
+                    self._state = "key"
+                elif char == "}":
+                    self.done = True
+
+        # Keep only the text of the unfinished key or value
+        pending = self._state in ("string", "scalar", "nested") or (self._state == "key" and self._in_string)
+        cut = self._start if pending else pos
+        self._text = text[cut:]
+        self._pos = pos - cut
+        self._start -= cut
+        return completed
+
+    def _complete(self, value_text: str) -> Tuple[str, Any]:
+        value = json.loads(value_text)
+        self.fields[self._key] = value
+        self._state = "comma"
+        self._start = 0
+        return self._key, value
+
+    @property
+    def partial(self) -> Dict[str, Any]:
+        """The completed fields plus, when it parses once closed, the unfinished one"""
+        partial = dict(self.fields)
+        value = self._pending_value()
+        if value is not _MISSING:
+            partial[self._key] = value
+        return partial
+
+    def _pending_value(self) -> Any:
+        if self._state not in ("string", "scalar", "nested"):
+            return _MISSING
+        fragment = self._text[self._start:]
+        if self._in_string:
+            if (len(fragment) - len(fragment.rstrip("\\"))) % 2:
+                fragment = fragment[:-1]  # drop a dangling escape
+            fragment += '"'
+        candidates = [fragment + "".join(reversed(self._closers))]
+        if self._closers:
+            # A trailing comma or key without a value, inside a container
+            trimmed = re.sub(r',?\s*"(?:[^"\\]|\\.)*"\s*:?\s*$|,\s*$', "", fragment)
+            candidates.append(trimmed + "".join(reversed(self._closers)))
+        for candidate in candidates:
+            try:
+                return json.loads(candidate)
+            except ValueError:
+                pass
+        return _MISSING
+
+
+@dataclass
+class ParseEvent:
+    """
+    Progress of parse_stream: one event per completed top-level field, then
+    a final event with the output (done=True).
+    """
+    fields: Dict[str, Any]  # fields completed so far that passed validation
+    name: Optional[str] = None  # field completed by this event
+    value: Any = None
+    error: Optional[ValidationError] = None  # the field's value did not match the schema
+    output: Any = None  # the parsed output, on the final event unless stopped early
+    done: bool = False
+    stopped: bool = False  # stop_when ended the stream before the output was complete
+
+
+class _StreamState:
+    """Text and fields of one stream being parsed"""
+
+    def __init__(self, parser: 'JsonOutputParser'):
+        self.parser = parser
+        self.json = IncrementalJsonParser()
+        self.content: List[str] = []
+        self.message: Optional[AIMessage] = None
+        self.valid: Dict[str, Any] = {}
+
+    def feed(self, chunk: AIMessageChunk) -> List[ParseEvent]:
+        if chunk.message is not None:
+            self.message = chunk.message
+        if not chunk.content:
+            return []
+        self.content.append(chunk.content)
+        events = []
+        for name, value in self.json.feed(chunk.content):
+            value, error = self.parser._validate_field(name, value)
+            if error is None:
+                self.valid[name] = value
+            events.append(ParseEvent(fields=dict(self.valid), name=name, value=value, error=error))
+        return events
+
+    @property
+    def text(self) -> str:
+        # The assembled message is authoritative when the stream got that far
+        if self.message is not None and self.message.content is not None:
+            return self.message.content
+        return "".join(self.content)
+
+    def stopped(self) -> ParseEvent:
+        return ParseEvent(fields=dict(self.valid), done=True, stopped=True)
+
+    def finished(self, output: Any) -> ParseEvent:
+        return ParseEvent(fields=dict(self.valid), output=output, done=True)
+
+
 class JsonOutputParser(OutputParser):
     def parse(self, ai_message: AIMessage) -> Any:
         return json.loads(ai_message.content)
 
+    def _validate_field(self, name: str, value: Any) -> Tuple[Any, Optional[ValidationError]]:
+        return value, None
+
+    def _final_output(self, state: _StreamState, llm: Optional[LLM]) -> Any:
+        return json.loads(state.text)
+
+    async def _afinal_output(self, state: _StreamState, llm: Optional[LLM]) -> Any:
+        return self._final_output(state, llm)
+
+    def parse_stream(self,
+                     chunks: Iterable[AIMessageChunk],
+                     stop_when: Optional[Callable[[ParseEvent], bool]] = None,
+                     llm: Optional[LLM] = None) -> Iterator[ParseEvent]:
+        """
+        Parse a streamed completion (LLM.stream) as it arrives.
+
+        Yields a ParseEvent as soon as each top-level field is complete,
+        then a final one with the output, as parse would return it. When
+        stop_when returns True for an event, the stream is closed, which
+        aborts the request, and a final event with stopped=True follows.
+        `llm` answers repair requests of parsers with a schema.
+        """
+        state = _StreamState(self)
+        try:
+            for chunk in chunks:
+                for event in state.feed(chunk):
+                    yield event
+                    if stop_when is not None and stop_when(event):
+                        yield state.stopped()
+                        return
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        yield state.finished(self._final_output(state, llm))
+
+    async def aparse_stream(self,
+                            chunks: AsyncIterable[AIMessageChunk],
+                            stop_when: Optional[Callable[[ParseEvent], bool]] = None,
+                            llm: Optional[LLM] = None) -> AsyncIterator[ParseEvent]:
+        """Asynchronous counterpart of parse_stream, for LLM.astream"""
+        state = _StreamState(self)
+        try:
+            async for chunk in chunks:
+                for event in state.feed(chunk):
+                    yield event
+                    if stop_when is not None and stop_when(event):
+                        yield state.stopped()
+                        return
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        yield state.finished(await self._afinal_output(state, llm))
+
+
+@lru_cache(maxsize=None)
+def _field_adapter(model_class: Type[BaseModel], name: str) -> Optional[TypeAdapter]:
+    field_info = model_class.model_fields.get(name)
+    return TypeAdapter(field_info.annotation) if field_info is not None else None
+
+
+@lru_cache(maxsize=None)
+def _repair_model(model_class: Type[BaseModel], names: Tuple[str, ...]) -> Type[BaseModel]:
+    # The schema of only the fields to fix, so the reply is no longer than it must be
+    return create_model(
+        f"{model_class.__name__}Repair",
+        **{name: (model_class.model_fields[name].annotation, model_class.model_fields[name]) for name in names},
+    )
 
-class PydanticOutputParser(OutputParser):
+
+class PydanticOutputParser(JsonOutputParser):
+    """
+    Parses a completion into `model_class`.
+
+    While streaming, each top-level field is validated against its
+    annotation as soon as it is complete. When the finished output fails
+    validation and parse_stream has an `llm`, only the failing fields are
+    requested again (see repair) rather than the whole completion.
+    """
     model_class: Type[BaseModel]
 
     def parse(self, ai_message: AIMessage) -> BaseModel:
         return self.model_class.model_validate_json(ai_message.content)
-    
\ No newline at end of file
+
+    def _validate_field(self, name: str, value: Any) -> Tuple[Any, Optional[ValidationError]]:
+        adapter = _field_adapter(self.model_class, name)
+        if adapter is None:
+            return value, None
+        try:
+            return adapter.validate_python(value), None
+        except ValidationError as e:
+            return value, e
+
+    def _final_output(self, state: _StreamState, llm: Optional[LLM]) -> BaseModel:
+        try:
+            return self.model_class.model_validate_json(state.text)
+        except ValidationError as e:
+            if llm is None:
+                raise
+            return self.repair(llm, state.json.fields, e)
+
+    async def _afinal_output(self, state: _StreamState, llm: Optional[LLM]) -> BaseModel:
+        try:
+            return self.model_class.model_validate_json(state.text)
+        except ValidationError as e:
+            if llm is None:
+                raise
+            return await self.arepair(llm, state.json.fields, e)
+
+    def _failed_fields(self, fields: Dict[str, Any], error: ValidationError) -> Tuple[str, ...]:
+        located = {e["loc"][0] for e in error.errors() if e["loc"]}
+        failed = tuple(
+            name for name in self.model_class.model_fields
+            if name in located or name not in fields or self._validate_field(name, fields[name])[1] is not None
+        )
+        # A model-level validator failing on valid fields: ask for everything
+        return failed or tuple(self.model_class.model_fields)
+
+    def _repair_request(self, fields: Dict[str, Any], error: ValidationError) -> Tuple[str, Type[BaseModel]]:
+        names = self._failed_fields(fields, error)
+        prompt = (
+            f"A JSON object for the {self.model_class.__name__} schema failed validation.\n"
+            f"Object: {json.dumps(fields, default=str)}\n"
+            f"Errors: {error}\n"
+            f"Reply with corrected values for only these fields: {', '.join(names)}."
+        )
+        return prompt, _repair_model(self.model_class, names)
+
+    def _apply_repair(self, fields: Dict[str, Any], repair_model: Type[BaseModel], reply: AIMessage) -> BaseModel:
+        patch = repair_model.model_validate_json(reply.content).model_dump()
+        kept = {name: value for name, value in fields.items() if name not in patch}
+        return self.model_class.model_validate({**kept, **patch})
+
+    def repair(self, llm: LLM, fields: Dict[str, Any], error: ValidationError) -> BaseModel:
+        """
+        Fix an output that failed validation with one small request.
+
+        The model gets the fields parsed so far and the validation errors,
+        without the original conversation, and replies with the failing or
+        missing fields only, which are merged into the others. Raises
+        ValidationError if the result is still invalid.
+        """
+        prompt, repair_model = self._repair_request(fields, error)
+        return self._apply_repair(fields, repair_model, llm.invoke(prompt, response_format=repair_model))
+
+    async def arepair(self, llm: LLM, fields: Dict[str, Any], error: ValidationError) -> BaseModel:
+        """Asynchronous counterpart of repair"""
+        prompt, repair_model = self._repair_request(fields, error)
+        return self._apply_repair(fields, repair_model, await llm.ainvoke(prompt, response_format=repair_model))
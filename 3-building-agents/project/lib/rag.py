@@ -1,6 +1,7 @@
-from typing import TypedDict, List
+from typing import Iterator, TypedDict, List, Optional
 import logging
 
+from lib.cache import Cache
 from lib.state_machine import StateMachine, Step, EntryPoint, Termination, Run, Resource
 from lib.llm import LLM
 from lib.messages import BaseMessage, UserMessage, SystemMessage
@@ -19,6 +20,7 @@ class RAGState(TypedDict):
     documents: List[str]
     distances: List[float]
     answer: str
+    total_tokens: int
 
 class RAG:
     """
@@ -32,7 +34,18 @@ class RAG:
     The RAG pattern enhances LLM responses by providing relevant external knowledge,
     reducing hallucinations and improving factual accuracy.
     """
-    def __init__(self, llm: LLM, vector_store: VectorStore):
+    def __init__(self, llm: LLM, vector_store: VectorStore, cache: Optional[Cache] = None):
+        """
+        Args:
+            llm: Model used by the generate step
+            vector_store: Store queried by the retrieve step
+            cache: Optional cache memoizing the retrieve and augment steps, so a
+                repeated question skips the vector search. Keys include the
+                vector store's collection and document count, so the cache can
+                be shared between RAG instances or outlive a re-index.
+        """
+        self.cache = cache
+        self.vector_store = vector_store
         self.workflow = self._create_state_machine()
         self.resource = Resource(
             vars = {
@@ -77,6 +90,7 @@ class RAG:
         return {
             "answer": ai_message.content, 
             "messages": state["messages"] + [ai_message],
+            "total_tokens": ai_message.token_usage.total_tokens if ai_message.token_usage else 0,
         }
 
     def _create_state_machine(self) -> StateMachine[RAGState]:
@@ -84,8 +98,11 @@ class RAG:
 
         # Create steps
         entry = EntryPoint[RAGState]()
-        retrieve = Step[RAGState]("retrieve", self._retrieve)
-        augment = Step[RAGState]("augment", self._augment)
+        retrieve = Step[RAGState]("retrieve", self._retrieve,
+                                  reads=["question"], cache=self.cache,
+                                  cache_salt=self.vector_store)
+        augment = Step[RAGState]("augment", self._augment,
+                                 reads=["question", "documents"], cache=self.cache)
         generate = Step[RAGState]("generate", self._generate)
         termination = Termination[RAGState]()
 
@@ -125,3 +142,27 @@ class RAG:
             resource = self.resource,
         )
         return run_object
+
+    def invoke_many(self, queries: List[str], concurrency: int = 8) -> Iterator[Run]:
+        """
+        Execute the RAG pipeline for many independent queries concurrently.
+
+        Runs are yielded as they complete; each final state carries its
+        "question". Pair with VectorStoreManager(batch_embeddings=True) so the
+        concurrent retrieve steps share embedding requests.
+
+        Args:
+            queries (List[str]): Questions to answer
+            concurrency (int): Maximum number of pipelines running at once
+
+        Example:
+            >>> for run in rag.invoke_many(questions, concurrency=16):
+            ...     state = run.get_final_state()
+            ...     print(state["question"], state["answer"])
+        """
+        initial_states = [{"question": query} for query in queries]
+        return self.workflow.run_many(
+            initial_states,
+            resource=self.resource,
+            concurrency=concurrency,
+        )
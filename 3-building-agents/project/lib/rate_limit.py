@@ -0,0 +1,329 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional
+
+from lib.instrumentation import record_queue_wait
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Whether an exception is an HTTP 429 from the provider (openai.RateLimitError and the like)"""
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+class TokenBucket:
+    """
+    Continuously refilled budget of `rate` units per minute, up to `capacity`.
+
+    Callers reserve units up front and sleep the returned wait. The balance
+    may go negative, so a reservation larger than the capacity still goes
+    through, and waiting callers are served in reservation order.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate  # units per minute
+        self.capacity = capacity if capacity is not None else rate
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"TokenBucket(rate={self.rate}/min, available={self.available:.0f})"
+
+    def _refill(self, now: float):
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.rate / 60)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._available
+
+    def reserve(self, amount: float) -> float:
+        """Take amount units; return the seconds to wait until they are covered"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available -= amount
+            return max(0.0, -self._available * 60 / self.rate)
+
+    def refund(self, amount: float):
+        """Give back units (negative to take more), e.g. once actual usage is known"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available = min(self.capacity, self._available + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on the number of requests in flight.
+
+    Every successful request raises the limit by about `increase` per limit's
+    worth of requests (additive increase); a 429, or a latency above
+    `latency_target`, multiplies it by `decrease` (multiplicative decrease),
+    at most once per `cooldown` seconds so one burst of errors counts once.
+    Slots are handed to waiters in arrival order, from threads and event
+    loops alike.
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 increase: float = 1.0, decrease: float = 0.5,
+                 latency_target: Optional[float] = None, cooldown: float = 1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target  # seconds; None ignores latency
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._limit = float(initial)
+        self._last_decrease = 0.0
+        self._waiters: Deque[Callable[[], None]] = deque()
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"AdaptiveConcurrency(limit={self.limit}, in_flight={self.in_flight}, waiting={len(self._waiters)})"
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def _try_acquire(self) -> bool:
+        if not self._waiters and self.in_flight < self.limit:
+            self.in_flight += 1
+            return True
+        return False
+
+    def _wake(self):
+        # Hand free slots to the oldest waiters; the slot is counted on their behalf
+        while self._waiters and self.in_flight < self.limit:
+            self.in_flight += 1
+            self._waiters.popleft()()
+
+    def acquire(self):
+        with self._lock:
+            if self._try_acquire():
+                return
+            event = threading.Event()
+            self._waiters.append(event.set)
+        event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if future.cancelled():
+                self.release()  # the waiter gave up after being handed a slot
+            elif not future.done():
+                future.set_result(None)
+
+        def waiter():
+            loop.call_soon_threadsafe(resolve)
+
+        with self._lock:
+            if self._try_acquire():
+                return
+            self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self, latency: Optional[float] = None, rate_limited: bool = False):
+        """Free a slot and adapt the limit to how the request went"""
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if rate_limited or (self.latency_target is not None and latency is not None
+                                and latency > self.latency_target):
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.min_limit, self._limit * self.decrease)
+                    self._last_decrease = now
+            elif latency is not None:
+                self._limit = min(self.max_limit, self._limit + self.increase / self._limit)
+            self._wake()
+
+
+@dataclass
+class Permit:
+    """Admission of one request by a RateLimiter"""
+    tokens: int  # tokens reserved up front
+    queue_wait: float = 0.0  # seconds spent waiting for admission
+    started: float = field(default_factory=time.monotonic)
+    _adjustment: int = 0
+    _recorded: bool = False
+
+    def record_usage(self, total_tokens: int):
+        """Correct the reservation with the tokens the request actually used"""
+        self._adjustment = total_tokens - self.tokens
+        self._recorded = True
+
+
+class RateLimiter:
+    """
+    Admission control for one model or endpoint: requests per minute, tokens
+    per minute and an optional adaptive concurrency limit.
+
+    A request waits for a concurrency slot, then for its request and
+    estimated token reservations. Once it completes, the token reservation
+    is corrected to the actual usage and its latency, or 429, adapts the
+    concurrency limit. A request that fails without reporting its usage
+    gives its whole token reservation back. The time spent waiting is added to the current step's
+    StepMetrics.queue_wait and to stats.
+
+    Share one limiter per model through get_rate_limiter, from any thread or
+    event loop.
+
+    Example:
+        >>> limiter = get_rate_limiter("gpt-4o-mini", requests_per_minute=500,
+        ...                            tokens_per_minute=200_000, max_concurrency=32)
+        >>> llm = LLM(model="gpt-4o-mini", rate_limiter=limiter)
+    """
+
+    def __init__(self, name: str = "default",
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 concurrency: Optional[AdaptiveConcurrency] = None):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency
+        self.admitted = 0
+        self.rate_limited = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"RateLimiter('{self.name}')"
+
+    def _reserve(self, tokens: int) -> float:
+        wait = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def _admitted(self, tokens: int, started: float) -> Permit:
+        permit = Permit(tokens=tokens, queue_wait=time.monotonic() - started)
+        with self._lock:
+            self.admitted += 1
+            self.queue_wait_total += permit.queue_wait
+            self.queue_wait_max = max(self.queue_wait_max, permit.queue_wait)
+        record_queue_wait(permit.queue_wait)
+        return permit
+
+    def acquire(self, tokens: int = 0) -> Permit:
+        """Block until a request of about `tokens` tokens may be sent"""
+        started = time.monotonic()
+        if self.concurrency:
+            self.concurrency.acquire()
+        try:
+            wait = self._reserve(tokens)
+            if wait:
+                time.sleep(wait)
+        except BaseException:
+            if self.concurrency:
+                self.concurrency.release()
+            raise
+        return self._admitted(tokens, started)
+
+    async def aacquire(self, tokens: int = 0) -> Permit:
+        """Asynchronous counterpart of acquire; waits without blocking the loop"""
+        started = time.monotonic()
+        if self.concurrency:
+            await self.concurrency.aacquire()
+        try:
+            wait = self._reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+        except BaseException:
+            if self.concurrency:
+                self.concurrency.release()
+            raise
+        return self._admitted(tokens, started)
+
+    def release(self, permit: Permit, error: Optional[BaseException] = None):
+        rate_limited = error is not None and is_rate_limit_error(error)
+        if rate_limited:
+            with self._lock:
+                self.rate_limited += 1
+        if self.tokens:
+            if error is not None and not permit._recorded:
+                # No usage came back; a failed request is not billed
+                self.tokens.refund(permit.tokens)
+            elif permit._adjustment:
+                self.tokens.refund(-permit._adjustment)
+        if self.concurrency:
+            # Failures other than 429 say nothing about capacity
+            latency = time.monotonic() - permit.started if error is None else None
+            self.concurrency.release(latency, rate_limited)
+
+    @contextmanager
+    def limit(self, tokens: int = 0):
+        """Hold a permit around one request; 429s raised inside count as such"""
+        permit = self.acquire(tokens)
+        error = None
+        try:
+            yield permit
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(permit, error)
+
+    @asynccontextmanager
+    async def alimit(self, tokens: int = 0):
+        """Asynchronous counterpart of limit"""
+        permit = await self.aacquire(tokens)
+        error = None
+        try:
+            yield permit
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(permit, error)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "admitted": self.admitted,
+                "rate_limited": self.rate_limited,
+                "queue_wait_total": self.queue_wait_total,
+                "queue_wait_max": self.queue_wait_max,
+                "queue_wait_mean": self.queue_wait_total / self.admitted if self.admitted else 0.0,
+            }
+        if self.concurrency:
+            stats["concurrency_limit"] = self.concurrency.limit
+            stats["in_flight"] = self.concurrency.in_flight
+        return stats
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, requests_per_minute: Optional[float] = None,
+                     tokens_per_minute: Optional[float] = None,
+                     max_concurrency: Optional[int] = None) -> RateLimiter:
+    """Process-wide rate limiter for a model or endpoint (e.g. "gpt-4o-mini"),
+    shared by every LLM and embedding function naming it. Limits apply on first
+    creation; max_concurrency caps an adaptive limit starting at a quarter of it."""
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            concurrency = None
+            if max_concurrency:
+                concurrency = AdaptiveConcurrency(initial=max(1, max_concurrency // 4), max_limit=max_concurrency)
+            _rate_limiters[name] = RateLimiter(name, requests_per_minute, tokens_per_minute, concurrency)
+        return _rate_limiters[name]
@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type, Union
+
+
+class StepTimeoutError(TimeoutError):
+    """Raised when a step exceeds its policy deadline"""
+    pass
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing downstream dependency for a while.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail fast with CircuitOpenError. Once recovery_timeout seconds have passed,
+    one trial call is let through (half-open); success closes the circuit,
+    failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"CircuitBreaker('{self.name}', state={self.state})"
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == self.OPEN or (state == self.HALF_OPEN and self._trial_in_flight):
+                raise CircuitOpenError(f"Circuit '{self.name}' is open")
+            if state == self.HALF_OPEN:
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, failure_threshold: int = 5,
+                        recovery_timeout: float = 30.0) -> CircuitBreaker:
+    """Process-wide circuit breaker for a named dependency (e.g. "openai"),
+    shared by every step and run that names it. Thresholds apply on first creation."""
+    with _circuit_breakers_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(name, failure_threshold, recovery_timeout)
+        return _circuit_breakers[name]
+
+
+@dataclass
+class RetryPolicy:
+    """Retry with exponential backoff and full jitter"""
+    max_attempts: int = 3  # including the first attempt
+    initial_delay: float = 0.5  # seconds
+    max_delay: float = 30.0
+    multiplier: float = 2.0
+    jitter: bool = True
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,)
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before the given retry (1 for the first retry)"""
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** (retry - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        if isinstance(error, CircuitOpenError):
+            return False
+        return attempt < self.max_attempts and isinstance(error, self.retry_on)
+
+
+@dataclass
+class StepPolicy:
+    """
+    Failure handling the StateMachine applies around a step.
+
+    Attributes:
+        timeout: Seconds an attempt may take before StepTimeoutError. Sync logic
+            keeps running in its abandoned worker thread; async logic is cancelled.
+        retry: Retry policy for failed attempts (no retries when None)
+        fallback: Step id to transition to once every attempt failed, instead of
+            failing the run. The state passes through unchanged and the failure
+            is recorded in the snapshot metrics.
+        circuit_breaker: Breaker, or name of a shared one, guarding the dependency
+    """
+    timeout: Optional[float] = None
+    retry: Optional[RetryPolicy] = None
+    fallback: Optional[str] = None
+    circuit_breaker: Optional[Union[str, CircuitBreaker]] = field(default=None)
+
+    def __post_init__(self):
+        if isinstance(self.circuit_breaker, str):
+            self.circuit_breaker = get_circuit_breaker(self.circuit_breaker)
+
+    def _should_retry(self, error: BaseException, attempt: int) -> bool:
+        return self.retry is not None and self.retry.should_retry(error, attempt)
+
+    def call(self, fn: Callable[[], Any], on_retry: Optional[Callable[[int], None]] = None) -> Any:
+        """Call fn under this policy; on_retry receives the retry number"""
+        attempt = 1
+        while True:
+            try:
+                return self._attempt(fn)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                if on_retry:
+                    on_retry(attempt)
+                time.sleep(self.retry.delay(attempt))
+                attempt += 1
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]],
+                    on_retry: Optional[Callable[[int], None]] = None) -> Any:
+        """Asynchronous counterpart of call; fn returns a fresh awaitable per attempt"""
+        attempt = 1
+        while True:
+            try:
+                return await self._aattempt(fn)
+            except Exception as e:
+                if not self._should_retry(e, attempt):
+                    raise
+                if on_retry:
+                    on_retry(attempt)
+                await asyncio.sleep(self.retry.delay(attempt))
+                attempt += 1
+
+    def _attempt(self, fn: Callable[[], Any]) -> Any:
+        breaker = self.circuit_breaker
+        if breaker:
+            breaker.before_call()
+        try:
+            result = call_with_timeout(fn, self.timeout) if self.timeout else fn()
+        except Exception:
+            if breaker:
+                breaker.record_failure()
+            raise
+        if breaker:
+            breaker.record_success()
+        return result
+
+    async def _aattempt(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        breaker = self.circuit_breaker
+        if breaker:
+            breaker.before_call()
+        try:
+            if self.timeout:
+                try:
+                    result = await asyncio.wait_for(fn(), self.timeout)
+                except asyncio.TimeoutError:
+                    raise StepTimeoutError(f"Attempt exceeded {self.timeout}s")
+            else:
+                result = await fn()
+        except Exception:
+            if breaker:
+                breaker.record_failure()
+            raise
+        if breaker:
+            breaker.record_success()
+        return result
+
+
+def call_with_timeout(fn: Callable[[], Any], timeout: float) -> Any:
+    """Call fn, raising StepTimeoutError if it has not returned within timeout seconds"""
+    # Run in a daemon thread so a hung call can be abandoned; the context is
+    # copied so token usage still lands on the calling step's metrics
+    context = contextvars.copy_context()
+    outcome: Dict[str, Any] = {}
+
+    def target():
+        try:
+            outcome["result"] = context.run(fn)
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        raise StepTimeoutError(f"Attempt exceeded {timeout}s")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
@@ -1,21 +1,73 @@
-from typing import Any, Callable, Dict, List, Optional, Union, TypeVar, Generic, cast, Type, TypedDict, get_type_hints
-from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, ClassVar, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union, TypeVar, Generic, cast, Type, TypedDict, get_type_hints
+from dataclasses import dataclass, field, replace
 from datetime import datetime
-import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import asyncio
 import copy
+import logging
+import queue
+import threading
+import time
+import uuid
 import inspect
 
+from lib.cache import Cache, stable_hash
+from lib.instrumentation import StepMetrics, StepObserver, current_step_metrics
+from lib.resilience import StepPolicy
+
+if TYPE_CHECKING:
+    # lib.checkpoint imports this module
+    from lib.checkpoint import Checkpointer
+
 
 StateSchema = TypeVar("StateSchema")
 
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def schema_fields(state_schema: Type[StateSchema]) -> FrozenSet[str]:
+    """Field names of a TypedDict state schema, resolved once per schema"""
+    return frozenset(get_type_hints(state_schema))
+
+
 @dataclass
 class Resource:
     vars: Dict[str, Any]
 
 class Step(Generic[StateSchema]):
-    def __init__(self, step_id: str, logic: Callable[[StateSchema], Dict]):
+    def __init__(self, step_id: str, logic: Callable[[StateSchema], Dict],
+                 reads: Optional[List[str]] = None,
+                 cache: Optional[Cache] = None,
+                 policy: Optional[StepPolicy] = None,
+                 cache_salt: Any = None):
+        """
+        Args:
+            step_id: Unique identifier of the step in its workflow
+            logic: Function receiving the state (and optionally the Resource)
+                and returning the fields to update. Return new values rather
+                than mutating the state's lists or dicts in place: snapshots
+                share them, so an in-place change rewrites the run's history.
+            reads: State fields the logic depends on. Required with cache.
+            cache: Opt-in memoization. When set, the logic result is cached under
+                a stable hash of the `reads` fields and reused on identical input,
+                so the logic must be a pure function of those fields.
+            policy: Timeout, retry, fallback and circuit breaker settings the
+                StateMachine applies when running the step
+            cache_salt: Hashed into the cache key along with `reads`, for what the
+                logic depends on outside the state, e.g. the vector store a
+                retrieve step queries. Objects defining __cache_key__ are
+                re-keyed on every lookup, so they can report a new version.
+        """
+        if cache is not None and not reads:
+            raise ValueError(f"Step '{step_id}' needs `reads` to be memoized")
         self.step_id = step_id
         self.logic = logic
+        self.reads = list(reads) if reads else None
+        self.cache = cache
+        self.cache_salt = cache_salt
+        self.policy = policy
         # Store the number of parameters the logic function expects
         self.logic_params_count = self._calculate_params_count()
 
@@ -34,19 +86,21 @@ class Step(Generic[StateSchema]):
             # For regular functions
             return self.logic.__code__.co_argcount
 
-    def run(self, state: StateSchema, state_schema: Type[StateSchema], resource: Resource=None) -> StateSchema:
+    def _call_logic(self, state: StateSchema, resource: Resource = None) -> Any:
         # Call logic function with appropriate number of arguments
         if self.logic_params_count == 1:
-            result = self.logic(state)
+            return self.logic(state)
         elif self.logic_params_count == 2:
-            result = self.logic(state, resource)
+            return self.logic(state, resource)
         else:
             raise ValueError(
                 f"Step '{self.step_id}' logic function must accept either 1 argument (state) "
                 f"or 2 arguments (state, resource). Found {self.logic_params_count} arguments."
             ) 
+
+    def _apply(self, state: StateSchema, state_schema: Type[StateSchema], result: Dict) -> StateSchema:
         # Get expected fields from the TypedDict
-        expected_fields = get_type_hints(state_schema)
+        expected_fields = schema_fields(state_schema)
         
         # Create new state with all fields from state_schema
         # Only copy fields that are defined in state_schema
@@ -57,6 +111,54 @@ class Step(Generic[StateSchema]):
         
         return cast(StateSchema, updated)
 
+    def _cache_key(self, state: StateSchema) -> str:
+        logic = getattr(self.logic, "__func__", self.logic)
+        return stable_hash({
+            "step_id": self.step_id,
+            "logic": f"{getattr(logic, '__module__', '')}.{getattr(logic, '__qualname__', '')}",
+            "salt": self.cache_salt,
+            "reads": {field: state.get(field) for field in self.reads},
+        })
+
+    def _cached_result(self, key: Optional[str]) -> Optional[Dict]:
+        if key is None:
+            return None
+        result = self.cache.get(key)
+        metrics = current_step_metrics()
+        if metrics is not None:
+            metrics.cache_hit = result is not None
+        return result
+
+    def run(self, state: StateSchema, state_schema: Type[StateSchema], resource: Resource=None) -> StateSchema:
+        key = self._cache_key(state) if self.cache is not None else None
+        result = self._cached_result(key)
+        if result is not None:
+            return self._apply(state, state_schema, result)
+
+        result = self._call_logic(state, resource)
+        if inspect.isawaitable(result):
+            result.close()
+            raise TypeError(
+                f"Step '{self.step_id}' has async logic. Use StateMachine.arun to execute it."
+            )
+        if key is not None:
+            self.cache.set(key, result)
+        return self._apply(state, state_schema, result)
+
+    async def arun(self, state: StateSchema, state_schema: Type[StateSchema], resource: Resource=None) -> StateSchema:
+        """Run the step from an event loop, awaiting the logic if it is a coroutine"""
+        key = self._cache_key(state) if self.cache is not None else None
+        result = self._cached_result(key)
+        if result is not None:
+            return self._apply(state, state_schema, result)
+
+        result = self._call_logic(state, resource)
+        if inspect.isawaitable(result):
+            result = await result
+        if key is not None:
+            self.cache.set(key, result)
+        return self._apply(state, state_schema, result)
+
 
 class EntryPoint(Step[StateSchema]):
     """Special step that marks the beginning of the workflow.
@@ -72,6 +174,63 @@ class Termination(Step[StateSchema]):
         super().__init__("__termination__", lambda x: {})
 
 
+def _branch_delta(base: Any, value: Any) -> Any:
+    """What a branch changed in a field: the items appended to a list, tuple or
+    string, the keys added or changed in a dict, the members added to a set.
+    Any other value is returned whole. A sequence that does not extend base
+    (replaced, shortened or reordered) raises ValueError: its items cannot be
+    told apart from the ones before the fan-out."""
+    if isinstance(value, (list, tuple, str)) and isinstance(base, (list, tuple, str)):
+        if type(value) is type(base) and len(value) >= len(base) and value[:len(base)] == base:
+            return value[len(base):]
+        raise ValueError("the branch replaced the value instead of appending to it")
+    if isinstance(value, dict) and isinstance(base, dict):
+        return {k: v for k, v in value.items() if k not in base or (base[k] is not v and base[k] != v)}
+    if isinstance(value, (set, frozenset)) and isinstance(base, (set, frozenset)):
+        return value - base
+    return value
+
+
+class Merge(Step[StateSchema]):
+    """Special step that joins parallel branches back into a single state.
+    When a transition resolves to several targets, each target runs as its own
+    branch until it reaches this step. Each branch's change to a field with a
+    reducer is folded into it as reducer(current, branch_delta), starting from
+    the value before the fan-out; the delta is what the branch appended or
+    added (see _branch_delta), so with operator.add two branches appending to
+    a list yield the shared prefix once followed by both additions. A branch
+    that replaces or shortens such a list raises ValueError instead of being
+    appended again. Fields without a reducer keep the value of the last
+    branch, in target order."""
+    def __init__(self, step_id: str,
+                 reducers: Optional[Dict[str, Callable[[Any, Any], Any]]] = None,
+                 logic: Optional[Callable[[StateSchema], Dict]] = None):
+        super().__init__(step_id, logic or (lambda x: {}))
+        self.reducers = reducers or {}
+
+    def reduce(self, base: StateSchema, branch_states: List[StateSchema]) -> StateSchema:
+        merged = {**base}
+        updated_fields = set()
+        for branch_state in branch_states:
+            for field, value in branch_state.items():
+                if field in base and base[field] is value:
+                    continue
+                reducer = self.reducers.get(field)
+                if reducer is not None and field in base:
+                    try:
+                        delta = _branch_delta(base[field], value)
+                    except ValueError as e:
+                        raise ValueError(f"[Merge] Cannot reduce field '{field}' in {self}: {e}") from None
+                    merged[field] = reducer(merged[field], delta)
+                elif reducer is not None and field in updated_fields:
+                    # Added by the branches: nothing to subtract
+                    merged[field] = reducer(merged[field], value)
+                else:
+                    merged[field] = value
+                updated_fields.add(field)
+        return cast(StateSchema, merged)
+
+
 @dataclass
 class Transition(Generic[StateSchema]):
     source: str
@@ -84,46 +243,169 @@ class Transition(Generic[StateSchema]):
     def __repr__(self) -> str:
         return self.__str__()
 
+    def _normalize(self, result: Union[str, List[str], Step[StateSchema], List[Step[StateSchema]]]) -> List[str]:
+        if isinstance(result, Step):
+            return [result.step_id]
+        elif isinstance(result, list) and all(isinstance(x, Step) for x in result):
+            return [step.step_id for step in result]
+        elif isinstance(result, str):
+            return [result]
+        return result
+
     def resolve(self, state: StateSchema) -> List[str]:
         if self.condition:
             result = self.condition(state)
-            if isinstance(result, Step):
-                return [result.step_id]
-            elif isinstance(result, list) and all(isinstance(x, Step) for x in result):
-                return [step.step_id for step in result]
-            elif isinstance(result, str):
-                return [result]
-            return result
+            if inspect.isawaitable(result):
+                result.close()
+                raise TypeError(
+                    f"{self} has an async condition. Use StateMachine.arun to execute it."
+                )
+            return self._normalize(result)
+        return self.targets
+
+    async def aresolve(self, state: StateSchema) -> List[str]:
+        if self.condition:
+            result = self.condition(state)
+            if inspect.isawaitable(result):
+                result = await result
+            return self._normalize(result)
         return self.targets
 
 
-@dataclass
+@dataclass(frozen=True)
+class CompiledStep(Generic[StateSchema]):
+    """A step frozen into the compiled transition graph"""
+    step: Step[StateSchema]
+    transitions: Tuple[Transition[StateSchema], ...]
+    # Targets of a step whose transitions are all unconditional, resolved at compile time
+    static_targets: Optional[List[str]] = None
+
+
+@dataclass(frozen=True)
 class Snapshot(Generic[StateSchema]):
-    """Represents a single state snapshot in time"""
+    """Represents a single state snapshot in time.
+    Only the fields changed by the step are stored in `delta`; unchanged values are
+    shared with earlier snapshots and the full state is rebuilt on access. Every
+    KEYFRAME_INTERVAL snapshots the whole state is stored to bound that rebuild.
+    Snapshots are immutable, so copies of a Run share them instead of
+    duplicating (see Run.copy). The state values are shared too, which is
+    why steps return new values instead of mutating the state in place."""
     snapshot_id: str
     timestamp: datetime
-    state_data: StateSchema
+    delta: Dict[str, Any]
     state_schema: Type[StateSchema]
     step_id: str
+    branch: Optional[str] = None
+    parent: Optional["Snapshot[StateSchema]"] = field(default=None, repr=False, compare=False)
+    depth: int = 0
+    metrics: Optional[StepMetrics] = field(default=None, compare=False)
+    # Step the run fell back to after this step failed, instead of its transitions
+    fallback: Optional[str] = None
+
+    KEYFRAME_INTERVAL: ClassVar[int] = 64
 
     def __str__(self) -> str:
-        return f"Snapshot('{self.snapshot_id}') @ [{self.timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')}]: {self.step_id}.State({self.state_data})"
+        step = f"{self.branch}/{self.step_id}" if self.branch else self.step_id
+        return f"Snapshot('{self.snapshot_id}') @ [{self.timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')}]: {step}.State({self.state_data})"
 
     def __repr__(self) -> str:
         return self.__str__()
 
+    @property
+    def is_keyframe(self) -> bool:
+        return self.parent is None or self.depth % self.KEYFRAME_INTERVAL == 0
+
+    @property
+    def state_data(self) -> StateSchema:
+        """Rebuild the full state by replaying deltas since the last keyframe"""
+        deltas = []
+        snapshot = self
+        while snapshot is not None:
+            deltas.append(snapshot.delta)
+            if snapshot.is_keyframe:
+                break
+            snapshot = snapshot.parent
+        state = {}
+        for delta in reversed(deltas):
+            state.update(delta)
+        return cast(StateSchema, state)
+
     @classmethod
     def create(cls, state_data: StateSchema, state_schema: Type[StateSchema],
-               step_id:str) -> 'Snapshot[StateSchema]':
+               step_id:str, branch: Optional[str] = None,
+               parent: Optional['Snapshot[StateSchema]'] = None,
+               parent_state: Optional[StateSchema] = None,
+               metrics: Optional[StepMetrics] = None,
+               fallback: Optional[str] = None) -> 'Snapshot[StateSchema]':
+        """Create a snapshot of state_data.
+        parent_state is the state recorded by parent; it is rebuilt when omitted."""
+        depth = parent.depth + 1 if parent else 0
+        if parent is None or depth % cls.KEYFRAME_INTERVAL == 0:
+            delta = {**state_data}
+        else:
+            if parent_state is None:
+                parent_state = parent.state_data
+            delta = {
+                key: value for key, value in state_data.items()
+                if key not in parent_state or parent_state[key] is not value
+            }
         return cls(
             snapshot_id=str(uuid.uuid4()),
             timestamp=datetime.now(),
-            state_data=state_data,
+            delta=delta,
             state_schema=state_schema,
             step_id=step_id,
+            branch=branch,
+            parent=parent,
+            depth=depth,
+            metrics=metrics,
+            fallback=fallback,
         )
 
 
+class BudgetExceededError(Exception):
+    """Raised when a run exhausts its RunBudget and has no on_exhausted step to go to"""
+    pass
+
+
+@dataclass(frozen=True)
+class RunBudget:
+    """
+    Limits on how much work a single run may do, checked before every step.
+
+    Attributes:
+        max_steps: Steps executed, including failed and memoized ones
+        max_wall_time: Seconds since the run (or resume) started
+        max_tokens: LLM tokens used by the run's steps
+        on_exhausted: Step id to transition to once a limit is hit, e.g. a step
+            that writes a best-effort answer. Budgets stop being enforced after
+            that, so its path must reach a Termination. When None, or inside a
+            parallel branch, the run fails with BudgetExceededError instead.
+    """
+    max_steps: Optional[int] = None
+    max_wall_time: Optional[float] = None
+    max_tokens: Optional[int] = None
+    on_exhausted: Optional[str] = None
+
+
+@dataclass
+class RunUsage:
+    """Resources consumed by a run so far, shared by all of its branches"""
+    steps: int = 0
+    tokens: int = 0
+    exhausted: Optional[str] = None  # which limit was hit, if any
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, metrics: StepMetrics):
+        with self._lock:
+            self.steps += 1
+            self.tokens += metrics.total_tokens
+
+    def __deepcopy__(self, memo: Dict) -> 'RunUsage':
+        # Locks cannot be copied; the copy gets its own
+        return RunUsage(steps=self.steps, tokens=self.tokens, exhausted=self.exhausted)
+
+
 @dataclass
 class Run(Generic[StateSchema]):
     """Represents a single execution run of the state machine"""
@@ -131,6 +413,8 @@ class Run(Generic[StateSchema]):
     start_timestamp: datetime
     snapshots: List[Snapshot[StateSchema]] = field(default_factory=list)
     end_timestamp: Optional[datetime] = None
+    budget: Optional[RunBudget] = None
+    usage: RunUsage = field(default_factory=RunUsage)
 
     def __str__(self) -> str:
         return f"Run('{self.run_id}')"
@@ -151,9 +435,25 @@ class Run(Generic[StateSchema]):
             "run_id": self.run_id,
             "start_timestamp": self.start_timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
             "end_timestamp": self.end_timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
-            "snapshot_counts": len(self.snapshots)
+            "snapshot_counts": len(self.snapshots),
+            "cache_hits": sum(1 for s in self.snapshots if s.metrics and s.metrics.cache_hit),
+            "cache_misses": sum(1 for s in self.snapshots if s.metrics and s.metrics.cache_hit is False),
+            "budget": {
+                "steps": self.usage.steps,
+                "max_steps": self.budget.max_steps if self.budget else None,
+                "tokens": self.usage.tokens,
+                "max_tokens": self.budget.max_tokens if self.budget else None,
+                "wall_time": (self.end_timestamp - self.start_timestamp).total_seconds(),
+                "max_wall_time": self.budget.max_wall_time if self.budget else None,
+                "exhausted": self.usage.exhausted,
+            },
         }
 
+    def copy(self) -> 'Run[StateSchema]':
+        """Copy of the run that can be added to independently; the snapshots
+        are immutable and shared with this run, not duplicated"""
+        return replace(self, snapshots=list(self.snapshots), usage=copy.deepcopy(self.usage))
+
     def add_snapshot(self, snapshot: Snapshot[StateSchema]):
         """Add a new snapshot to this run"""
         self.snapshots.append(snapshot)
@@ -168,12 +468,123 @@ class Run(Generic[StateSchema]):
             return None
         return self.snapshots[-1].state_data
 
+    def get_branch_snapshots(self, branch: str) -> List[Snapshot[StateSchema]]:
+        """Get the snapshots recorded by a single parallel branch"""
+        return [s for s in self.snapshots if s.branch == branch]
+
+    def step_summary(self) -> Dict[str, Dict[str, Any]]:
+        """Aggregate step metrics per step id, slowest steps first"""
+        summary: Dict[str, Dict[str, Any]] = {}
+        for snapshot in self.snapshots:
+            metrics = snapshot.metrics
+            if metrics is None:
+                continue
+            entry = summary.setdefault(metrics.step_id, {
+                "calls": 0, "wall_time": 0.0, "cpu_time": 0.0,
+                "llm_calls": 0, "total_tokens": 0, "retries": 0,
+                "cache_hits": 0, "cache_misses": 0,
+            })
+            entry["calls"] += 1
+            entry["wall_time"] += metrics.wall_time
+            entry["cpu_time"] += metrics.cpu_time
+            entry["llm_calls"] += metrics.llm_calls
+            entry["total_tokens"] += metrics.total_tokens
+            entry["retries"] += metrics.retries
+            if metrics.cache_hit is not None:
+                entry["cache_hits" if metrics.cache_hit else "cache_misses"] += 1
+        return dict(sorted(summary.items(), key=lambda item: item[1]["wall_time"], reverse=True))
+
+    def flame_graph(self) -> str:
+        """Step wall times in folded-stack format ("run;branch;step microseconds"),
+        ready for flamegraph.pl or speedscope"""
+        totals: Dict[str, int] = {}
+        for snapshot in self.snapshots:
+            if snapshot.metrics is None:
+                continue
+            frames = [f"run {self.run_id[:8]}"]
+            if snapshot.branch:
+                frames += snapshot.branch.split("/")
+            frames.append(snapshot.step_id)
+            stack = ";".join(frames)
+            totals[stack] = totals.get(stack, 0) + int(snapshot.metrics.wall_time * 1_000_000)
+        return "\n".join(f"{stack} {value}" for stack, value in totals.items())
+
+
+@dataclass
+class StreamEvent:
+    """An event yielded by StateMachine.stream"""
+    kind: str  # run_start, step_start, token, step_end, state_delta, transition or run_end
+    run_id: str
+    step_id: Optional[str] = None
+    branch: Optional[str] = None
+    # token: the text delta; step_end: StepMetrics; state_delta: the changed fields;
+    # transition: the target step ids; run_end: the completed Run
+    data: Any = None
+
+
+class _StreamObserver(StepObserver):
+    """Turns observer callbacks into StreamEvents handed to emit"""
+
+    def __init__(self, emit: Callable[[StreamEvent], None]):
+        self.emit = emit
+
+    def on_run_start(self, run):
+        self.emit(StreamEvent("run_start", run.run_id))
+
+    def on_step_start(self, run, step_id, branch):
+        self.emit(StreamEvent("step_start", run.run_id, step_id, branch))
+
+    def on_token(self, run, step_id, branch, delta):
+        self.emit(StreamEvent("token", run.run_id, step_id, branch, delta))
+
+    def on_step_end(self, run, metrics):
+        self.emit(StreamEvent("step_end", run.run_id, metrics.step_id, metrics.branch, metrics))
+
+    def on_snapshot(self, run, snapshot):
+        self.emit(StreamEvent("state_delta", run.run_id, snapshot.step_id, snapshot.branch, snapshot.delta))
+
+    def on_transition(self, run, source, targets):
+        self.emit(StreamEvent("transition", run.run_id, source, data=targets))
+
+    def on_run_end(self, run):
+        self.emit(StreamEvent("run_end", run.run_id, data=run))
+
+
+@dataclass
+class RunContext(Generic[StateSchema]):
+    """Per-run execution state threaded through the engine"""
+    run: Run[StateSchema]
+    resource: Optional[Resource]
+    # Where snapshots go: the run itself, or a branch-local list during a fan-out
+    record: Callable[[Snapshot[StateSchema]], None]
+    budget: Optional[RunBudget] = None
+    # time.monotonic() value after which max_wall_time is exhausted
+    deadline: Optional[float] = None
+    # Machine-wide observers plus any registered for this run only
+    observers: List[StepObserver] = field(default_factory=list)
+
 
 class StateMachine(Generic[StateSchema]):
-    def __init__(self, state_schema: Type[StateSchema]):
+    def __init__(self, state_schema: Type[StateSchema], max_workers: Optional[int] = None,
+                 checkpointer: Optional["Checkpointer"] = None,
+                 observers: Optional[List[StepObserver]] = None,
+                 budget: Optional[RunBudget] = None):
         self.state_schema = state_schema
+        # Upper bound on threads used when a transition fans out to several branches
+        self.max_workers = max_workers
+        # Optional lib.checkpoint.Checkpointer persisting every snapshot as it is recorded
+        self.checkpointer = checkpointer
+        self.observers: List[StepObserver] = list(observers or [])
+        # Default limits for every run; run(..., budget=...) overrides them per call
+        self.budget = budget
         self.steps: Dict[str, Step[StateSchema]] = {}
         self.transitions: Dict[str, List[Transition[StateSchema]]] = {}
+        # Filled by compile(); any change to steps or transitions invalidates it
+        self.graph: Optional[Dict[str, CompiledStep[StateSchema]]] = None
+        self.entry_point_id: Optional[str] = None
+        # Steps entered without a transition, as budget fallbacks: the compiled graph's roots
+        self.roots: FrozenSet[str] = frozenset()
+        self._budget_fallbacks: Tuple[str, ...] = ()
 
     def __str__(self) -> str:
         schema_keys = list(get_type_hints(self.state_schema).keys())
@@ -186,6 +597,7 @@ class StateMachine(Generic[StateSchema]):
         """Add steps to the workflow"""
         for step in steps:
             self.steps[step.step_id] = step
+        self.graph = None
 
     def connect(
         self,
@@ -200,58 +612,690 @@ class StateMachine(Generic[StateSchema]):
         if src_id not in self.transitions:
             self.transitions[src_id] = []
         self.transitions[src_id].append(transition)
+        self.graph = None
 
-    def run(self, state: StateSchema, resource: Resource = None):
-        # Validate that state has at least one field from the schema
-        expected_fields = get_type_hints(self.state_schema)
-        state_fields = set(state.keys())
-        common_fields = state_fields.intersection(expected_fields)
-        
-        if not common_fields:
-            raise ValueError(f"Initial state must have at least one field from the schema. Expected fields: {list(expected_fields.keys())}")
+    def compile(self, budget_fallbacks: Iterable[str] = ()) -> 'StateMachine[StateSchema]':
+        """Validate the workflow once and freeze it into an adjacency table.
 
+        Checks that there is exactly one EntryPoint, that every transition and
+        step fallback points at known steps, that every step is reachable from
+        the entry point (or a budget's on_exhausted step) and that a
+        Termination step is reachable. Conditional transitions are followed
+        through the targets declared in connect().
+        budget_fallbacks names the on_exhausted steps of per-run budgets; the
+        machine-wide budget's is included already. run() and arun() compile
+        on demand, adding the fallback of the budget they are given, so
+        calling this is only needed to surface graph errors early.
+        """
         entry_points = [s for s in self.steps.values() if isinstance(s, EntryPoint)]
         if not entry_points:
             raise Exception("No EntryPoint step found in workflow")
         if len(entry_points) > 1:
             raise Exception("Multiple EntryPoint steps found in workflow")
-        
+        entry_id = entry_points[0].step_id
+
+        for src_id, transitions in self.transitions.items():
+            if src_id not in self.steps:
+                raise ValueError(f"[StateMachine] Transition source '{src_id}' is not a registered step")
+            for t in transitions:
+                missing = [target for target in t.targets if target not in self.steps]
+                if missing:
+                    raise ValueError(f"[StateMachine] {t} targets unknown steps: {missing}")
+        for step in self.steps.values():
+            if step.policy and step.policy.fallback and step.policy.fallback not in self.steps:
+                raise ValueError(f"[StateMachine] {step} falls back to unknown step: '{step.policy.fallback}'")
+
+        # Budgets' on_exhausted steps are entered without a transition
+        fallbacks = list(budget_fallbacks)
+        if self.budget is not None and self.budget.on_exhausted is not None:
+            fallbacks.append(self.budget.on_exhausted)
+        roots = [entry_id]
+        for fallback in fallbacks:
+            if fallback not in self.steps:
+                raise ValueError(f"[StateMachine] Budget falls back to unknown step: '{fallback}'")
+            if fallback not in roots:
+                roots.append(fallback)
+        reachable = set(roots)
+        pending = list(roots)
+        while pending:
+            step_id = pending.pop()
+            targets = [target for t in self.transitions.get(step_id, []) for target in t.targets]
+            policy = self.steps[step_id].policy
+            if policy and policy.fallback:
+                targets.append(policy.fallback)
+            for target in targets:
+                if target not in reachable:
+                    reachable.add(target)
+                    pending.append(target)
+
+        unreachable = [step_id for step_id in self.steps if step_id not in reachable]
+        if unreachable:
+            raise ValueError(f"[StateMachine] Steps unreachable from '{entry_id}': {unreachable}")
+        if not any(isinstance(self.steps[step_id], Termination) for step_id in reachable):
+            raise ValueError("[StateMachine] No Termination step is reachable from the EntryPoint")
+        dead_ends = [
+            step_id for step_id in reachable
+            if not isinstance(self.steps[step_id], Termination) and not self.transitions.get(step_id)
+        ]
+        if dead_ends:
+            raise ValueError(f"[StateMachine] Steps without outgoing transitions: {dead_ends}")
+
+        graph = {}
+        for step_id, step in self.steps.items():
+            transitions = tuple(self.transitions.get(step_id, []))
+            static_targets = None
+            if transitions and all(t.condition is None for t in transitions):
+                static_targets = [target for t in transitions for target in t.targets]
+            graph[step_id] = CompiledStep(step, transitions, static_targets)
+
+        self.entry_point_id = entry_id
+        self.roots = frozenset(roots)
+        self._budget_fallbacks = tuple(dict.fromkeys([*self._budget_fallbacks, *budget_fallbacks]))
+        self.graph = graph
+        return self
+
+    def _ensure_compiled(self, budget: Optional[RunBudget] = None):
+        """Compile if needed, with the fallback of a per-run budget among the roots"""
+        fallback = budget.on_exhausted if budget is not None else None
+        if self.graph is None or (fallback is not None and fallback not in self.roots):
+            extra = (fallback,) if fallback is not None else ()
+            self.compile(self._budget_fallbacks + extra)
+
+    def _get_entry_point(self, state: StateSchema, budget: Optional[RunBudget] = None) -> str:
+        self._ensure_compiled(budget)
+
+        # Validate that state has at least one field from the schema
+        expected_fields = schema_fields(self.state_schema)
+        if expected_fields.isdisjoint(state.keys()):
+            raise ValueError(f"Initial state must have at least one field from the schema. Expected fields: {list(get_type_hints(self.state_schema).keys())}")
+
+        return self.entry_point_id
+
+    def _next_steps(self, node: CompiledStep[StateSchema], state: StateSchema) -> List[str]:
+        if node.static_targets is not None:
+            return node.static_targets
+
+        next_steps: List[str] = []
+        for t in node.transitions:
+            next_steps += t.resolve(state)
+        self._check_next_steps(node, next_steps)
+        return next_steps
+
+    async def _anext_steps(self, node: CompiledStep[StateSchema], state: StateSchema) -> List[str]:
+        if node.static_targets is not None:
+            return node.static_targets
+
+        next_steps: List[str] = []
+        for t in node.transitions:
+            next_steps += await t.aresolve(state)
+        self._check_next_steps(node, next_steps)
+        return next_steps
+
+    def _check_next_steps(self, node: CompiledStep[StateSchema], next_steps: List[str]):
+        if not next_steps:
+            raise Exception(f"[StateMachine] No transitions found from step: {node.step.step_id}")
+        unknown = [step_id for step_id in next_steps if step_id not in self.graph]
+        if unknown:
+            raise ValueError(f"[StateMachine] Step '{node.step.step_id}' resolved to unknown steps: {unknown}")
+
+    def add_observer(self, observer: StepObserver):
+        """Register a hook notified of run, step and transition events"""
+        self.observers.append(observer)
+
+    def _start_run(self, resource: Resource = None, budget: Optional[RunBudget] = None,
+                   observers: Optional[List[StepObserver]] = None) -> RunContext[StateSchema]:
         # Create a new run for this execution
         current_run = Run.create()
-        
-        current_step_id = entry_points[0].step_id        
+        if self.checkpointer is not None:
+            self.checkpointer.start_run(current_run)
+        ctx = self._context(current_run, resource, budget, observers)
+        for observer in ctx.observers:
+            observer.on_run_start(current_run)
+        return ctx
+
+    def _context(self, current_run: Run[StateSchema], resource: Optional[Resource],
+                 budget: Optional[RunBudget],
+                 observers: Optional[List[StepObserver]] = None) -> RunContext[StateSchema]:
+        budget = budget or self.budget
+        if budget is not None and budget.on_exhausted is not None and budget.on_exhausted not in self.steps:
+            raise ValueError(f"[StateMachine] Budget falls back to unknown step: '{budget.on_exhausted}'")
+        current_run.budget = budget
+        deadline = None
+        if budget is not None and budget.max_wall_time is not None:
+            deadline = time.monotonic() + budget.max_wall_time
+        return RunContext(run=current_run, resource=resource, record=self._recorder(current_run),
+                          budget=budget, deadline=deadline,
+                          observers=self.observers + list(observers or []))
+
+    def _budget_exhausted(self, ctx: RunContext[StateSchema]) -> Optional[str]:
+        """Name the limit the run has hit, if any; a few comparisons per step"""
+        budget = ctx.budget
+        usage = ctx.run.usage
+        if usage.exhausted is not None:
+            # Already handled; let the on_exhausted path finish
+            return None
+        if budget.max_steps is not None and usage.steps >= budget.max_steps:
+            return "max_steps"
+        if budget.max_tokens is not None and usage.tokens >= budget.max_tokens:
+            return "max_tokens"
+        if ctx.deadline is not None and time.monotonic() >= ctx.deadline:
+            return "max_wall_time"
+        return None
+
+    def _exhaust_budget(self, ctx: RunContext[StateSchema], step_id: str, reason: str,
+                        branch: Optional[str] = None) -> str:
+        """Mark the budget exhausted before step_id and return the step to continue with"""
+        usage = ctx.run.usage
+        usage.exhausted = reason
+        target = ctx.budget.on_exhausted
+        logger.warning(
+            "[StateMachine] Budget exhausted (%s) before step: %s", reason, step_id,
+            extra={"run_id": ctx.run.run_id, "step_id": step_id, "branch": branch,
+                   "steps": usage.steps, "tokens": usage.tokens},
+        )
+        if target is None or branch is not None:
+            raise BudgetExceededError(
+                f"[StateMachine] Run '{ctx.run.run_id}' exhausted {reason} before step '{step_id}'"
+            )
+        self._notify_transition(ctx, step_id, [target])
+        return target
+
+    def _recorder(self, current_run: Run[StateSchema]) -> Callable[[Snapshot[StateSchema]], None]:
+        if self.checkpointer is None:
+            return current_run.add_snapshot
+
+        def record(snapshot: Snapshot[StateSchema]):
+            current_run.add_snapshot(snapshot)
+            self.checkpointer.save_snapshot(current_run.run_id, snapshot)
+        return record
+
+    def _complete_run(self, ctx: RunContext[StateSchema]) -> Run[StateSchema]:
+        current_run = ctx.run
+        current_run.complete()
+        if self.checkpointer is not None:
+            self.checkpointer.complete_run(current_run)
+        for observer in ctx.observers:
+            observer.on_run_end(current_run)
+        logger.info(
+            "[StateMachine] Run completed: %s", current_run.run_id,
+            extra={"run_id": current_run.run_id, "snapshot_count": len(current_run.snapshots)},
+        )
+        return current_run
+
+    def run(self, state: StateSchema, resource: Resource = None, budget: Optional[RunBudget] = None,
+            observers: Optional[List[StepObserver]] = None):
+        entry_point_id = self._get_entry_point(state, budget)
+        ctx = self._start_run(resource, budget, observers)
+
+        self._execute(entry_point_id, state, ctx)
+
+        return self._complete_run(ctx)
+
+    async def arun(self, state: StateSchema, resource: Resource = None, budget: Optional[RunBudget] = None,
+                   observers: Optional[List[StepObserver]] = None):
+        """Asynchronous counterpart of run.
+        Steps and transition conditions may be plain or async functions; parallel
+        branches are awaited together on the running event loop instead of threads."""
+        entry_point_id = self._get_entry_point(state, budget)
+        ctx = self._start_run(resource, budget, observers)
+
+        await self._aexecute(entry_point_id, state, ctx)
+
+        return self._complete_run(ctx)
+
+    def stream(self, state: StateSchema, resource: Resource = None,
+               budget: Optional[RunBudget] = None) -> Iterator[StreamEvent]:
+        """Execute a run, yielding its events as they happen.
+
+        The run executes on a background thread; events arrive in order per branch:
+        "run_start", then per step "step_start", any "token" deltas streamed by
+        LLM calls, "step_end", "state_delta" and "transition", and finally
+        "run_end" carrying the completed Run. A failing run raises here after
+        its last event. Closing the iterator early leaves the run to finish in
+        the background.
+        """
+        events: "queue.Queue[Union[StreamEvent, BaseException, None]]" = queue.Queue()
+        entry_point_id = self._get_entry_point(state, budget)
 
+        def target():
+            try:
+                ctx = self._start_run(resource, budget, [_StreamObserver(events.put)])
+                self._execute(entry_point_id, state, ctx)
+                self._complete_run(ctx)
+            except BaseException as e:
+                events.put(e)
+            finally:
+                events.put(None)
+
+        threading.Thread(target=target, daemon=True).start()
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+
+    async def astream(self, state: StateSchema, resource: Resource = None,
+                      budget: Optional[RunBudget] = None) -> AsyncIterator[StreamEvent]:
+        """Asynchronous counterpart of stream; the run executes as a task on the running loop"""
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[StreamEvent]" = asyncio.Queue()
+        # Branches or step timeouts may emit from worker threads
+        observer = _StreamObserver(lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+        task = asyncio.ensure_future(self.arun(state, resource, budget, observers=[observer]))
+        try:
+            while True:
+                next_event = asyncio.ensure_future(events.get())
+                await asyncio.wait({next_event, task}, return_when=asyncio.FIRST_COMPLETED)
+                if next_event.done():
+                    yield next_event.result()
+                    continue
+                next_event.cancel()
+                # The run ended; flush what was queued before it did
+                await asyncio.sleep(0)
+                while not events.empty():
+                    yield events.get_nowait()
+                task.result()
+                return
+        finally:
+            task.cancel()
+
+    def run_many(self, states: Iterable[StateSchema], resource: Resource = None,
+                 concurrency: int = 8, budget: Optional[RunBudget] = None,
+                 ordered: bool = False,
+                 return_exceptions: bool = False) -> Iterator[Union[Run[StateSchema], Exception]]:
+        """Execute independent runs concurrently, yielding each Run as it completes.
+
+        Runs execute on up to `concurrency` threads and share the resource, so it
+        must be thread-safe. Every Run keeps its own snapshots in step order; with
+        ordered=True the runs are also yielded in input order. A failed run raises
+        from the iterator, or is yielded as its exception with return_exceptions.
+        Runs not started yet are cancelled when the iterator is closed early.
+        """
+        self._ensure_compiled(budget)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        futures = [executor.submit(self.run, state, resource, budget) for state in states]
+        try:
+            for future in (futures if ordered else as_completed(futures)):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    yield e
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    async def arun_many(self, states: Iterable[StateSchema], resource: Resource = None,
+                        concurrency: int = 8, budget: Optional[RunBudget] = None,
+                        ordered: bool = False,
+                        return_exceptions: bool = False) -> AsyncIterator[Union[Run[StateSchema], Exception]]:
+        """Asynchronous counterpart of run_many; at most `concurrency` runs are in flight"""
+        self._ensure_compiled(budget)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(state: StateSchema) -> Run[StateSchema]:
+            async with semaphore:
+                return await self.arun(state, resource, budget)
+
+        tasks = [asyncio.ensure_future(run_one(state)) for state in states]
+        try:
+            for next_run in (tasks if ordered else asyncio.as_completed(tasks)):
+                try:
+                    yield await next_run
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    yield e
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _load_checkpoint(self, run_id: str, resource: Resource = None,
+                         budget: Optional[RunBudget] = None) -> Tuple[RunContext[StateSchema], Optional[Snapshot[StateSchema]]]:
+        if self.checkpointer is None:
+            raise ValueError("[StateMachine] resume requires a checkpointer")
+        self._ensure_compiled(budget)
+
+        current_run = self.checkpointer.load_run(run_id, self.state_schema)
+        if current_run is None:
+            raise ValueError(f"[StateMachine] No checkpoint found for run '{run_id}'")
+
+        # Branch snapshots are not resumable on their own; an interrupted fan-out re-runs from its fork
+        last = next((s for s in reversed(current_run.snapshots) if s.branch is None), None)
+        if last is not None:
+            current_run.snapshots = current_run.snapshots[:current_run.snapshots.index(last) + 1]
+        elif current_run.end_timestamp is None:
+            raise ValueError(f"[StateMachine] Run '{run_id}' has no completed step to resume from")
+
+        if last is not None and current_run.end_timestamp is None:
+            # Records of the interrupted fan-out are superseded by the ones about to be written
+            self.checkpointer.resume_run(run_id, last)
+
+        # Steps and tokens spent before the interruption count against the budget
+        for snapshot in current_run.snapshots:
+            if snapshot.metrics is not None:
+                current_run.usage.add(snapshot.metrics)
+        ctx = self._context(current_run, resource, budget)
+        return ctx, last
+
+    def resume(self, run_id: str, resource: Resource = None,
+               budget: Optional[RunBudget] = None) -> Run[StateSchema]:
+        """Continue a checkpointed run after its last completed step.
+        A run that already completed is returned as stored."""
+        ctx, last = self._load_checkpoint(run_id, resource, budget)
+        if ctx.run.end_timestamp is not None:
+            return ctx.run
+
+        logger.info("[StateMachine] Resuming after step: %s", last.step_id,
+                    extra={"run_id": run_id, "step_id": last.step_id})
+        state = last.state_data
+        # A failed step handled by its fallback continues there, not along its transitions
+        next_steps = [last.fallback] if last.fallback else self._next_steps(self.graph[last.step_id], state)
+        self._notify_transition(ctx, last.step_id, next_steps)
+        if len(next_steps) > 1:
+            merged, next_step_id = self._fan_out(next_steps, state, ctx, None, last)
+            if next_step_id is not None:
+                self._execute(next_step_id, merged, ctx, None, last, state)
+        else:
+            self._execute(next_steps[0], state, ctx, None, last)
+
+        return self._complete_run(ctx)
+
+    async def aresume(self, run_id: str, resource: Resource = None,
+                      budget: Optional[RunBudget] = None) -> Run[StateSchema]:
+        """Asynchronous counterpart of resume"""
+        ctx, last = self._load_checkpoint(run_id, resource, budget)
+        if ctx.run.end_timestamp is not None:
+            return ctx.run
+
+        logger.info("[StateMachine] Resuming after step: %s", last.step_id,
+                    extra={"run_id": run_id, "step_id": last.step_id})
+        state = last.state_data
+        next_steps = [last.fallback] if last.fallback else await self._anext_steps(self.graph[last.step_id], state)
+        self._notify_transition(ctx, last.step_id, next_steps)
+        if len(next_steps) > 1:
+            merged, next_step_id = await self._afan_out(next_steps, state, ctx, None, last)
+            if next_step_id is not None:
+                await self._aexecute(next_step_id, merged, ctx, None, last, state)
+        else:
+            await self._aexecute(next_steps[0], state, ctx, None, last)
+
+        return self._complete_run(ctx)
+
+    def _execute(self, current_step_id: str, state: StateSchema, ctx: RunContext[StateSchema],
+                 branch: Optional[str] = None,
+                 parent: Optional[Snapshot[StateSchema]] = None,
+                 parent_state: Optional[StateSchema] = None):
+        """Run steps from current_step_id until termination.
+        Inside a parallel branch, execution also stops at the first Merge step.
+        Returns the last state and the Merge step id (None on termination)."""
+        # Snapshots store deltas against the state recorded by parent, which is the
+        # incoming state unless we are entering a Merge step after a fan-out
+        if parent_state is None:
+            parent_state = state
+        joined_step_id = None
+        graph = self.graph
         while current_step_id:
-            step = self.steps[current_step_id]
+            node = graph[current_step_id]
+            step = node.step
             if isinstance(step, Termination):
-                print(f"[StateMachine] Terminating: {current_step_id}")
-                break
-            
-            # Replace state entirely
-            state = step.run(state, self.state_schema, resource)  
+                if branch is None:
+                    self._log_termination(ctx, current_step_id)
+                return state, None
 
-            if isinstance(step, EntryPoint):
-                print(f"[StateMachine] Starting: {current_step_id}")
-            else:
-                print(f"[StateMachine] Executing step: {current_step_id}")
+            # A nested Merge reached after our own fan-out runs here; any other one ends the branch
+            if branch is not None and isinstance(step, Merge) and current_step_id != joined_step_id:
+                return state, current_step_id
+            joined_step_id = None
 
-            # Create and add snapshot to the current run
-            snapshot = Snapshot.create(copy.deepcopy(state), self.state_schema, current_step_id)
-            current_run.add_snapshot(snapshot)
+            if ctx.budget is not None:
+                reason = self._budget_exhausted(ctx)
+                if reason is not None:
+                    current_step_id = self._exhaust_budget(ctx, current_step_id, reason, branch)
+                    continue
 
-            transitions = self.transitions.get(current_step_id, [])
-            next_steps: List[str] = []
+            metrics = self._begin_step(ctx, step, branch)
+            try:
+                # Replace state entirely
+                state = self._run_step(step, state, ctx, metrics)
+            except Exception as e:
+                fallback = step.policy.fallback if step.policy else None
+                self._fail_step(ctx, metrics, e, handled=fallback is not None)
+                if fallback is None:
+                    raise
+                # Record the failed attempt with the state passed through unchanged
+                parent = self._record_step(step, state, ctx, branch, parent, parent_state, metrics, fallback)
+                parent_state = state
+                self._notify_transition(ctx, current_step_id, [fallback])
+                current_step_id = fallback
+                continue
+            self._end_step(ctx, metrics)
 
-            for t in transitions:
-                next_steps += t.resolve(state)
+            parent = self._record_step(step, state, ctx, branch, parent, parent_state, metrics)
+            parent_state = state
 
-            if not next_steps:
-                raise Exception(f"[StateMachine] No transitions found from step: {current_step_id}")
+            next_steps = self._next_steps(node, state)
+            self._notify_transition(ctx, current_step_id, next_steps)
 
             if len(next_steps) > 1:
-                raise NotImplementedError("Parallel execution not implemented yet.")
+                state, current_step_id = self._fan_out(next_steps, state, ctx, branch, parent)
+                if current_step_id is None:
+                    if branch is None:
+                        self._log_termination(ctx, "all branches")
+                    return state, None
+                # The merged state is what the Merge step receives
+                joined_step_id = current_step_id
+                continue
 
             current_step_id = next_steps[0]
 
-        current_run.complete()
-        return current_run
+        return state, None
+
+    def _run_step(self, step: Step[StateSchema], state: StateSchema, ctx: RunContext[StateSchema],
+                  metrics: StepMetrics) -> StateSchema:
+        if step.policy is None:
+            return step.run(state, self.state_schema, ctx.resource)
+
+        def on_retry(retry: int):
+            metrics.retries = retry
+            logger.warning("[StateMachine] Retrying step: %s (retry %d)", step.step_id, retry,
+                           extra={"run_id": ctx.run.run_id, "step_id": step.step_id, "retries": retry})
+
+        return step.policy.call(lambda: step.run(state, self.state_schema, ctx.resource), on_retry)
+
+    async def _arun_step(self, step: Step[StateSchema], state: StateSchema, ctx: RunContext[StateSchema],
+                         metrics: StepMetrics) -> StateSchema:
+        if step.policy is None:
+            return await step.arun(state, self.state_schema, ctx.resource)
+
+        def on_retry(retry: int):
+            metrics.retries = retry
+            logger.warning("[StateMachine] Retrying step: %s (retry %d)", step.step_id, retry,
+                           extra={"run_id": ctx.run.run_id, "step_id": step.step_id, "retries": retry})
+
+        return await step.policy.acall(lambda: step.arun(state, self.state_schema, ctx.resource), on_retry)
+
+    def _begin_step(self, ctx: RunContext[StateSchema], step: Step[StateSchema],
+                    branch: Optional[str] = None) -> StepMetrics:
+        for observer in ctx.observers:
+            observer.on_step_start(ctx.run, step.step_id, branch)
+        metrics = StepMetrics(step_id=step.step_id, branch=branch, run_id=ctx.run.run_id)
+        if ctx.observers:
+            metrics.on_token = lambda delta: self._notify_token(ctx, step.step_id, branch, delta)
+        # LLM calls made while the step runs attribute their token usage to these metrics
+        metrics.start()
+        return metrics
+
+    def _end_step(self, ctx: RunContext[StateSchema], metrics: StepMetrics):
+        metrics.stop()
+        ctx.run.usage.add(metrics)
+        for observer in ctx.observers:
+            observer.on_step_end(ctx.run, metrics)
+
+    def _notify_token(self, ctx: RunContext[StateSchema], step_id: str, branch: Optional[str], delta: str):
+        for observer in ctx.observers:
+            observer.on_token(ctx.run, step_id, branch, delta)
+
+    def _fail_step(self, ctx: RunContext[StateSchema], metrics: StepMetrics, error: Exception,
+                   handled: bool = False):
+        metrics.error = f"{type(error).__name__}: {error}"
+        self._end_step(ctx, metrics)
+        logger.log(
+            logging.WARNING if handled else logging.ERROR,
+            "[StateMachine] Step failed: %s (%s)", metrics.step_id, metrics.error,
+            extra={"run_id": ctx.run.run_id, **metrics.to_dict()},
+        )
+
+    def _notify_transition(self, ctx: RunContext[StateSchema], source: str, targets: List[str]):
+        for observer in ctx.observers:
+            observer.on_transition(ctx.run, source, targets)
+
+    def _log_termination(self, ctx: RunContext[StateSchema], step_id: str):
+        logger.info("[StateMachine] Terminating: %s", step_id,
+                    extra={"run_id": ctx.run.run_id, "step_id": step_id})
+
+    def _record_step(self, step: Step[StateSchema], state: StateSchema, ctx: RunContext[StateSchema],
+                     branch: Optional[str] = None,
+                     parent: Optional[Snapshot[StateSchema]] = None,
+                     parent_state: Optional[StateSchema] = None,
+                     metrics: Optional[StepMetrics] = None,
+                     fallback: Optional[str] = None) -> Snapshot[StateSchema]:
+        if logger.isEnabledFor(logging.INFO):
+            message = "[StateMachine] Starting: %s" if isinstance(step, EntryPoint) else "[StateMachine] Executing step: %s"
+            extra = {"run_id": ctx.run.run_id, **metrics.to_dict()} if metrics else {"run_id": ctx.run.run_id}
+            logger.info(message, step.step_id, extra=extra)
+
+        # Create and add snapshot to the current run
+        # Values are shared with the live state, so steps must return new objects
+        # for the fields they change rather than mutating them in place
+        snapshot = Snapshot.create(state, self.state_schema, step.step_id, branch, parent, parent_state, metrics, fallback)
+        ctx.record(snapshot)
+        for observer in ctx.observers:
+            observer.on_snapshot(ctx.run, snapshot)
+        return snapshot
+
+    def _fan_out(self, targets: List[str], state: StateSchema, ctx: RunContext[StateSchema],
+                 parent_branch: Optional[str] = None,
+                 parent: Optional[Snapshot[StateSchema]] = None):
+        """Run each target as a parallel branch and join them at their common Merge step"""
+        logger.info("[StateMachine] Forking: %s", targets, extra={"run_id": ctx.run.run_id, "targets": targets})
+
+        branch_ids = [f"{parent_branch}/{t}" if parent_branch else t for t in targets]
+        branch_snapshots: List[List[Snapshot[StateSchema]]] = [[] for _ in targets]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(targets)) as executor:
+            futures = [
+                executor.submit(self._execute, target, {**state}, replace(ctx, record=snapshots.append), branch_id, parent)
+                for target, snapshots, branch_id in zip(targets, branch_snapshots, branch_ids)
+            ]
+            results = [future.result() for future in futures]
+
+        return self._join(targets, state, results, branch_snapshots, ctx)
+
+    def _join(self, targets: List[str], state: StateSchema, results: List,
+              branch_snapshots: List[List[Snapshot[StateSchema]]],
+              ctx: RunContext[StateSchema]):
+        """Record branch snapshots and merge the branch states at their common Merge step"""
+        # Record branch snapshots grouped per branch, in target order
+        for snapshots in branch_snapshots:
+            for snapshot in snapshots:
+                ctx.record(snapshot)
+
+        join_ids = {join_id for _, join_id in results}
+        if len(join_ids) > 1:
+            raise Exception(f"[StateMachine] Parallel branches {targets} do not converge on a single Merge step: {join_ids}")
+
+        join_id = join_ids.pop()
+        branch_states = [branch_state for branch_state, _ in results]
+        if join_id is None:
+            # Every branch terminated; fold their states without an explicit Merge step
+            return Merge[StateSchema]("__join__").reduce(state, branch_states), None
+
+        logger.info("[StateMachine] Merging: %s", join_id, extra={"run_id": ctx.run.run_id, "step_id": join_id})
+        merge_step = cast(Merge[StateSchema], self.steps[join_id])
+        return merge_step.reduce(state, branch_states), join_id
+
+    async def _aexecute(self, current_step_id: str, state: StateSchema, ctx: RunContext[StateSchema],
+                        branch: Optional[str] = None,
+                        parent: Optional[Snapshot[StateSchema]] = None,
+                        parent_state: Optional[StateSchema] = None):
+        """Asynchronous counterpart of _execute"""
+        if parent_state is None:
+            parent_state = state
+        joined_step_id = None
+        graph = self.graph
+        while current_step_id:
+            node = graph[current_step_id]
+            step = node.step
+            if isinstance(step, Termination):
+                if branch is None:
+                    self._log_termination(ctx, current_step_id)
+                return state, None
+
+            # A nested Merge reached after our own fan-out runs here; any other one ends the branch
+            if branch is not None and isinstance(step, Merge) and current_step_id != joined_step_id:
+                return state, current_step_id
+            joined_step_id = None
+
+            if ctx.budget is not None:
+                reason = self._budget_exhausted(ctx)
+                if reason is not None:
+                    current_step_id = self._exhaust_budget(ctx, current_step_id, reason, branch)
+                    continue
+
+            metrics = self._begin_step(ctx, step, branch)
+            try:
+                # Replace state entirely
+                state = await self._arun_step(step, state, ctx, metrics)
+            except Exception as e:
+                fallback = step.policy.fallback if step.policy else None
+                self._fail_step(ctx, metrics, e, handled=fallback is not None)
+                if fallback is None:
+                    raise
+                # Record the failed attempt with the state passed through unchanged
+                parent = self._record_step(step, state, ctx, branch, parent, parent_state, metrics, fallback)
+                parent_state = state
+                self._notify_transition(ctx, current_step_id, [fallback])
+                current_step_id = fallback
+                continue
+            self._end_step(ctx, metrics)
+
+            parent = self._record_step(step, state, ctx, branch, parent, parent_state, metrics)
+            parent_state = state
+
+            next_steps = await self._anext_steps(node, state)
+            self._notify_transition(ctx, current_step_id, next_steps)
+
+            if len(next_steps) > 1:
+                state, current_step_id = await self._afan_out(next_steps, state, ctx, branch, parent)
+                if current_step_id is None:
+                    if branch is None:
+                        self._log_termination(ctx, "all branches")
+                    return state, None
+                # The merged state is what the Merge step receives
+                joined_step_id = current_step_id
+                continue
+
+            current_step_id = next_steps[0]
+
+        return state, None
+
+    async def _afan_out(self, targets: List[str], state: StateSchema, ctx: RunContext[StateSchema],
+                        parent_branch: Optional[str] = None,
+                        parent: Optional[Snapshot[StateSchema]] = None):
+        """Asynchronous counterpart of _fan_out"""
+        logger.info("[StateMachine] Forking: %s", targets, extra={"run_id": ctx.run.run_id, "targets": targets})
+
+        branch_ids = [f"{parent_branch}/{t}" if parent_branch else t for t in targets]
+        branch_snapshots: List[List[Snapshot[StateSchema]]] = [[] for _ in targets]
+
+        results = await asyncio.gather(*[
+            self._aexecute(target, {**state}, replace(ctx, record=snapshots.append), branch_id, parent)
+            for target, snapshots, branch_id in zip(targets, branch_snapshots, branch_ids)
+        ])
+
+        return self._join(targets, state, results, branch_snapshots, ctx)
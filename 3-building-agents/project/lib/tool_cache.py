@@ -0,0 +1,264 @@
+import asyncio
+import functools
+import inspect
+import itertools
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from lib.cache import Cache, LRUCache, stable_hash
+
+
+_function_numbers: "weakref.WeakKeyDictionary[Callable, int]" = weakref.WeakKeyDictionary()
+_function_counter = itertools.count(1)
+_function_numbers_lock = threading.Lock()
+
+
+def tool_scope(func: Callable, name: Optional[str] = None) -> str:
+    """
+    Identity of a tool's results in a ToolCache: "module:name", from the
+    module defining the function. Functions made inside another function
+    (closures, tool factories), bound methods and other callables get "#n"
+    appended, a number unique to the object in this process, since several
+    of them can share a module and name but compute different things.
+    """
+    name = name or func.__name__
+    if inspect.isfunction(func) and "<locals>" not in func.__qualname__:
+        return f"{func.__module__}:{name}"
+    with _function_numbers_lock:
+        try:
+            number = _function_numbers.get(func)
+            if number is None:
+                number = _function_numbers[func] = next(_function_counter)
+        except TypeError:  # not weak-referenceable; the Tool keeps it alive
+            number = id(func)
+    return f"{getattr(func, '__module__', None)}:{name}#{number}"
+
+
+def resolve_scopes(module: str, names: Iterable[str]) -> Tuple[str, ...]:
+    """Scopes of the tools named by invalidates=: plain names are looked up
+    in `module`, the module of the invalidating tool; "module:name" is used
+    as given"""
+    return tuple(name if ":" in name else f"{module}:{name}" for name in names)
+
+
+class ToolCache:
+    """
+    Results of tool calls, reused for identical calls within a run and
+    across runs, sessions and agents.
+
+    Entries are keyed on the tool's scope (see tool_scope) and the canonical
+    JSON of its bound arguments, so f(1), f(x=1) and a defaulted f() share
+    one, while tools of the same name from different modules or factories
+    do not. Identical calls arriving while the first is still running wait
+    for its result instead of running again. Failures are never cached.
+
+    invalidate(scope) drops every result of a tool, e.g. after a tool that
+    mutates what it reads: results of calls that started before the
+    invalidation are no longer served. Invalidating "module:name" covers
+    the "#n" scopes of that name too. Invalidations are kept per process,
+    so a DiskCache shared by several processes should only hold the results
+    of pure tools.
+
+    Example:
+        >>> cache = ToolCache(DiskCache("tools.db"))
+        >>> @tool(ttl=60, cache=cache)
+        ... def check_stock_levels(item_name: str) -> str: ...
+        >>> @tool(invalidates=["check_stock_levels"], cache=cache)
+        ... def place_stock_order(item_name: str, quantity: int) -> str: ...
+    """
+
+    def __init__(self, cache: Optional[Cache] = None):
+        self.cache = cache if cache is not None else LRUCache(maxsize=4096)
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0  # calls that waited for an identical call in flight
+        self.invalidations = 0
+        self._invalidated: Dict[str, float] = {}  # scope -> time of its last invalidation
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"ToolCache({self.cache!r})"
+
+    @staticmethod
+    def key(scope: str, arguments: Dict[str, Any]) -> str:
+        return f"{scope}/{stable_hash(arguments)}"
+
+    def _invalidated_at(self, scope: str) -> float:
+        base = scope.split("#", 1)[0]
+        return max(self._invalidated.get(scope, 0.0), self._invalidated.get(base, 0.0))
+
+    def _lookup(self, scope: str, key: str) -> Tuple[bool, Any]:
+        entry = self.cache.get(key)
+        with self._lock:
+            # Entries are (time the call started, result); None results are cached too
+            hit = entry is not None and entry[0] > self._invalidated_at(scope)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit, entry[1] if hit else None
+
+    def _join(self, key: str) -> Tuple[bool, Future]:
+        # The first caller of a key runs it; the others get its future
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return False, future
+            future = self._inflight[key] = Future()
+            return True, future
+
+    def _settle(self, key: str, future: Future, started: float, ttl: Optional[float],
+                result: Any = None, error: Optional[BaseException] = None):
+        if error is None:
+            self.cache.set(key, (started, result), ttl)
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def call(self, scope: str, arguments: Dict[str, Any], compute: Callable[[], Any],
+             ttl: Optional[float] = None) -> Any:
+        """The cached result of a call, else compute() stored for ttl seconds
+        (None: until evicted or invalidated)"""
+        key = self.key(scope, arguments)
+        started = time.time()
+        hit, result = self._lookup(scope, key)
+        if hit:
+            return result
+        owner, future = self._join(key)
+        if not owner:
+            return future.result()
+        try:
+            result = compute()
+        except BaseException as e:
+            self._settle(key, future, started, ttl, error=e)
+            raise
+        self._settle(key, future, started, ttl, result)
+        return result
+
+    async def acall(self, scope: str, arguments: Dict[str, Any], compute: Callable[[], Awaitable[Any]],
+                    ttl: Optional[float] = None) -> Any:
+        """Asynchronous counterpart of call; identical calls from other threads
+        and event loops are deduplicated too"""
+        key = self.key(scope, arguments)
+        started = time.time()
+        hit, result = self._lookup(scope, key)
+        if hit:
+            return result
+        owner, future = self._join(key)
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await compute()
+        except BaseException as e:
+            self._settle(key, future, started, ttl, error=e)
+            raise
+        self._settle(key, future, started, ttl, result)
+        return result
+
+    def invalidate(self, *scopes: str):
+        """Stop serving the results of the tools of these scopes computed so far"""
+        now = time.time()
+        with self._lock:
+            self.invalidations += 1
+            for scope in scopes:
+                self._invalidated[scope] = now
+            # Later callers must not join a call that may read the old state
+            for key in list(self._inflight):
+                scope = key.split("/", 1)[0]
+                if scope in scopes or scope.split("#", 1)[0] in scopes:
+                    del self._inflight[key]
+
+    def clear(self):
+        self.cache.clear()
+        with self._lock:
+            self._invalidated.clear()
+            # Calls still running finish for their own callers; later ones recompute
+            self._inflight.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "deduplicated": self.deduplicated,
+                "invalidations": self.invalidations,
+            }
+
+
+_tool_cache: Optional[ToolCache] = None
+_tool_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> ToolCache:
+    """Process-wide ToolCache used by tools that do not name their own"""
+    global _tool_cache
+    with _tool_cache_lock:
+        if _tool_cache is None:
+            _tool_cache = ToolCache()
+        return _tool_cache
+
+
+def cached(func: Optional[Callable] = None, *,
+           pure: bool = False,
+           ttl: Optional[float] = None,
+           invalidates: Sequence[str] = (),
+           name: Optional[str] = None,
+           cache: Optional[ToolCache] = None):
+    """
+    Cache a plain function's calls in a ToolCache, for tools of other
+    frameworks (e.g. under smolagents' @tool). The wrapper keeps the
+    function's name, docstring and signature, and shares entries and
+    invalidations with a lib Tool of the same function and cache.
+
+    The wrapper sets __wrapped__, which inspect.getsource follows: a
+    smolagents tool serialized from its source (to_dict, save, push_to_hub,
+    remote executors) gets the undecorated function and runs uncached.
+    Caching applies to tools called in this process only.
+
+    Example:
+        >>> @tool  # smolagents
+        ... @cached(ttl=60)
+        ... def check_stock_levels(item_name: str, as_of_date: str) -> str: ...
+    """
+    def wrapper(f: Callable) -> Callable:
+        scope = tool_scope(f, name)
+        stale = resolve_scopes(f.__module__, invalidates)
+        signature = inspect.signature(f)
+
+        def tool_cache() -> ToolCache:
+            return cache if cache is not None else get_tool_cache()
+
+        def arguments(args, kwargs) -> Dict[str, Any]:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return dict(bound.arguments)
+
+        @functools.wraps(f)
+        def cached_call(*args, **kwargs):
+            try:
+                if pure or ttl is not None:
+                    return tool_cache().call(scope, arguments(args, kwargs), lambda: f(*args, **kwargs), ttl)
+                return f(*args, **kwargs)
+            finally:
+                if stale:
+                    tool_cache().invalidate(*stale)
+
+        return cached_call
+
+    return wrapper(func) if func else wrapper
@@ -1,34 +1,122 @@
+import asyncio
 import inspect
 import datetime
+import weakref
 from typing import (
-    Any, Callable, 
-    Literal, Optional, Union, TypeAlias,
+    Any, Callable, Dict, Sequence, Tuple,
+    Literal, Optional, Union,
     get_type_hints, get_origin, get_args,
 )
-from functools import wraps
-from openai.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall
+from dataclasses import dataclass
+from functools import partial
 
+from lib.tool_cache import ToolCache, get_tool_cache, resolve_scopes, tool_scope
+
+
+@dataclass(frozen=True, slots=True)
+class ToolCallFunction:
+    name: str
+    arguments: str  # JSON-encoded arguments, as written by the model
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class ToolCall:
+    """
+    A tool call requested by the model, with the attributes of OpenAI's
+    ChatCompletionMessageToolCall. Immutable and hashable, like the messages
+    holding it; OpenAI tool calls and plain dicts are converted by
+    model_validate, and `function` may be given as a dict.
+    """
+    id: str
+    function: ToolCallFunction
+    type: Literal["function"] = "function"
+
+    def __post_init__(self):
+        if isinstance(self.function, dict):
+            object.__setattr__(self, "function", ToolCallFunction(**self.function))
+
+    def model_dump(self, mode: Optional[str] = None, exclude_none: bool = False) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "function": {"name": self.function.name, "arguments": self.function.arguments},
+        }
+
+    @classmethod
+    def model_validate(cls, data: Any) -> 'ToolCall':
+        """Build a tool call from a dict or an OpenAI tool call, checking field types"""
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict):
+            # OpenAI's pydantic tool calls, from responses and older recordings
+            function = getattr(data, "function", None)
+            data = {
+                "id": getattr(data, "id", None),
+                "type": getattr(data, "type", None),
+                "function": {"name": getattr(function, "name", None), "arguments": getattr(function, "arguments", None)},
+            }
+        function = data.get("function")
+        if not isinstance(data.get("id"), str):
+            raise TypeError(f"ToolCall.id must be a string, not {type(data.get('id')).__name__}")
+        if data.get("type", "function") != "function":
+            raise ValueError(f"Unsupported tool call type: {data.get('type')!r}")
+        if not isinstance(function, dict) or not all(isinstance(function.get(k), str) for k in ("name", "arguments")):
+            raise TypeError("ToolCall.function must be a dict with string name and arguments")
+        return cls(id=data["id"], function=ToolCallFunction(function["name"], function["arguments"]))
 
-# Type alias for OpenAI's tool call implementation
-ToolCall: TypeAlias = ChatCompletionMessageToolCall
 
 class Tool:
+    # Signature, type hints and parameter schemas per function, computed once
+    _inspection_cache: "weakref.WeakKeyDictionary[Callable, Tuple[inspect.Signature, Dict, Tuple[dict, ...]]]" = weakref.WeakKeyDictionary()
+
     def __init__(
         self,
         func: Callable,
         name: Optional[str] = None,
-        description: Optional[str] = None
+        description: Optional[str] = None,
+        pure: bool = False,
+        ttl: Optional[float] = None,
+        invalidates: Sequence[str] = (),
+        cache: Optional[ToolCache] = None
     ):
         self.func = func
+        # async def tools are awaited natively by acall
+        self.is_async = inspect.iscoroutinefunction(func)
         self.name = name or func.__name__
         self.description = description or inspect.getdoc(func)
+        self.signature, self.type_hints, self.parameters = self._inspect(func)
+        # Built on first use by dict(); treat the returned schema as read-only
+        self._schema: Optional[dict] = None
+        # Results are reused when the tool is pure (same arguments, same
+        # result) or may be up to ttl seconds stale; calling the tool drops
+        # the cached results of the tools it invalidates
+        self.pure = pure
+        self.ttl = ttl
+        self.invalidates = tuple(invalidates)
+        self._cache = cache
+        # Entries are kept apart from other tools of the same name (see tool_scope);
+        # names in invalidates refer to tools of this function's module
+        self.scope = tool_scope(func, self.name)
+        self._stale = resolve_scopes(getattr(func, "__module__", None), self.invalidates)
+
+    def _inspect(self, func: Callable) -> Tuple[inspect.Signature, Dict, Tuple[dict, ...]]:
+        try:
+            return Tool._inspection_cache[func]
+        except (KeyError, TypeError):
+            pass
+
         self.signature = inspect.signature(func, eval_str=True)
         self.type_hints = get_type_hints(func)
-
-        self.parameters = [
+        parameters = tuple(
             self._build_param_schema(key, param)
             for key, param in self.signature.parameters.items()
-        ]
+        )
+        inspection = (self.signature, self.type_hints, parameters)
+        try:
+            Tool._inspection_cache[func] = inspection
+        except TypeError:
+            pass  # not weak-referenceable, e.g. a builtin
+        return inspection
 
     def _build_param_schema(self, name: str, param: inspect.Parameter):
         param_type = self.type_hints.get(name, str)
@@ -83,6 +171,11 @@ class Tool:
         return {"type": mapping.get(typ, "string")}
 
     def dict(self) -> dict:
+        if self._schema is None:
+            self._schema = self._build_schema()
+        return self._schema
+
+    def _build_schema(self) -> dict:
         return {
             "type": "function",
             "function": {
@@ -102,8 +195,49 @@ class Tool:
             }
         }
 
+    @property
+    def cached(self) -> bool:
+        return self.pure or self.ttl is not None
+
+    @property
+    def cache(self) -> ToolCache:
+        return self._cache if self._cache is not None else get_tool_cache()
+
+    def _arguments(self, args: tuple, kwargs: dict) -> Dict[str, Any]:
+        # Bound with defaults applied, so equivalent calls share a cache key
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return dict(bound.arguments)
+
     def __call__(self, *args, **kwargs):
-        return self.func(*args, **kwargs)
+        if self.is_async:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(self.acall(*args, **kwargs))
+            raise TypeError(f"Tool '{self.name}' is async. Use `await tool.acall(...)` inside an event loop.")
+        try:
+            if self.cached:
+                return self.cache.call(self.scope, self._arguments(args, kwargs), partial(self.func, *args, **kwargs), self.ttl)
+            return self.func(*args, **kwargs)
+        finally:
+            if self._stale:
+                self.cache.invalidate(*self._stale)
+
+    async def acall(self, *args, **kwargs):
+        """Call the tool from an event loop. Sync tools run in the default
+        executor so they do not block the loop."""
+        if self.is_async:
+            compute = partial(self.func, *args, **kwargs)
+        else:
+            compute = partial(asyncio.to_thread, partial(self.func, *args, **kwargs))
+        try:
+            if self.cached:
+                return await self.cache.acall(self.scope, self._arguments(args, kwargs), compute, self.ttl)
+            return await compute()
+        finally:
+            if self._stale:
+                self.cache.invalidate(*self._stale)
 
     def __repr__(self):
         return f"<Tool name={self.name} params={[p['name'] for p in self.parameters]}>"
@@ -114,12 +248,13 @@ class Tool:
 
 
 
-def tool(func=None, *, name: str = None, description: str = None):
+def tool(func=None, *, name: str = None, description: str = None,
+         pure: bool = False, ttl: Optional[float] = None,
+         invalidates: Sequence[str] = (), cache: Optional[ToolCache] = None):
+    # Works for plain and async def functions alike; Tool detects which
     def wrapper(f):
-        @wraps(f)
-        def wrapped(*args, **kwargs):
-            return f(*args, **kwargs)
-        return Tool(f, name=name, description=description)
+        return Tool(f, name=name, description=description,
+                    pure=pure, ttl=ttl, invalidates=invalidates, cache=cache)
     
     # @tool ou @tool(name="foo")
     return wrapper(func) if func else wrapper
\ No newline at end of file
@@ -0,0 +1,286 @@
+import csv
+import io
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, fields
+from typing import Callable, Dict, List, Optional, Sequence, TextIO, Tuple, Union
+
+from lib.instrumentation import current_step_metrics
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """USD per million tokens"""
+    input: float
+    output: float
+    cached_input: Optional[float] = None  # None when the model has no prompt-cache discount
+
+    def cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        # cached_tokens are the part of prompt_tokens served from the provider's prompt cache
+        cached_rate = self.cached_input if self.cached_input is not None else self.input
+        return (
+            (prompt_tokens - cached_tokens) * self.input
+            + cached_tokens * cached_rate
+            + completion_tokens * self.output
+        ) / 1_000_000
+
+
+# Standard-tier list prices. Dated snapshots ("gpt-4o-mini-2024-07-18") match
+# the longest model name they start with; add entries for other models here.
+PRICING: Dict[str, ModelPrice] = {
+    "gpt-4o-mini": ModelPrice(input=0.15, output=0.60, cached_input=0.075),
+    "gpt-4o": ModelPrice(input=2.50, output=10.00, cached_input=1.25),
+    "gpt-4.1-nano": ModelPrice(input=0.10, output=0.40, cached_input=0.025),
+    "gpt-4.1-mini": ModelPrice(input=0.40, output=1.60, cached_input=0.10),
+    "gpt-4.1": ModelPrice(input=2.00, output=8.00, cached_input=0.50),
+    "gpt-3.5-turbo": ModelPrice(input=0.50, output=1.50),
+    "text-embedding-3-small": ModelPrice(input=0.02, output=0.0),
+    "text-embedding-3-large": ModelPrice(input=0.13, output=0.0),
+}
+
+
+def model_price(model: str) -> Optional[ModelPrice]:
+    """Price of a model from PRICING, or None when it is not listed"""
+    if model in PRICING:
+        return PRICING[model]
+    matches = [name for name in PRICING if model.startswith(name)]
+    return PRICING[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """USD cost of a call; 0.0 for models missing from PRICING"""
+    price = model_price(model)
+    return price.cost(prompt_tokens, completion_tokens, cached_tokens) if price else 0.0
+
+
+# Labels (session_id, tool) attached to usage recorded in this thread or task
+_usage_labels: ContextVar[Dict[str, str]] = ContextVar("usage_labels", default={})
+
+
+@contextmanager
+def usage_scope(**labels: Optional[str]):
+    """
+    Attribute usage recorded inside the block to the given session_id and/or
+    tool. Scopes nest; inner labels override outer ones.
+
+    Example:
+        >>> with usage_scope(session_id="alice"):
+        ...     llm.invoke("Hello")
+    """
+    token = _usage_labels.set({**_usage_labels.get(), **{k: v for k, v in labels.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _usage_labels.reset(token)
+
+
+@dataclass
+class UsageRecord:
+    """Token usage and cost of one model call"""
+    timestamp: float
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    total_tokens: int = 0
+    cost: float = 0.0
+    run_id: Optional[str] = None
+    session_id: Optional[str] = None
+    step_id: Optional[str] = None
+    branch: Optional[str] = None
+    tool: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+@dataclass
+class UsageTotals:
+    """Sum of a group of UsageRecords"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    total_tokens: int = 0
+    cost: float = 0.0
+
+    def add(self, record: UsageRecord):
+        self.calls += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cached_tokens += record.cached_tokens
+        self.total_tokens += record.total_tokens
+        self.cost += record.cost
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+GroupKey = Union[str, Sequence[str]]
+
+
+class UsageLedger:
+    """
+    Thread-safe record of every model call's token usage and cost.
+
+    LLM records into the process-wide ledger (get_usage_ledger()) after each
+    API call. Records are attributed to the run and step executing at the
+    time, and to the session_id and tool of the enclosing usage_scope; Agent
+    opens those scopes for its sessions and tool calls. Costs come from
+    PRICING when the call is recorded.
+
+    The oldest records are discarded beyond max_records, so aggregates of a
+    long-lived process cover the most recent calls only.
+
+    Example:
+        >>> ledger = get_usage_ledger()
+        >>> for run_id, totals in ledger.by_run().items():
+        ...     print(run_id, totals.total_tokens, f"${totals.cost:.4f}")
+        >>> ledger.to_csv("usage.csv")
+    """
+
+    def __init__(self, max_records: Optional[int] = 100_000):
+        self.max_records = max_records
+        self._records: "deque[UsageRecord]" = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"UsageLedger(records={len(self._records)})"
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def record(self, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+               cached_tokens: int = 0, total_tokens: Optional[int] = None,
+               **labels: Optional[str]) -> UsageRecord:
+        """Record one call. run_id, step_id, branch, session_id and tool default
+        to the current step and usage_scope; pass them to override."""
+        metrics = current_step_metrics()
+        context = {
+            **_usage_labels.get(),
+            "run_id": metrics.run_id if metrics else None,
+            "step_id": metrics.step_id if metrics else None,
+            "branch": metrics.branch if metrics else None,
+        }
+        context.update({k: v for k, v in labels.items() if v is not None})
+        record = UsageRecord(
+            timestamp=time.time(),
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            total_tokens=total_tokens if total_tokens is not None else prompt_tokens + completion_tokens,
+            cost=estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+            **context,
+        )
+        with self._lock:
+            self._records.append(record)
+        return record
+
+    def records(self, **filters: Optional[str]) -> List[UsageRecord]:
+        """Records whose fields equal the given values, oldest first"""
+        with self._lock:
+            records = list(self._records)
+        if filters:
+            records = [r for r in records if all(getattr(r, k) == v for k, v in filters.items())]
+        return records
+
+    def totals(self, **filters: Optional[str]) -> UsageTotals:
+        """Totals of the records matching filters, e.g. totals(session_id="alice")"""
+        totals = UsageTotals()
+        for record in self.records(**filters):
+            totals.add(record)
+        return totals
+
+    def aggregate(self, by: GroupKey, **filters: Optional[str]) -> Dict[Union[str, Tuple], UsageTotals]:
+        """
+        Totals grouped by one record field, or by a tuple of fields.
+
+        Example:
+            >>> ledger.aggregate(by=("run_id", "step_id"), session_id="alice")
+        """
+        key: Callable[[UsageRecord], Union[str, Tuple]]
+        if isinstance(by, str):
+            key = lambda record: getattr(record, by)
+        else:
+            key = lambda record: tuple(getattr(record, field) for field in by)
+        groups: Dict[Union[str, Tuple], UsageTotals] = {}
+        for record in self.records(**filters):
+            groups.setdefault(key(record), UsageTotals()).add(record)
+        return groups
+
+    def by_model(self, **filters) -> Dict[str, UsageTotals]:
+        return self.aggregate("model", **filters)
+
+    def by_session(self, **filters) -> Dict[str, UsageTotals]:
+        return self.aggregate("session_id", **filters)
+
+    def by_run(self, **filters) -> Dict[str, UsageTotals]:
+        return self.aggregate("run_id", **filters)
+
+    def by_step(self, **filters) -> Dict[str, UsageTotals]:
+        return self.aggregate("step_id", **filters)
+
+    def by_tool(self, **filters) -> Dict[str, UsageTotals]:
+        return self.aggregate("tool", **filters)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def to_csv(self, file: Union[str, TextIO, None] = None) -> str:
+        """Write one row per record to a path or open file; also returns the CSV text"""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=[f.name for f in fields(UsageRecord)])
+        writer.writeheader()
+        for record in self.records():
+            writer.writerow(record.to_dict())
+        text = buffer.getvalue()
+        if isinstance(file, str):
+            with open(file, "w", newline="") as f:
+                f.write(text)
+        elif file is not None:
+            file.write(text)
+        return text
+
+    def to_prometheus(self, labels: Sequence[str] = ("model",), prefix: str = "llm") -> str:
+        """
+        Totals in the Prometheus text exposition format.
+
+        Every label adds a series per distinct value, so avoid high-cardinality
+        labels such as run_id for long-lived processes.
+        """
+        groups = self.aggregate(tuple(labels))
+        metrics = [
+            (f"{prefix}_calls_total", "counter", "Model calls", "calls"),
+            (f"{prefix}_prompt_tokens_total", "counter", "Prompt tokens", "prompt_tokens"),
+            (f"{prefix}_completion_tokens_total", "counter", "Completion tokens", "completion_tokens"),
+            (f"{prefix}_cached_tokens_total", "counter", "Prompt tokens served from the prompt cache", "cached_tokens"),
+            (f"{prefix}_cost_usd_total", "counter", "Estimated cost in USD", "cost"),
+        ]
+        lines = []
+        for name, kind, help_text, attribute in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for values, totals in sorted(groups.items(), key=lambda item: tuple(str(v) for v in item[0])):
+                label_text = ",".join(
+                    f'{label}="{_escape_label(value)}"' for label, value in zip(labels, values)
+                )
+                lines.append(f"{name}{{{label_text}}} {getattr(totals, attribute)}" if label_text
+                             else f"{name} {getattr(totals, attribute)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: Optional[str]) -> str:
+    return ("" if value is None else str(value)).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_default_ledger = UsageLedger()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """The process-wide ledger LLM records into"""
+    return _default_ledger
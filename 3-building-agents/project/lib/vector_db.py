@@ -3,12 +3,50 @@ from typing_extensions import TypedDict
 import chromadb
 from chromadb.utils import embedding_functions
 from chromadb.api.models.Collection import Collection as ChromaCollection
-from chromadb.api.types import EmbeddingFunction, QueryResult, GetResult
+from chromadb.api.types import Documents, Embeddings, EmbeddingFunction, QueryResult, GetResult
 
+from lib.batching import MicroBatcher
+from lib.rate_limit import RateLimiter, get_rate_limiter
 from lib.loaders import PDFLoader
 from lib.documents import Document, Corpus
 
 
+class BatchingEmbeddingFunction(EmbeddingFunction):
+    """
+    Embedding function that coalesces concurrent requests into one API call.
+
+    When many runs query the store from different threads (see
+    StateMachine.run_many), their query texts are embedded together in a
+    single request instead of one request each.
+    """
+
+    def __init__(self, embedding_function: EmbeddingFunction,
+                 max_batch_size: int = 256, max_wait: float = 0.01):
+        self.embedding_function = embedding_function
+        self._batcher = MicroBatcher(embedding_function, max_batch_size, max_wait)
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self._batcher(input)
+
+
+class RateLimitedEmbeddingFunction(EmbeddingFunction):
+    """
+    Embedding function whose API calls are admitted by a RateLimiter, so
+    concurrent ingestion and retrieval share the embedding model's request
+    and token limits instead of tripping 429s.
+    """
+
+    def __init__(self, embedding_function: EmbeddingFunction, rate_limiter: RateLimiter):
+        self.embedding_function = embedding_function
+        self.rate_limiter = rate_limiter
+
+    def __call__(self, input: Documents) -> Embeddings:
+        # Embeddings bill input tokens only; estimate four characters per token
+        tokens = sum(len(text) for text in input) // 4 + len(input)
+        with self.rate_limiter.limit(tokens):
+            return self.embedding_function(input)
+
+
 class VectorStore:
     """
     High-level interface for vector database operations using ChromaDB.
@@ -28,6 +66,15 @@ class VectorStore:
     def __init__(self, chroma_collection: ChromaCollection):
         self._collection = chroma_collection
 
+    def __cache_key__(self):
+        """Identify the indexed content, so cached retrievals miss after a re-index"""
+        # A recreated collection gets a new id; adding documents changes the count
+        return {
+            "name": self._collection.name,
+            "id": str(self._collection.id),
+            "count": self._collection.count(),
+        }
+
     def add(self, item: Union[Document, Corpus, List[Document]]):
         """
         Add documents to the vector store with automatic embedding generation.
@@ -154,14 +201,30 @@ class VectorStoreManager:
     - Store lifecycle management (create, get, delete)
     """
 
-    def __init__(self, openai_api_key: str):
+    def __init__(self, openai_api_key: str, batch_embeddings: bool = False,
+                 rate_limiter: Optional[Union[str, RateLimiter]] = None):
+        """
+        Args:
+            openai_api_key: Key for the OpenAI embeddings endpoint
+            batch_embeddings: Coalesce embedding requests made concurrently by
+                different threads into batched API calls
+            rate_limiter: Optional limiter, or name of a shared one, admitting
+                embedding API calls (each batch counts as one request)
+        """
         self.chroma_client = chromadb.Client()
-        self.embedding_function = self._create_embedding_function(openai_api_key)
+        self.embedding_function = self._create_embedding_function(openai_api_key, batch_embeddings, rate_limiter)
 
-    def _create_embedding_function(self, api_key: str) -> EmbeddingFunction:
+    def _create_embedding_function(self, api_key: str, batch_embeddings: bool = False,
+                                   rate_limiter: Optional[Union[str, RateLimiter]] = None) -> EmbeddingFunction:
         embeddings_fn = embedding_functions.OpenAIEmbeddingFunction(
             api_key=api_key
         )
+        if rate_limiter is not None:
+            if isinstance(rate_limiter, str):
+                rate_limiter = get_rate_limiter(rate_limiter)
+            embeddings_fn = RateLimitedEmbeddingFunction(embeddings_fn, rate_limiter)
+        if batch_embeddings:
+            return BatchingEmbeddingFunction(embeddings_fn)
         return embeddings_fn
 
     def __repr__(self):
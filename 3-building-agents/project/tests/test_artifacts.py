@@ -0,0 +1,35 @@
+from lib.artifacts import ArtifactStore, ToolResultPolicy
+from lib.context import TokenCounter
+
+
+class ByteEncoding:
+    """Tokenizer splitting UTF-8 text every three bytes, so tokens cut
+    through multi-byte characters as byte-level BPE tokens can"""
+    name = "bytes3"
+
+    def encode(self, text, disallowed_special=()):
+        data = text.encode("utf-8")
+        return [data[i:i + 3] for i in range(0, len(data), 3)]
+
+    def decode_bytes(self, tokens):
+        return b"".join(tokens)
+
+    def decode(self, tokens):
+        return self.decode_bytes(tokens).decode("utf-8", errors="replace")
+
+
+def test_spilled_head_lines_up_with_artifact():
+    counter = TokenCounter()
+    counter.encoding = ByteEncoding()
+    store = ArtifactStore(directory=None)
+    policy = ToolResultPolicy(max_tokens=40, store=store, counter=counter)
+    result = "Inventaire: " + "papier crème 🧾 日本語 " * 200
+    reduced = policy.apply("inventory_report", result)
+
+    head = reduced.split("\n[", 1)[0]
+    assert "�" not in head
+    assert result.startswith(head)
+
+    artifact_id = next(iter(store._memory))
+    page = store.read(artifact_id, offset=len(head), length=20)
+    assert page.startswith(result[len(head):len(head) + 20])
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from lib.batching import MicroBatcher
+
+
+def test_flushes_in_chunks_of_max_batch_size():
+    sizes = []
+
+    def double(items):
+        sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_batch_size=4, max_wait=0.05)
+    results = {}
+
+    def call(i: int):
+        results[i] = batcher([i] * 3)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: [i * 2] * 3 for i in range(5)}
+    assert max(sizes) <= 4
+    assert sum(sizes) == 15
+
+
+def test_lone_caller_does_not_wait():
+    batcher = MicroBatcher(lambda items: items, max_wait=10)
+    start = time.monotonic()
+    assert batcher([1, 2]) == [1, 2]
+    assert time.monotonic() - start < 1
+
+
+def test_base_exception_settles_every_caller():
+    entered, gate = threading.Event(), threading.Event()
+    calls = []
+
+    def fn(items):
+        calls.append(items)
+        if len(calls) == 1:
+            entered.set()
+            gate.wait(5)
+            return items
+        raise KeyboardInterrupt
+
+    batcher = MicroBatcher(fn, max_batch_size=2, max_wait=5)
+    outcomes = []
+
+    def call(i: int):
+        try:
+            outcomes.append(batcher([i]))
+        except BaseException as e:
+            outcomes.append(type(e))
+
+    first = threading.Thread(target=call, args=(0,))
+    first.start()
+    entered.wait(5)
+    # Both queue while the first call is in fn; the batch fills and fn raises
+    others = [threading.Thread(target=call, args=(i,)) for i in (1, 2)]
+    for thread in others:
+        thread.start()
+    for thread in others:
+        thread.join(timeout=5)
+    gate.set()
+    first.join(timeout=5)
+
+    assert not any(thread.is_alive() for thread in [first, *others])
+    assert sorted(map(str, outcomes)) == sorted(map(str, [[0], KeyboardInterrupt, RuntimeError]))
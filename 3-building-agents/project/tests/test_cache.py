@@ -0,0 +1,82 @@
+import threading
+from typing import List, TypedDict
+
+import pytest
+
+from lib.cache import LRUCache, stable_hash
+from lib.state_machine import EntryPoint, StateMachine, Step, Termination
+
+
+class RetrieveState(TypedDict):
+    question: str
+    documents: List[str]
+
+
+class Customer:
+    def __init__(self, customer_id: int):
+        self.customer_id = customer_id
+
+    def __cache_key__(self):
+        return self.customer_id
+
+
+def test_stable_hash_rejects_objects_without_deterministic_encoding():
+    with pytest.raises(TypeError):
+        stable_hash({"value": object()})
+
+
+def test_stable_hash_uses_cache_key():
+    assert stable_hash(Customer(7)) == stable_hash(Customer(7))
+    assert stable_hash(Customer(7)) != stable_hash(Customer(8))
+    assert stable_hash({3, 1, 2}) == stable_hash({2, 3, 1})
+
+
+def test_cache_counts_concurrent_lookups():
+    cache = LRUCache()
+    cache.set("key", "value")
+
+    def lookup():
+        for _ in range(1000):
+            cache.get("key")
+            cache.get("missing")
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (8000, 8000)
+
+
+class Store:
+    def __init__(self, name: str, documents: list):
+        self.name = name
+        self.documents = documents
+
+    def __cache_key__(self):
+        return {"name": self.name, "count": len(self.documents)}
+
+
+def retrieve_machine(store: Store, cache: LRUCache) -> StateMachine[RetrieveState]:
+    machine = StateMachine[RetrieveState](RetrieveState)
+    entry = EntryPoint[RetrieveState]()
+    retrieve = Step[RetrieveState]("retrieve", lambda state: {"documents": list(store.documents)},
+                                   reads=["question"], cache=cache, cache_salt=store)
+    termination = Termination[RetrieveState]()
+    machine.add_steps([entry, retrieve, termination])
+    machine.connect(entry, retrieve)
+    machine.connect(retrieve, termination)
+    return machine
+
+
+def test_step_cache_is_keyed_on_its_salt():
+    cache = LRUCache()
+    books, films = Store("books", ["dune"]), Store("films", ["alien"])
+    state = {"question": "scifi?", "documents": []}
+    assert retrieve_machine(books, cache).run(dict(state)).get_final_state()["documents"] == ["dune"]
+    assert retrieve_machine(films, cache).run(dict(state)).get_final_state()["documents"] == ["alien"]
+
+    # Re-indexing changes the store's key, so the stale retrieval is not reused
+    books.documents.append("foundation")
+    final = retrieve_machine(books, cache).run(dict(state)).get_final_state()
+    assert final["documents"] == ["dune", "foundation"]
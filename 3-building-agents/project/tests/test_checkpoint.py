@@ -0,0 +1,82 @@
+from typing import List, TypedDict
+
+import pytest
+
+from lib.checkpoint import FileCheckpointer, dumps_state, loads_state
+from lib.messages import AIMessage, ToolMessage
+from lib.resilience import StepPolicy
+from lib.state_machine import EntryPoint, Merge, StateMachine, Step, Termination
+from lib.tooling import ToolCall
+
+
+class TraceState(TypedDict):
+    trace: List[str]
+
+
+class Crash(Exception):
+    pass
+
+
+def visit(name: str, crashes: List[str] = None):
+    """Step logic appending name to the trace; raises Crash once if name is in crashes"""
+    def logic(state: TraceState) -> dict:
+        if crashes is not None and name in crashes:
+            crashes.remove(name)
+            raise Crash(name)
+        return {"trace": state["trace"] + [name]}
+    return logic
+
+
+def test_tool_call_messages_round_trip():
+    call = ToolCall(id="call_1", type="function",
+                    function={"name": "search", "arguments": '{"query": "zelda"}'})
+    state = {"messages": [AIMessage(content=None, tool_calls=[call]),
+                          ToolMessage(content="3 games", tool_call_id="call_1", name="search")]}
+    restored = loads_state(dumps_state(state))
+    assert restored == state
+    assert restored["messages"][0].content is None
+    assert restored["messages"][0].tool_calls[0].function.name == "search"
+
+
+def test_resume_follows_fallback_taken(tmp_path):
+    crashes = ["recover"]
+    machine = StateMachine[TraceState](TraceState, checkpointer=FileCheckpointer(str(tmp_path), fsync=False))
+    entry, termination = EntryPoint[TraceState](), Termination[TraceState]()
+    flaky = Step[TraceState]("flaky", lambda state: 1 / 0, policy=StepPolicy(fallback="recover"))
+    normal = Step[TraceState]("normal", visit("normal"))
+    recover = Step[TraceState]("recover", visit("recover", crashes))
+    machine.add_steps([entry, flaky, normal, recover, termination])
+    machine.connect(entry, flaky)
+    machine.connect(flaky, normal)
+    machine.connect(normal, termination)
+    machine.connect(recover, termination)
+
+    with pytest.raises(Crash):
+        machine.run({"trace": []})
+    (run_id,) = [path.stem for path in tmp_path.iterdir()]
+    run = machine.resume(run_id)
+    assert run.get_final_state()["trace"] == ["recover"]
+
+
+def test_load_run_skips_interrupted_branches(tmp_path):
+    crashes = ["join"]
+    checkpointer = FileCheckpointer(str(tmp_path), fsync=False)
+    machine = StateMachine[TraceState](TraceState, checkpointer=checkpointer)
+    entry, termination = EntryPoint[TraceState](), Termination[TraceState]()
+    a, b = Step[TraceState]("a", visit("a")), Step[TraceState]("b", visit("b"))
+    join = Merge[TraceState]("join", logic=visit("join", crashes))
+    machine.add_steps([entry, a, b, join, termination])
+    machine.connect(entry, [a, b])
+    machine.connect(a, join)
+    machine.connect(b, join)
+    machine.connect(join, termination)
+
+    with pytest.raises(Crash):
+        machine.run({"trace": []})
+    (run_id,) = [path.stem for path in tmp_path.iterdir()]
+    assert [s.step_id for s in checkpointer.load_run(run_id, TraceState).snapshots] == ["__entry__"]
+
+    machine.resume(run_id)
+    loaded = checkpointer.load_run(run_id, TraceState)
+    assert [s.step_id for s in loaded.snapshots] == ["__entry__", "a", "b", "join"]
+    assert loaded.end_timestamp is not None
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from lib.context import ContextManager, SUMMARY_PREFIX
+from lib.messages import AIMessage, SystemMessage, UserMessage
+
+
+def conversation(turns: int):
+    messages = [SystemMessage(content="You answer questions about video games.")]
+    for i in range(turns):
+        messages += [UserMessage(content=f"Question {i} about {'zelda' if i == 1 else 'mario'} " + "pad " * 30),
+                     AIMessage(content="An answer " * 20)]
+    return messages + [UserMessage(content="Tell me about zelda again")]
+
+
+def test_fit_leaves_history_intact():
+    messages = conversation(10)
+    history = list(messages)
+    fitted, usage = ContextManager(300).fit(messages)
+    assert len(fitted) == usage.messages_after < len(messages)
+    assert messages == history
+
+
+def test_summaries_are_reused_and_extended():
+    transcripts = []
+
+    def invoke(request):
+        transcripts.append(request[-1].content)
+        return AIMessage(content=f"summary {len(transcripts)}")
+
+    manager = ContextManager(300, strategy="summarize", llm=SimpleNamespace(invoke=invoke), summary_tokens=32)
+    messages = conversation(10)
+    first, _ = manager.fit(messages)
+    again, _ = manager.fit(messages)
+    assert len(transcripts) == 1
+    assert first[1] == again[1]
+
+    longer = messages + [AIMessage(content="An answer " * 20)] + conversation(2)[1:]
+    fitted, _ = manager.fit(longer)
+    assert len(transcripts) == 2
+    assert f"{SUMMARY_PREFIX}summary 1" in transcripts[1]
+    assert fitted[1].content == f"{SUMMARY_PREFIX}summary 2"
+
+
+def test_retrieve_embeds_each_turn_once():
+    embedded = []
+
+    def embed(text):
+        embedded.append(text)
+        return [text.count("zelda"), text.count("mario"), 1.0]
+
+    manager = ContextManager(300, strategy="retrieve", embed=embed)
+    messages = conversation(10)
+    fitted, _ = manager.fit(messages)
+    assert any("zelda" in (m.content or "") for m in fitted[1:-1])
+    calls = len(embedded)
+    manager.fit(messages + [AIMessage(content="More")])
+    assert len(embedded) == calls
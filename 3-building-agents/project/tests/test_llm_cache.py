@@ -0,0 +1,30 @@
+from lib.backends import LLMBackend
+from lib.llm import LLM
+from lib.llm_cache import CompletionCache
+from lib.messages import AIMessage, AIMessageChunk, TokenUsage
+from lib.usage import UsageLedger
+
+
+class EchoBackend(LLMBackend):
+    def __init__(self):
+        self.calls = 0
+
+    def complete(self, payload):
+        self.calls += 1
+        return AIMessage(content="hi", token_usage=TokenUsage(
+            prompt_tokens=10, completion_tokens=2, total_tokens=12))
+
+    def stream(self, payload):
+        message = self.complete(payload)
+        yield AIMessageChunk(content=message.content, message=message)
+
+
+def test_cache_hit_reports_no_token_usage():
+    backend = EchoBackend()
+    llm = LLM(backend=backend, cache=CompletionCache(), ledger=UsageLedger())
+    first = llm.invoke("hello")
+    second = llm.invoke("hello")
+    assert backend.calls == 1
+    assert first.token_usage.total_tokens == 12
+    assert second.content == "hi"
+    assert second.token_usage.total_tokens == 0
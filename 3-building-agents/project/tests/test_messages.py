@@ -0,0 +1,36 @@
+import dataclasses
+
+import pytest
+
+from lib.messages import AIMessage, UserMessage
+from lib.tooling import ToolCall
+
+
+def tool_call_message() -> AIMessage:
+    return AIMessage(content=None, tool_calls=[{"id": "call_1", "type": "function",
+                                                "function": {"name": "search", "arguments": "{}"}}])
+
+
+def test_messages_with_tool_calls_are_hashable_and_frozen():
+    message = tool_call_message()
+    assert isinstance(message.tool_calls[0], ToolCall)
+    assert hash(message) == hash(tool_call_message())
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        message.tool_calls[0].function.name = "delete_everything"
+
+
+@pytest.mark.parametrize("data", [
+    {"content": 42},
+    {"tool_calls": "search"},
+    {"tool_calls": [{"id": 1, "function": {"name": "search", "arguments": "{}"}}]},
+    {"tool_calls": [{"id": "call_1", "function": {"name": "search"}}]},
+])
+def test_model_validate_rejects_wrong_types(data):
+    with pytest.raises((TypeError, ValueError)):
+        AIMessage.model_validate(data)
+
+
+def test_model_validate_round_trip():
+    message = tool_call_message()
+    assert AIMessage.model_validate(message.model_dump()) == message
+    assert UserMessage.model_validate({"content": "Hi"}) == UserMessage(content="Hi")
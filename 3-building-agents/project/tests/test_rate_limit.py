@@ -0,0 +1,18 @@
+import pytest
+
+from lib.rate_limit import RateLimiter
+
+
+def test_failed_request_refunds_its_reservation():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    with pytest.raises(TimeoutError):
+        with limiter.limit(tokens=400):
+            raise TimeoutError()
+    assert limiter.tokens.available == pytest.approx(1000, abs=1)
+
+
+def test_recorded_usage_corrects_the_reservation():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    with limiter.limit(tokens=400) as permit:
+        permit.record_usage(100)
+    assert limiter.tokens.available == pytest.approx(900, abs=1)
@@ -0,0 +1,97 @@
+import operator
+from typing import List, TypedDict
+
+import pytest
+
+from lib.state_machine import EntryPoint, Merge, RunBudget, StateMachine, Step, Termination
+
+
+class LogState(TypedDict):
+    log: List[str]
+    note: str
+
+
+def append(name: str):
+    return lambda state: {"log": state["log"] + [name]}
+
+
+def fan_out_machine(*branches: str) -> StateMachine[LogState]:
+    machine = StateMachine[LogState](LogState)
+    entry = EntryPoint[LogState]()
+    join = Merge[LogState]("join", reducers={"log": operator.add})
+    termination = Termination[LogState]()
+    steps = [Step[LogState](name, append(name))
+             for name in branches]
+    machine.add_steps([entry, *steps, join, termination])
+    machine.connect(entry, steps)
+    for step in steps:
+        machine.connect(step, join)
+    machine.connect(join, termination)
+    return machine
+
+
+def test_merge_folds_each_branch_append_once():
+    machine = fan_out_machine("a", "b")
+    final = machine.run({"log": ["start"], "note": ""}).get_final_state()
+    assert final["log"] == ["start", "a", "b"]
+
+
+def test_merge_applies_reducer_to_single_changed_branch():
+    join = Merge[LogState]("join", reducers={"log": operator.add})
+    base = {"log": ["start"], "note": ""}
+    merged = join.reduce(base, [{"log": ["start", "a"], "note": ""}, dict(base)])
+    assert merged["log"] == ["start", "a"]
+
+
+def test_merge_without_reducer_keeps_last_branch():
+    join = Merge[LogState]("join")
+    base = {"log": ["start"], "note": ""}
+    merged = join.reduce(base, [{**base, "note": "a"}, {**base, "note": "b"}])
+    assert merged["note"] == "b"
+    assert merged["log"] == ["start"]
+
+
+def test_run_budget_fallback_is_a_compile_root():
+    machine = StateMachine[LogState](LogState)
+    entry = EntryPoint[LogState]()
+    loop = Step[LogState]("loop", append("loop"))
+    best_effort = Step[LogState]("best_effort", append("best_effort"))
+    termination = Termination[LogState]()
+    machine.add_steps([entry, loop, best_effort, termination])
+    machine.connect(entry, loop)
+    machine.connect(loop, [loop, termination],
+                    condition=lambda state: "termination" if len(state["log"]) > 10 else "loop")
+    machine.connect(best_effort, termination)
+
+    with pytest.raises(ValueError, match="unreachable"):
+        machine.compile()
+
+    budget = RunBudget(max_steps=3, on_exhausted="best_effort")
+    final = machine.run({"log": [], "note": ""}, budget=budget).get_final_state()
+    assert final["log"][-1] == "best_effort"
+    assert "best_effort" in machine.roots
+
+
+def test_merge_rejects_branch_replacing_reducer_list():
+    join = Merge[LogState]("join", reducers={"log": operator.add})
+    base = {"log": ["start", "a"], "note": ""}
+    with pytest.raises(ValueError, match="'log'"):
+        join.reduce(base, [{"log": ["start"], "note": ""}, {"log": ["start", "a", "b"], "note": ""}])
+
+
+def test_snapshots_keep_their_values_when_steps_return_new_ones():
+    machine = fan_out_machine("a")
+    run = machine.run({"log": ["start"], "note": ""})
+    logs = [s.state_data["log"] for s in run.snapshots]
+    # Steps build new lists, so the snapshots before step "a" still hold the old one
+    assert logs[0] == ["start"]
+    assert logs[-1] == ["start", "a"]
+
+
+def test_run_copy_shares_snapshots():
+    run = fan_out_machine("a").run({"log": ["start"], "note": ""})
+    stored = run.copy()
+    assert stored.snapshots == run.snapshots
+    assert all(a is b for a, b in zip(stored.snapshots, run.snapshots))
+    stored.add_snapshot(stored.snapshots[-1])
+    assert len(run.snapshots) == len(stored.snapshots) - 1
@@ -0,0 +1,71 @@
+import threading
+
+from lib.tool_cache import ToolCache
+from lib.tooling import Tool, tool
+
+cache = ToolCache()
+stock = {"A4": 10}
+
+
+@tool(ttl=60, cache=cache)
+def check_stock_levels(item_name: str) -> str:
+    """Stock level of an item"""
+    return f"{item_name}: {stock[item_name]}"
+
+
+@tool(invalidates=["check_stock_levels"], cache=cache)
+def place_stock_order(item_name: str, quantity: int) -> str:
+    """Order more of an item"""
+    stock[item_name] += quantity
+    return "ordered"
+
+
+def report_tool(prefix: str) -> Tool:
+    def report(query: str) -> str:
+        """Report on a query"""
+        return f"{prefix}: {query}"
+    return Tool(report, pure=True, cache=cache)
+
+
+def test_same_named_tools_do_not_share_results():
+    sales, stock_report = report_tool("sales"), report_tool("stock")
+    assert sales("paper") == "sales: paper"
+    assert stock_report("paper") == "stock: paper"
+
+
+def test_invalidation_is_scoped_to_the_tool():
+    # A tool of the same name from another module
+    other_scope = "warehouse.tools:check_stock_levels"
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "elsewhere"
+
+    assert check_stock_levels("A4") == "A4: 10"
+    cache.call(other_scope, {"item_name": "A4"}, compute, 60)
+    place_stock_order("A4", 5)
+    assert check_stock_levels("A4") == "A4: 15"
+    cache.call(other_scope, {"item_name": "A4"}, compute, 60)
+    assert len(calls) == 1
+
+
+def test_clear_drops_calls_in_flight():
+    local = ToolCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return len(calls)
+
+    thread = threading.Thread(target=local.call, args=("m:slow", {}, slow))
+    thread.start()
+    started.wait(5)
+    local.clear()
+    # A call after clear() recomputes instead of joining the one in flight
+    assert local.call("m:slow", {}, lambda: "fresh") == "fresh"
+    release.set()
+    thread.join(5)
@@ -595,7 +595,11 @@ def search_quote_history(search_terms: List[str], limit: int = 5) -> List[Dict]:
 import re
 import json
 import yaml
+import inspect
+import functools
+import threading
 import importlib.resources
+from collections import OrderedDict
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from smolagents import ToolCallingAgent, OpenAIServerModel, tool
@@ -612,8 +616,121 @@ model = OpenAIServerModel(
  and apply criteria to them to ensure that the flow of the system is correct."""
 
 
+class ToolResultCache:
+    """
+    Results of tool calls shared by every agent, keyed on the tool name and
+    its arguments as canonical JSON. Agents repeat the same reads within and
+    across requests (the inventory prompt checks the reorder status of every
+    item each time), and those are answered once until a tool writing
+    transactions invalidates them.
+
+    Keys (module:tool name plus the arguments) and invalidation by start
+    time follow lib.tool_cache.ToolCache of 3-building-agents, whose lib
+    this file runs without. It is a simpler cache: at most maxsize results
+    are kept, least recently used first out, and identical calls running
+    at the same time are each computed.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (started, expires_at, result)
+        self._invalidated: Dict[str, float] = {}  # module:tool name -> time of its last invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope: str, key: str):
+        """Return (hit, result)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            valid = entry is not None and entry[0] > self._invalidated.get(scope, 0.0) \
+                and (entry[1] is None or entry[1] > time.time())
+            if valid:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[2]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: str, started: float, result, ttl: Union[float, None]):
+        with self._lock:
+            self._entries[key] = (started, started + ttl if ttl is not None else None, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *scopes: str):
+        now = time.time()
+        with self._lock:
+            for scope in scopes:
+                self._invalidated[scope] = now
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidated.clear()
+
+
+tool_cache = ToolResultCache()
+
+
+def cached_tool(pure: bool = False, ttl: Union[float, None] = None, invalidates: List[str] = ()):
+    """
+    Cache a tool's results in `tool_cache`: forever when pure, else for ttl
+    seconds. Tools that change the database list the tools whose results
+    they make stale in `invalidates`. Goes under @tool, which still sees the
+    function's name, signature and docstring.
+
+    The wrapper sets __wrapped__, which inspect.getsource follows, so a tool
+    serialized from its source (Tool.to_dict, save, push_to_hub or a remote
+    executor) is the undecorated function and runs uncached. Caching only
+    applies to the tools called in this process.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        # Keyed per module, so a same-named tool elsewhere never shares results
+        scope = f"{func.__module__}:{func.__name__}"
+        stale = [f"{func.__module__}:{name}" for name in invalidates]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                if not pure and ttl is None:
+                    return func(*args, **kwargs)
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = f"{scope}/{json.dumps(bound.arguments, sort_keys=True, default=str)}"
+                hit, result = tool_cache.get(scope, key)
+                if hit:
+                    return result
+                started = time.time()
+                result = func(*args, **kwargs)
+                # The tools report failures as "Error ..." results; those are retried
+                if not (isinstance(result, str) and result.startswith("Error")):
+                    tool_cache.set(key, started, result, ttl)
+                return result
+            finally:
+                if stale:
+                    tool_cache.invalidate(*stale)
+
+        return wrapper
+    return decorator
+
+
+# Tools reading stock or cash, made stale by new transactions
+STOCK_READERS = [
+    "check_stock_levels",
+    "check_reorder_status",
+    "get_full_inventory_report",
+    "check_cash_balance",
+    "get_company_financials",
+    "get_pricing_and_availability",
+]
+
+
 # Tools for inventory agent
 @tool
+@cached_tool(ttl=600)
 def check_stock_levels(item_name: str, as_of_date: str) -> str:
     """
     Checks the stock level for a given item.
@@ -629,6 +746,7 @@ def check_stock_levels(item_name: str, as_of_date: str) -> str:
     return stock_level.to_string()
 
 @tool
+@cached_tool(ttl=600)
 def check_reorder_status(item_name: str, as_of_date: str) -> str:
     """
     Checks if an item needs to be reordered by comparing the current stock to the minimum stock level.
@@ -659,6 +777,7 @@ def check_reorder_status(item_name: str, as_of_date: str) -> str:
         return f"Item {item_name} is sufficiently stocked. Current stock: {current_stock}, Minimum stock: {min_stock_level}."
 
 @tool
+@cached_tool(invalidates=STOCK_READERS)
 def place_stock_order(item_name: str, quantity: int, price: float, date: str) -> str:
     """
     Place a stock order for a certain quantity of items at a given price and date.
@@ -679,6 +798,7 @@ def place_stock_order(item_name: str, quantity: int, price: float, date: str) ->
         return f"Error placing stock order: {e}"
 
 @tool
+@cached_tool(ttl=600)
 def get_full_inventory_report(as_of_date: str) -> str:
     """
     Generates inventory report of all items and their current stock levels for a given date.
@@ -695,6 +815,7 @@ def get_full_inventory_report(as_of_date: str) -> str:
     return pd.DataFrame.from_dict(inventory_dict, orient='index', columns=['stock']).to_string()
 
 @tool
+@cached_tool(ttl=600)
 def check_cash_balance(as_of_date: str) -> str:
     """
     Checks company's current cash balance.
@@ -709,6 +830,7 @@ def check_cash_balance(as_of_date: str) -> str:
     return f"The current cash balance is ${balance:.2f}."
 
 @tool
+@cached_tool(ttl=600)
 def get_company_financials(as_of_date: str) -> str:
     """
     Generates company financial report.
@@ -730,6 +852,7 @@ def get_company_financials(as_of_date: str) -> str:
 
 # Tools for quoting agent
 @tool
+@cached_tool(pure=True)
 def quote_history(customer_request: str) -> str:
     """
     Search for historic quotes based on customer's request.
@@ -763,6 +886,7 @@ def quote_history(customer_request: str) -> str:
 
 
 @tool
+@cached_tool(ttl=600)
 def get_pricing_and_availability(item_name: str, quantity: int, as_of_date: str) -> str:
     """
     Get the current price, availability, and estimated delivery date for a given item and quantity.
@@ -849,6 +973,7 @@ def apply_commission_and_discount(base_quote_str: str, discount_rate: float) ->
 
 # Tools for ordering agent
 @tool
+@cached_tool(invalidates=STOCK_READERS)
 def finalize_order(item_name: str, quantity: int, price: float, date: str) -> str:
     """
     Finalize a customer's order by creating a sales transaction.
@@ -1518,6 +1643,7 @@ def run_test_scenarios():
     
     print("Initializing Database...")
     init_database(db_engine)
+    tool_cache.clear()
     try:
         quote_requests_sample = pd.read_csv("data/quote_requests_sample.csv")
         quote_requests_sample["request_date"] = pd.to_datetime(